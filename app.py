@@ -18,7 +18,10 @@ sys.path.append(os.path.join(os.path.dirname(__file__), 'ocr'))
 
 from models_config import stanford_model
 from log_analysis import first_pass, second_pass
-from match_results import link_json
+from match_results import link_rows, page_json_files
+from case_store import CaseStore
+from memory_budget import PageCache
+from pdf_pages import render_page
 import subprocess
 from PIL import Image
 import fitz  # PyMuPDF for PDF rendering
@@ -86,35 +89,50 @@ def load_model():
     """Load the Stanford model (cached for performance)"""
     return stanford_model
 
-def pdf_to_images(pdf_path, dpi=150):
-    """Convert PDF to images for preview"""
+@st.cache_resource
+def load_case_store():
+    """Documents, passes and results of every case (logs/cases.db)"""
+    return CaseStore()
+
+@st.cache_resource
+def load_page_cache():
+    """Rendered preview pages, shared by every session; evicted under the memory budget"""
+    return PageCache(max_mb=256)
+
+def pdf_page_count(pdf_path):
     try:
-        doc = fitz.open(pdf_path)
-        images = []
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            pix = page.get_pixmap(dpi=dpi)
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            images.append(img)
-        doc.close()
-        return images
+        with fitz.open(pdf_path) as doc:
+            return doc.page_count
     except Exception as e:
-        st.error(f"Error converting PDF to images: {str(e)}")
-        return []
+        st.error(f"Error opening PDF: {str(e)}")
+        return 0
 
-def load_original_document(file_path):
-    """Load original document for display"""
+def render_pdf_page(pdf_path, page_index, dpi=150):
+    """One PDF page as an image for preview, rendered only when shown"""
+    render = lambda: render_page(pdf_path, page_index + 1, dpi=dpi, backend="pymupdf")
+    # the modification time keeps a re-written PDF from showing stale pages
+    key = (pdf_path, os.path.getmtime(pdf_path), page_index, dpi)
+    return load_page_cache().get(key, render)
+
+def document_page_count(file_path):
+    """Pages of a document that can be previewed"""
     file_ext = file_path.split('.')[-1].lower()
     
     if file_ext == 'pdf':
-        return pdf_to_images(file_path)
+        return pdf_page_count(file_path)
     elif file_ext in ['png', 'jpg', 'jpeg']:
-        return [Image.open(file_path)]
+        return 1
     elif file_ext == 'dcm':
         # For DICOM, you'd need pydicom rendering
         st.info("DICOM preview not yet implemented")
-        return []
-    return []
+        return 0
+    return 0
+
+def document_page(file_path, page_index):
+    """One page of a document for display"""
+    if file_path.split('.')[-1].lower() == 'pdf':
+        return render_pdf_page(file_path, page_index)
+    return Image.open(file_path)
 
 def generate_redaction_preview(original_path, anonymized_text):
     """Store anonymized text for preview (text-based, not images)"""
@@ -204,6 +222,8 @@ elif st.session_state.stage == 'ocr':
                 
                 if st.button("Proceed to First Pass", type="primary"):
                     st.session_state.stage = 'first_pass'
+                    # a new document: analyze it again in the first pass stage
+                    st.session_state.first_pass_results = None
                     st.rerun()
                     
         except Exception as e:
@@ -225,29 +245,32 @@ elif st.session_state.stage == 'first_pass':
     
     with st.spinner("Analyzing text for PHI..."):
         try:
-            anonymized, grouped_names, next_doc_id = first_pass(
-                model, 
-                st.session_state.ocr_text,
-                doc_id=1,
-                case=st.session_state.case_name
-            )
-            
-            st.session_state.first_pass_results = {
-                'anonymized': anonymized,
-                'grouped_names': grouped_names,
-                'next_doc_id': next_doc_id
-            }
-            
-            # Load results JSON
-            results_dir = f"logs/{st.session_state.case_name}/1/"
-            # Store anonymized text for review
-            st.session_state.redacted_text = st.session_state.first_pass_results['anonymized']
-            
-            results_files = [f for f in os.listdir(results_dir) if f.startswith('results_')]
-            if results_files:
-                with open(os.path.join(results_dir, results_files[0]), 'r') as f:
-                    results_data = json.load(f)
-                    st.session_state.first_pass_results['entities'] = results_data
+            store = load_case_store()
+            # Streamlit reruns this block on every interaction; the document and its first
+            # pass are stored once per upload and reused afterwards
+            if st.session_state.first_pass_results is None:
+                doc_id = store.add_document(st.session_state.case_name, st.session_state.base_name)
+                anonymized, grouped_names, _ = first_pass(
+                    model, 
+                    st.session_state.ocr_text,
+                    doc_id=doc_id,
+                    case=st.session_state.case_name,
+                    store=store
+                )
+                
+                st.session_state.first_pass_results = {
+                    'anonymized': anonymized,
+                    'grouped_names': grouped_names,
+                    'doc_id': doc_id
+                }
+                
+                # Store anonymized text for review
+                st.session_state.redacted_text = st.session_state.first_pass_results['anonymized']
+                
+                # Load results from the case store
+                record = store.get_pass(doc_id, "first")
+                st.session_state.first_pass_results['entities'] = record['results'] if record else []
+            results_data = st.session_state.first_pass_results['entities']
             
             st.success(f"✓ First pass completed! Detected {len(results_data)} entities.")
             
@@ -272,20 +295,20 @@ elif st.session_state.stage == 'review':
     st.subheader("📄 Document Comparison")
     
     # Display original document and redacted text side by side
-    original_images = load_original_document(st.session_state.uploaded_file_path)
+    original_pages = document_page_count(st.session_state.uploaded_file_path)
     redacted_text = st.session_state.get('redacted_text', '')
     
     col_orig, col_redact = st.columns(2)
     
     with col_orig:
         st.markdown("**Original Document**")
-        if original_images:
+        if original_pages:
             page_selector = st.selectbox(
                 "Select Page",
-                range(1, len(original_images) + 1),
+                range(1, original_pages + 1),
                 format_func=lambda x: f"Page {x}"
             )
-            st.image(original_images[page_selector - 1], width="stretch")
+            st.image(document_page(st.session_state.uploaded_file_path, page_selector - 1), width="stretch")
         else:
             st.info("Original document preview not available")
     
@@ -366,18 +389,21 @@ elif st.session_state.stage == 'second_pass':
             deny_list = st.session_state.corrections['deny_list']
             allow_list = st.session_state.corrections['allow_list']
             
-            anonymized, grouped_names, final_doc_id = second_pass(
+            # the second pass is recorded against the same document as the first
+            doc_id = st.session_state.first_pass_results['doc_id']
+            anonymized, grouped_names, _ = second_pass(
                 model,
                 st.session_state.ocr_text,
                 case=st.session_state.case_name,
-                doc_id=st.session_state.first_pass_results['next_doc_id'],
+                doc_id=doc_id,
                 allow_list=allow_list,
-                deny_list=deny_list
+                deny_list=deny_list,
+                store=load_case_store()
             )
             
             st.session_state.final_results = {
                 'anonymized_text': anonymized,
-                'doc_id': final_doc_id - 1
+                'doc_id': doc_id
             }
             
             st.success("✓ Second pass completed!")
@@ -392,21 +418,21 @@ elif st.session_state.stage == 'second_pass':
                     # Link results to OCR output
                     doc_id = st.session_state.final_results['doc_id']
                     case = st.session_state.case_name
-                    results_dir = f"logs/{case}/{doc_id}"
-                    results_files = [f for f in os.listdir(results_dir) if f.startswith('results_')]
+                    store = load_case_store()
+                    record = store.get_pass(doc_id, "second")
                     
-                    if results_files:
-                        results_path = os.path.join(results_dir, results_files[0])
+                    if record:
                         ocr_base_path = f"model-testing/transformer/ocr_output/{st.session_state.base_name}"
                         
                         if os.path.exists(ocr_base_path):
-                            st.info(f"Linking results: {results_path} to OCR: {ocr_base_path}")
+                            store.add_artifact(doc_id, "ocr_dir", ocr_base_path)
+                            st.info(f"Linking {len(record['results'])} results to OCR: {ocr_base_path}")
                             
                             # Check what JSON files exist in OCR directory
-                            ocr_files = [f for f in os.listdir(ocr_base_path) if f.endswith('_ocr.json')]
-                            st.info(f"Found OCR JSON files: {ocr_files}")
+                            ocr_files = page_json_files(ocr_base_path)
+                            st.info(f"Found OCR JSON files: {[os.path.basename(f) for f in ocr_files]}")
                             
-                            link_json(ocr_base_path, results_path)
+                            link_rows(record['results'], ocr_files)
                             st.success("✓ Results linked to OCR data")
                     
                     # Run output_layout.py to burn redactions onto PDF
@@ -444,6 +470,7 @@ elif st.session_state.stage == 'second_pass':
                                 
                                 if os.path.exists(output_pdf_path):
                                     st.session_state.final_pdf_path = output_pdf_path
+                                    store.add_artifact(doc_id, "redacted_pdf", output_pdf_path)
                                     st.success("✓ Final redacted PDF generated!")
                                 else:
                                     # Check if _deid.png files were created
@@ -481,11 +508,10 @@ elif st.session_state.stage == 'output':
     
     doc_id = st.session_state.final_results['doc_id']
     case = st.session_state.case_name
-    results_dir = f"logs/{case}/{doc_id}"
+    store = load_case_store()
     
-    # Find files
-    anonymized_files = [f for f in os.listdir(results_dir) if f.startswith('anonymized_text_')]
-    results_files = [f for f in os.listdir(results_dir) if f.startswith('results_')]
+    # Latest second pass over this document
+    record = store.get_pass(doc_id, "second")
     
     # Primary download - Redacted PDF
     st.subheader("📄 Primary Output")
@@ -501,9 +527,17 @@ elif st.session_state.stage == 'output':
         
         # Show preview
         with st.expander("Preview Redacted Document"):
-            pdf_images = pdf_to_images(st.session_state.final_pdf_path)
-            for i, img in enumerate(pdf_images):
-                st.image(img, caption=f"Page {i+1}", width="stretch")
+            # one page at a time: a long scan would otherwise be rendered whole on every rerun
+            redacted_pages = pdf_page_count(st.session_state.final_pdf_path)
+            if redacted_pages:
+                redacted_page = st.selectbox(
+                    "Select Page",
+                    range(1, redacted_pages + 1),
+                    format_func=lambda x: f"Page {x}",
+                    key="redacted_page_selector"
+                )
+                st.image(render_pdf_page(st.session_state.final_pdf_path, redacted_page - 1),
+                         caption=f"Page {redacted_page}", width="stretch")
     else:
         st.warning("Redacted PDF not available. Download text output below.")
     
@@ -514,37 +548,33 @@ elif st.session_state.stage == 'output':
     
     with col1:
         st.markdown("**Anonymized Text**")
-        if anonymized_files:
-            with open(os.path.join(results_dir, anonymized_files[0]), 'r') as f:
-                st.download_button(
-                    label="Download Text",
-                    data=f.read(),
-                    file_name=f"anonymized_{st.session_state.case_name}.txt",
-                    mime="text/plain"
-                )
+        if record:
+            st.download_button(
+                label="Download Text",
+                data=record['anonymized_text'],
+                file_name=f"anonymized_{st.session_state.case_name}.txt",
+                mime="text/plain"
+            )
     
     with col2:
         st.markdown("**Detection Results**")
-        if results_files:
-            with open(os.path.join(results_dir, results_files[0]), 'r') as f:
-                st.download_button(
-                    label="Download JSON",
-                    data=f.read(),
-                    file_name=f"results_{st.session_state.case_name}.json",
-                    mime="application/json"
-                )
+        if record:
+            st.download_button(
+                label="Download JSON",
+                data=json.dumps(record['results'], ensure_ascii=False),
+                file_name=f"results_{st.session_state.case_name}.json",
+                mime="application/json"
+            )
     
     with col3:
         st.markdown("**Parameters**")
-        params_file = os.path.join(results_dir, 'params.txt')
-        if os.path.exists(params_file):
-            with open(params_file, 'r') as f:
-                st.download_button(
-                    label="Download Params",
-                    data=f.read(),
-                    file_name=f"params_{st.session_state.case_name}.txt",
-                    mime="text/plain"
-                )
+        if record:
+            st.download_button(
+                label="Download Params",
+                data=json.dumps(record['params'], ensure_ascii=False, indent=2),
+                file_name=f"params_{st.session_state.case_name}.json",
+                mime="application/json"
+            )
     
     st.divider()
     
@@ -566,7 +596,7 @@ elif st.session_state.stage == 'output':
             st.rerun()
     
     with col_b:
-        st.markdown(f"**Results saved in:** `{results_dir}`")
+        st.markdown(f"**Results saved in:** `{store.path}` (case `{case}`, document {doc_id})")
 
 # Footer
 st.sidebar.divider()
@@ -0,0 +1,207 @@
+import os
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional
+
+# Embedded store of everything a case produced, so looking up or aggregating results
+# never walks logs/{case}/... :
+#
+#   documents  one row per document added to a case; its id replaces the hand-counted doc_id
+#   passes     one row per first_pass/second_pass call: params, anonymized text
+#   results    the results rows of a pass (see span_record.SpanRecord.to_row)
+#   artifacts  files produced for a document (OCR output dir, redacted PDF, ...)
+#
+# The run logs in logs/{case}/ (run_log.py) remain the append-only record of every call.
+
+DEFAULT_PATH = os.path.join("logs", "cases.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    case_name   TEXT NOT NULL,
+    name        TEXT,
+    created     TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS documents_case ON documents (case_name);
+
+CREATE TABLE IF NOT EXISTS passes (
+    id              INTEGER PRIMARY KEY AUTOINCREMENT,
+    document_id     INTEGER NOT NULL REFERENCES documents (id),
+    pass            TEXT NOT NULL,
+    ts              TEXT NOT NULL,
+    params          TEXT NOT NULL,
+    anonymized_text TEXT NOT NULL,
+    entity_count    INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS passes_document_pass ON passes (document_id, pass, id);
+
+CREATE TABLE IF NOT EXISTS results (
+    pass_id       INTEGER NOT NULL REFERENCES passes (id),
+    entity_type   TEXT NOT NULL,
+    start         INTEGER NOT NULL,
+    "end"         INTEGER NOT NULL,
+    score         REAL NOT NULL,
+    text          TEXT,
+    left_context  TEXT,
+    right_context TEXT,
+    replacement   TEXT
+);
+CREATE INDEX IF NOT EXISTS results_pass ON results (pass_id, start);
+CREATE INDEX IF NOT EXISTS results_type ON results (entity_type);
+
+CREATE TABLE IF NOT EXISTS artifacts (
+    document_id INTEGER NOT NULL REFERENCES documents (id),
+    kind        TEXT NOT NULL,
+    path        TEXT NOT NULL,
+    created     TEXT NOT NULL,
+    PRIMARY KEY (document_id, kind)
+);
+"""
+
+_RESULT_COLUMNS = ("entity_type", "start", "end", "score", "text", "left_context", "right_context", "replacement")
+
+
+class CaseStore:
+    """
+    SQLite store of documents, passes, results and artifacts, indexed on case,
+    document and pass.
+
+    One connection is shared by the threads of a process (Streamlit reruns the script on
+    different threads) and serialized with a lock; WAL mode lets other processes read
+    while a pass is being written.
+    """
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA foreign_keys=ON")
+            self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # --- writes ---
+
+    def add_document(self, case, name=None) -> int:
+        """ Registers a document in case and returns its id """
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO documents (case_name, name, created) VALUES (?, ?, ?)",
+                (str(case), name, _now()))
+        return cursor.lastrowid
+
+    def record_pass(self, doc_id, pass_name, anonymized_text, rows: Iterable[dict], params: dict) -> int:
+        """ Stores one pass over a document with its results rows (consumed one at a time);
+        returns the pass id """
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO passes (document_id, pass, ts, params, anonymized_text, entity_count) "
+                "VALUES (?, ?, ?, ?, ?, 0)",
+                (doc_id, pass_name, _now(), json.dumps(params, ensure_ascii=False), anonymized_text))
+            pass_id = cursor.lastrowid
+            cursor = self._conn.executemany(
+                'INSERT INTO results (pass_id, entity_type, start, "end", score, text, left_context, '
+                'right_context, replacement) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                ((pass_id, *(row.get(column) for column in _RESULT_COLUMNS)) for row in rows))
+            self._conn.execute("UPDATE passes SET entity_count = ? WHERE id = ?", (max(cursor.rowcount, 0), pass_id))
+        return pass_id
+
+    def add_artifact(self, doc_id, kind, path) -> None:
+        """ Records (or replaces) the file of the given kind produced for a document """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO artifacts (document_id, kind, path, created) VALUES (?, ?, ?, ?)",
+                (doc_id, kind, path, _now()))
+
+    # --- lookups ---
+
+    def get_pass(self, doc_id, pass_name=None) -> Optional[dict]:
+        """
+        Latest pass over doc_id (of pass_name, if given) as
+        {"id", "doc_id", "pass", "ts", "params", "anonymized_text", "results"}; None if absent.
+        """
+        query = "SELECT * FROM passes WHERE document_id = ?"
+        args = [doc_id]
+        if pass_name is not None:
+            query += " AND pass = ?"
+            args.append(pass_name)
+        with self._lock:
+            row = self._conn.execute(query + " ORDER BY id DESC LIMIT 1", args).fetchone()
+            if row is None:
+                return None
+            results = self._conn.execute(
+                'SELECT entity_type, start, "end", score, text, left_context, right_context, replacement '
+                "FROM results WHERE pass_id = ? ORDER BY start", (row["id"],)).fetchall()
+        return {
+            "id": row["id"],
+            "doc_id": row["document_id"],
+            "pass": row["pass"],
+            "ts": row["ts"],
+            "params": json.loads(row["params"]),
+            "anonymized_text": row["anonymized_text"],
+            "results": [dict(r) for r in results],
+        }
+
+    def iter_passes(self, case=None, pass_name="second") -> Iterator[dict]:
+        """ The latest pass_name over every document (of one case, or of every case), as
+        get_pass records with "case" added, in document order """
+        query = ("SELECT d.case_name, MAX(p.id) AS id, p.document_id FROM passes p JOIN documents d "
+                 "ON d.id = p.document_id WHERE p.pass = ?" + (" AND d.case_name = ?" if case is not None else "") +
+                 " GROUP BY p.document_id ORDER BY p.document_id")
+        args = (pass_name, str(case)) if case is not None else (pass_name,)
+        for latest in self._query(query, args):
+            record = self.get_pass(latest["document_id"], pass_name)
+            record["case"] = latest["case_name"]
+            yield record
+
+    def get_artifact(self, doc_id, kind) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT path FROM artifacts WHERE document_id = ? AND kind = ?",
+                                     (doc_id, kind)).fetchone()
+        return row["path"] if row else None
+
+    def cases(self) -> List[dict]:
+        """ Every case with its number of documents and last activity """
+        return self._query("SELECT case_name, COUNT(*) AS documents, MAX(created) AS last_created "
+                           "FROM documents GROUP BY case_name ORDER BY case_name")
+
+    def documents(self, case) -> List[dict]:
+        """ Documents of a case with the passes run over each """
+        return self._query(
+            "SELECT d.id, d.name, d.created, GROUP_CONCAT(p.pass) AS passes FROM documents d "
+            "LEFT JOIN passes p ON p.document_id = d.id WHERE d.case_name = ? GROUP BY d.id ORDER BY d.id",
+            (str(case),))
+
+    def entity_counts(self, case=None, pass_name="second") -> List[dict]:
+        """ Number of results per entity type over the latest pass_name of every document
+        (of one case, or of every case) """
+        query = (
+            "SELECT r.entity_type, COUNT(*) AS count FROM results r "
+            "JOIN (SELECT MAX(p.id) AS id FROM passes p JOIN documents d ON d.id = p.document_id "
+            "      WHERE p.pass = ?" + (" AND d.case_name = ?" if case is not None else "") +
+            "      GROUP BY p.document_id) latest ON latest.id = r.pass_id "
+            "GROUP BY r.entity_type ORDER BY count DESC")
+        args = (pass_name, str(case)) if case is not None else (pass_name,)
+        return self._query(query, args)
+
+    def _query(self, query, args=()) -> List[dict]:
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(query, args).fetchall()]
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
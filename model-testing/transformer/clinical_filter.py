@@ -1,224 +1,337 @@
 import re
 from typing import List
 from presidio_analyzer import RecognizerResult
+from medical_vocab import MEDICAL_VOCABULARY
+from interval_index import IntervalIndex
+from span_record import with_bounds
+
+
+RELATIVE_TIMES = frozenset({
+    'today', 'yesterday', 'tomorrow', 'tonight',
+    'last week', 'last month', 'last year', 'last night',
+    'this morning', 'this afternoon', 'this evening', 'this week',
+    'next week', 'next month'
+})
+
+DURATION_PATTERNS = [
+    r'^\d+\s+(week|day|month|year)s?$', 
+    r'^x\s*~?\s*\d+\s+(week|day|month)s?$',  
+    r'^(week|day|month|year)s?$', 
+    r'^breath x ~\d+$',  
+]
+
+MEDICAL_TERMS = frozenset({
+    'ekg', 'ecg', 'mri', 'ct', 'xray', 'lab', 'labs',
+    'lisinopril', 'atorvastatin', 'metformin', 'aspirin', 'ibuprofen',
+    'tylenol', 'advil', 'prednisone', 'amoxicillin', 'azithromycin',
+    'htn', 'dm', 'copd', 'cad', 'chf', 'gerd', 'mi', 'dvt', 'pe',
+    'occ', 'prn', 'qhs', 'bid', 'tid', 'qid',
+    'patient', 'complaint', 'history', 'assessment', 'plan'
+})
+
+# Preserve dates after these medical history keywords
+HISTORY_KEYWORDS = [
+    'began', 'started', 'onset', 'quit', 'stopped', 
+    'diagnosed', 'since', 'symptoms', 'history'
+]
+
+# Compiled once at import. Keyword lists become a single alternation so a context window
+# is scanned once, and windows are searched in place (pos/endpos) instead of sliced.
+_DURATION_RE = re.compile('|'.join(f'(?:{p})' for p in DURATION_PATTERNS), re.IGNORECASE)
+_DURATION_IN_TEXT_RE = re.compile(r'\d+\s+(week|day|month|year)s?', re.IGNORECASE)
+_DURATION_CONTEXT_RE = re.compile(r'in |for |x |x~', re.IGNORECASE)
+_HISTORY_CONTEXT_RE = re.compile('|'.join(HISTORY_KEYWORDS), re.IGNORECASE)
+_NUMBER_RE = re.compile(r'\d+')
+_UNIT_WORD_RE = re.compile(r'^(week|day|month|year)s?$', re.IGNORECASE)
+_ZIP_LIKE_RE = re.compile(r'^\d{5}$')
+_LONG_NUMBER_RE = re.compile(r'^\d{5,}$')
+_STATE_ABBR_RE = re.compile(r'^[A-Z]{2}$')
+_TIMES_N_RE = re.compile(r'x\s*~?\s*\d+')
+# medication name endings
+_MED_SUFFIX_RE = re.compile(r'(?:pril|statin|olol|pine|cillin|mycin|oxacin)$')
+_CLEAN_NAME_RE = re.compile(r'^([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)')
+
+
+# Filter rules. Each takes (detected_text, lower-cased detected_text, full_text, start)
+# and returns True when it fires; full_text/start are None outside filter_results.
+
+# Preserve relative times
+def _is_relative_time(detected, lower, full_text, start):
+    return lower in RELATIVE_TIMES
+
+# Preserve durations
+def _is_duration(detected, lower, full_text, start):
+    return _DURATION_RE.match(detected) is not None
+
+# "in 2 weeks" or "for 3 days" patterns
+def _has_duration_context(detected, lower, full_text, start):
+    return (full_text is not None
+            and _DURATION_CONTEXT_RE.search(full_text, max(0, start - 20), start) is not None
+            and _DURATION_IN_TEXT_RE.search(detected) is not None)
+
+# "quit 2015", "since 2010", "symptoms began 3/2", etc.
+def _follows_history_keyword(detected, lower, full_text, start):
+    return full_text is not None and _HISTORY_CONTEXT_RE.search(full_text, max(0, start - 50), start) is not None
+
+# Preserve ages under 89
+def _is_age_under_89(detected, lower, full_text, start):
+    age_match = _NUMBER_RE.search(detected)
+    return age_match is not None and int(age_match.group()) < 89
+
+def _is_medical_term(detected, lower, full_text, start):
+    return lower in MEDICAL_TERMS
+
+# Single letters or very short strings that are likely abbreviations
+def _is_short_abbreviation(detected, lower, full_text, start):
+    return len(lower) <= 2
+
+# Single word "weeks", "days", etc. should not be DATE_TIME
+def _is_unit_word(detected, lower, full_text, start):
+    return _UNIT_WORD_RE.match(detected) is not None
+
+# 5-digit numbers that look like ZIP codes
+def _is_zip_like(detected, lower, full_text, start):
+    return _ZIP_LIKE_RE.match(detected) is not None
+
+# Numbers without context (likely part of MRN or other ID)
+def _is_bare_long_number(detected, lower, full_text, start):
+    return _LONG_NUMBER_RE.match(detected) is not None
+
+# State abbreviations
+def _is_state_abbreviation(detected, lower, full_text, start):
+    return _STATE_ABBR_RE.match(detected) is not None
+
+# Duration patterns like "breath x ~2"
+def _has_times_n(detected, lower, full_text, start):
+    return _TIMES_N_RE.search(detected) is not None
+
+# Single word that looks like a medication (ends in common suffixes)
+def _is_medication_name(detected, lower, full_text, start):
+    return len(detected.split()) == 1 and _MED_SUFFIX_RE.search(lower) is not None
+
+# Drug/lab/anatomy names from the local vocabulary file (see medical_vocab.py)
+def _is_vocabulary_term(detected, lower, full_text, start):
+    return lower in ClinicalDataFilter.MEDICAL_VOCABULARY
+
+
+_GENERIC_FALSE_POSITIVE_RULES = (_is_medical_term,)
 
 
 class ClinicalDataFilter:
-    RELATIVE_TIMES = {
-        'today', 'yesterday', 'tomorrow', 'tonight',
-        'last week', 'last month', 'last year', 'last night',
-        'this morning', 'this afternoon', 'this evening', 'this week',
-        'next week', 'next month'
+    RELATIVE_TIMES = RELATIVE_TIMES
+    DURATION_PATTERNS = DURATION_PATTERNS
+    MEDICAL_TERMS = MEDICAL_TERMS
+    # Loaded on the first PERSON/ORGANIZATION check; empty if the file is absent
+    MEDICAL_VOCABULARY = MEDICAL_VOCABULARY
+    HISTORY_KEYWORDS = HISTORY_KEYWORDS
+    
+    # Rule tables, evaluated in order per entity type; the first rule that fires decides.
+    # The None entry applies to entity types without an entry of their own.
+    PRESERVE_RULES = {
+        'DATE_TIME': (_is_relative_time, _is_duration, _has_duration_context, _follows_history_keyword),
+        'AGE': (_is_age_under_89,),
     }
     
-    DURATION_PATTERNS = [
-        r'^\d+\s+(week|day|month|year)s?$', 
-        r'^x\s*~?\s*\d+\s+(week|day|month)s?$',  
-        r'^(week|day|month|year)s?$', 
-        r'^breath x ~\d+$',  
-    ]
+    FALSE_POSITIVE_RULES = {
+        None: _GENERIC_FALSE_POSITIVE_RULES,
+        'PERSON': _GENERIC_FALSE_POSITIVE_RULES + (_is_short_abbreviation, _is_medication_name, _is_vocabulary_term),
+        'ORGANIZATION': _GENERIC_FALSE_POSITIVE_RULES + (_is_short_abbreviation, _is_state_abbreviation, _has_times_n,
+                                                         _is_vocabulary_term),
+        'LOCATION': _GENERIC_FALSE_POSITIVE_RULES + (_is_short_abbreviation,),
+        'DATE_TIME': _GENERIC_FALSE_POSITIVE_RULES + (_is_unit_word, _is_zip_like, _is_bare_long_number),
+    }
     
-    MEDICAL_TERMS = {
-        'ekg', 'ecg', 'mri', 'ct', 'xray', 'lab', 'labs',
-        'lisinopril', 'atorvastatin', 'metformin', 'aspirin', 'ibuprofen',
-        'tylenol', 'advil', 'prednisone', 'amoxicillin', 'azithromycin',
-        'htn', 'dm', 'copd', 'cad', 'chf', 'gerd', 'mi', 'dvt', 'pe',
-        'occ', 'prn', 'qhs', 'bid', 'tid', 'qid',
-        'patient', 'complaint', 'history', 'assessment', 'plan'
+    # Define priority order (higher priority = keep this one)
+    ENTITY_PRIORITY = {
+        'SSN': 10,
+        'MRN': 9,
+        'PHONE_NUMBER': 8,
+        'EMAIL_ADDRESS': 8,
+        'DOB': 7,
+        'ZIPCODE': 6,
+        'ADDRESS': 5,
+        'PERSON': 4,
+        'ORGANIZATION': 3,
+        'LICENSE': 3,
+        'AGE': 2,
+        'LOCATION': 1,
+        'DATE_TIME': 0  # Lowest priority
     }
     
+    # Entity types that should "consume" smaller entities inside them
+    CONTAINER_TYPES = {'ADDRESS', 'PERSON', 'ORGANIZATION'}
+    NESTED_TYPES = {'LOCATION', 'ZIPCODE', 'DATE_TIME'}
+    
     @staticmethod
     def filter_results(text: str, results: List[RecognizerResult]) -> List[RecognizerResult]:
         # Step 1: Clean person names
         results = ClinicalDataFilter.clean_person_names(text, results)
         
         # Step 2: Filter out false positives and clinical data
+        filtered = ClinicalDataFilter._apply_rules(
+            text, results, ClinicalDataFilter.PRESERVE_RULES, ClinicalDataFilter.FALSE_POSITIVE_RULES)
+        
+        # Step 3: Resolve conflicts (e.g., same text detected as both ZIPCODE and DATE_TIME),
+        # nested entities (e.g., city/ZIP inside ADDRESS) and partial overlaps
+        filtered = ClinicalDataFilter.resolve_overlaps(text, filtered)
+        
+        return filtered
+    
+    @staticmethod
+    def preserve_clinical(text: str, results: List[RecognizerResult]) -> List[RecognizerResult]:
+        """Drop results that should stay readable (relative times, durations, ages under 89)"""
+        return ClinicalDataFilter._apply_rules(text, results, ClinicalDataFilter.PRESERVE_RULES)
+    
+    @staticmethod
+    def remove_false_positives(text: str, results: List[RecognizerResult]) -> List[RecognizerResult]:
+        """Drop results that are clinical terms, abbreviations or numbers rather than PHI"""
+        return ClinicalDataFilter._apply_rules(text, results, ClinicalDataFilter.FALSE_POSITIVE_RULES)
+    
+    @staticmethod
+    def _apply_rules(text: str, results: List[RecognizerResult], *tables) -> List[RecognizerResult]:
+        """
+        Drop every result for which a rule fires. The rules for an entity type are the
+        concatenation of its entries in tables, looked up once per type, and evaluated in
+        order until the first one fires.
+        """
+        rules_by_type = {}
         filtered = []
         for result in results:
-            detected_text = text[result.start:result.end].strip()
+            rules = rules_by_type.get(result.entity_type)
+            if rules is None:
+                rules = rules_by_type[result.entity_type] = sum(
+                    (table.get(result.entity_type, table.get(None, ())) for table in tables), ())
             
-            # Skip if should be preserved
-            if ClinicalDataFilter._should_preserve(detected_text, text, result):
-                continue
-            
-            # Skip if it's a false positive
-            if ClinicalDataFilter._is_false_positive(detected_text, result.entity_type):
-                continue
-            
-            filtered.append(result)
-        
-        # Step 3: Resolve conflicts (e.g., same text detected as both ZIPCODE and DATE_TIME)
-        filtered = ClinicalDataFilter._resolve_conflicts(text, filtered)
-        
-        # Step 4: Remove nested entities (e.g., city/ZIP inside ADDRESS)
-        filtered = ClinicalDataFilter._remove_nested_entities(filtered)
-        
+            detected_text = text[result.start:result.end].strip()
+            lower = detected_text.lower()
+            for rule in rules:
+                if rule(detected_text, lower, text, result.start):
+                    break
+            else:
+                filtered.append(result)
         return filtered
     
     @staticmethod
     def _should_preserve(detected_text: str, full_text: str, result: RecognizerResult) -> bool:
         """Determine if entity should be preserved (not obfuscated)"""
-        
-        # Preserve relative times
-        if result.entity_type == "DATE_TIME":
-            if detected_text.lower() in ClinicalDataFilter.RELATIVE_TIMES:
-                return True
-            
-            # Preserve durations
-            for pattern in ClinicalDataFilter.DURATION_PATTERNS:
-                if re.match(pattern, detected_text, re.IGNORECASE):
-                    return True
-            
-            # Check context for duration indicators
-            context_before = full_text[max(0, result.start - 20):result.start].lower()
-            
-            # "in 2 weeks" or "for 3 days" patterns
-            if any(word in context_before for word in ['in ', 'for ', 'x ', 'x~']):
-                if re.search(r'\d+\s+(week|day|month|year)s?', detected_text, re.IGNORECASE):
-                    return True
-            
-            context_before_expanded = full_text[max(0, result.start - 50):result.start].lower()
-            
-            # Preserve dates after these medical history keywords
-            history_keywords = [
-                'began', 'started', 'onset', 'quit', 'stopped', 
-                'diagnosed', 'since', 'symptoms', 'history'
-            ]
-            
-            if any(keyword in context_before_expanded for keyword in history_keywords):
-                return True
-            
-            # "quit 2015", "since 2010", etc.
-            if re.match(r'^\d{4}$', detected_text):
-                if any(keyword in context_before_expanded for keyword in ['quit', 'since', 'started', 'began', 'stopped']):
-                    return True
-        
-        # Preserve ages under 89
-        if result.entity_type == "AGE":
-            age_match = re.search(r'\d+', detected_text)
-            if age_match and int(age_match.group()) < 89:
-                return True
-        
-        return False
+        rules = ClinicalDataFilter.PRESERVE_RULES.get(result.entity_type, ())
+        lower = detected_text.lower()
+        return any(rule(detected_text, lower, full_text, result.start) for rule in rules)
     
     @staticmethod
     def _is_false_positive(detected_text: str, entity_type: str) -> bool:
         """Check if detected entity is a false positive"""
-        
-        text_lower = detected_text.lower().strip()
-        
-        # Check if it's a medical term
-        if text_lower in ClinicalDataFilter.MEDICAL_TERMS:
-            return True
-        
-        # Single letters or very short strings that are likely abbreviations
-        if len(text_lower) <= 2 and entity_type in ['PERSON', 'ORGANIZATION', 'LOCATION']:
-            return True
-        
-        # Single word "weeks", "days", etc. should not be DATE_TIME
-        if entity_type == "DATE_TIME":
-            if re.match(r'^(week|day|month|year)s?$', detected_text, re.IGNORECASE):
-                return True
-            
-            # 5-digit numbers that look like ZIP codes
-            if re.match(r'^\d{5}$', detected_text):
-                return True
-            
-            # Numbers without context (likely part of MRN or other ID)
-            if re.match(r'^\d+$', detected_text) and len(detected_text) > 4:
-                return True
-        
-        # Common false positive org patterns
-        if entity_type == 'ORGANIZATION':
-            # State abbreviations
-            if re.match(r'^[A-Z]{2}$', detected_text):
-                return True
-            # Duration patterns like "breath x ~2"
-            if re.search(r'x\s*~?\s*\d+', detected_text):
-                return True
-        
-        # Single capitalized words that are likely NOT people
-        if entity_type == 'PERSON':
-            # Single word names that are likely not people
-            if len(detected_text.split()) == 1:
-                # Check if it's a common place or medical term
-                if text_lower in ClinicalDataFilter.MEDICAL_TERMS:
-                    return True
-                # Check if it looks like a medication (ends in common suffixes)
-                med_suffixes = ['pril', 'statin', 'olol', 'pine', 'cillin', 'mycin', 'oxacin']
-                if any(text_lower.endswith(suffix) for suffix in med_suffixes):
-                    return True
-        
-        return False
+        table = ClinicalDataFilter.FALSE_POSITIVE_RULES
+        rules = table.get(entity_type, table[None])
+        lower = detected_text.lower().strip()
+        return any(rule(detected_text, lower, None, None) for rule in rules)
     
     @staticmethod
-    def _resolve_conflicts(text: str, results: List[RecognizerResult]) -> List[RecognizerResult]:
-        # Group by position
-        by_position = {}
-        for result in results:
-            key = (result.start, result.end)
-            if key not in by_position:
-                by_position[key] = []
-            by_position[key].append(result)
+    def _rank(result: RecognizerResult) -> tuple:
+        """Which of two overlapping results wins: type priority, then longer span, then score"""
+        return (ClinicalDataFilter.ENTITY_PRIORITY.get(result.entity_type, 0),
+                result.end - result.start, result.score)
+    
+    @staticmethod
+    def _trimmed(result: RecognizerResult, start: int, end: int) -> RecognizerResult:
+        # same type as the input: SpanRecord inside the pipeline, RecognizerResult otherwise
+        return with_bounds(result, start, end)
+    
+    @staticmethod
+    def resolve_overlaps(text: str, results: List[RecognizerResult]) -> List[RecognizerResult]:
+        """
+        Resolve exact duplicates, nesting and partial overlaps in one sort-and-sweep pass.
         
-        # Define priority order (higher priority = keep this one)
-        priority = {
-            'SSN': 10,
-            'MRN': 9,
-            'PHONE_NUMBER': 8,
-            'EMAIL_ADDRESS': 8,
-            'DOB': 7,
-            'ZIPCODE': 6,
-            'ADDRESS': 5,
-            'PERSON': 4,
-            'ORGANIZATION': 3,
-            'LICENSE': 3,
-            'AGE': 2,
-            'LOCATION': 1,
-            'DATE_TIME': 0  # Lowest priority
-        }
+        - Same (start, end) detected as several types: keep the highest ENTITY_PRIORITY
+        - LOCATION/ZIPCODE/DATE_TIME inside an ADDRESS/PERSON/ORGANIZATION: drop the inner one
+        - Other nesting is kept (e.g. a PHONE_NUMBER inside an ADDRESS)
+        - Partial overlap: the higher _rank keeps the shared characters and the other result
+          is trimmed to the part outside it, so no detected text is left unredacted. A
+          trimmed result is checked again against the kept ones, so none of the output
+          results partially overlap
         
-        resolved = []
-        for (start, end), candidates in by_position.items():
-            if len(candidates) == 1:
-                resolved.append(candidates[0])
+        Sorting is O(n log n); each step of the sweep is an IntervalIndex overlap query over
+        the results kept so far, which only scans spans still open at the current start.
+        """
+        priority = ClinicalDataFilter.ENTITY_PRIORITY
+        containers = ClinicalDataFilter.CONTAINER_TYPES
+        nested_types = ClinicalDataFilter.NESTED_TYPES
+        rank = ClinicalDataFilter._rank
+        trimmed = ClinicalDataFilter._trimmed
+        
+        # Exact duplicates: adjacent after sorting by position. Ties in priority go to the
+        # result reported first (the sort is stable), as max() did before.
+        deduped = []
+        for result in sorted(results, key=lambda r: (r.start, r.end)):
+            if deduped and (deduped[-1].start, deduped[-1].end) == (result.start, result.end):
+                if priority.get(result.entity_type, 0) > priority.get(deduped[-1].entity_type, 0):
+                    deduped[-1] = result
             else:
-                # Keep the one with highest priority
-                best = max(candidates, key=lambda r: priority.get(r.entity_type, 0))
-                resolved.append(best)
+                deduped.append(result)
         
-        return resolved
-    
-    @staticmethod
-    def _remove_nested_entities(results: List[RecognizerResult]) -> List[RecognizerResult]:
-        # Sort by span size (larger spans first)
-        sorted_results = sorted(results, key=lambda r: (r.end - r.start), reverse=True)
+        # Containers sort before anything they contain: by start, then longest first
+        deduped.sort(key=lambda r: (r.start, -r.end))
         
-        # Entity types that should "consume" smaller entities inside them
-        container_types = {'ADDRESS', 'PERSON', 'ORGANIZATION'}
+        # Kept results, indexed by their original bounds. Trimming only shrinks a result,
+        # so the indexed bounds stay a superset and the checks below use the result itself.
+        kept = IntervalIndex()
+        touched = []    # kept results trimmed since they were settled
         
-        keep = []
+        def settle(result, own=None):
+            """result resolved against every kept result (but its own entry); None if it is
+            dropped. A trimmed result is checked again from the start, since a nesting it
+            had can turn into a partial overlap; kept results it trims go to touched."""
+            changed = True
+            while changed:
+                changed = False
+                for i in kept.overlapping(result.start, result.end):
+                    other = kept.values[i]
+                    if i == own or other.end <= result.start or other.start >= result.end:
+                        continue
+                    if other.start <= result.start and result.end <= other.end:
+                        # result is nested inside other
+                        if other.entity_type in containers and result.entity_type in nested_types:
+                            return None
+                        continue
+                    if result.start <= other.start and other.end <= result.end:
+                        # other is nested inside result
+                        if result.entity_type in containers and other.entity_type in nested_types:
+                            kept.discard(i)
+                        continue
+                    # partial overlap: the loser keeps only the part outside the winner
+                    if rank(result) > rank(other):
+                        if other.start < result.start:
+                            kept.values[i] = trimmed(other, other.start, result.start)
+                        else:
+                            kept.values[i] = trimmed(other, result.end, other.end)
+                        touched.append(i)
+                    else:
+                        if result.start < other.start:
+                            result = trimmed(result, result.start, other.start)
+                        else:
+                            result = trimmed(result, other.end, result.end)
+                        changed = True
+                        break
+            return result
         
-        for result in sorted_results:
-            # Check if this entity is nested inside a container we're already keeping
-            is_nested = False
-            
-            for kept_result in keep:
-                # Check if kept_result is a container type
-                if kept_result.entity_type in container_types:
-                    # Check if current result is inside kept_result
-                    if kept_result.start <= result.start and result.end <= kept_result.end:
-                        # This result is nested inside a container
-                        # Only skip if it's a lower-priority type
-                        if result.entity_type in ['LOCATION', 'ZIPCODE', 'DATE_TIME']:
-                            is_nested = True
-                            break
-            
-            if not is_nested:
-                keep.append(result)
+        for result in deduped:
+            start = result.start
+            result = settle(result)
+            if result is not None:
+                kept.append(start, result.end, result)
+            # every trim shrinks a result, so this ends
+            while touched:
+                i = touched.pop()
+                if not kept.alive[i]:
+                    continue
+                settled = settle(kept.values[i], own=i)
+                if settled is None:
+                    kept.discard(i)
+                else:
+                    kept.values[i] = settled
         
-        # Sort back by position
-        return sorted(keep, key=lambda r: r.start)
+        # trimming can move a start past its neighbour's, so sort back by position
+        return sorted((result for _, _, result in kept), key=lambda r: r.start)
     
     @staticmethod
     def clean_person_names(text: str, results: List[RecognizerResult]) -> List[RecognizerResult]:
@@ -229,16 +342,11 @@ class ClinicalDataFilter:
                 detected_text = text[result.start:result.end]
                 
                 # Find where the name actually ends (before newline or "DOB")
-                clean_match = re.match(r'^([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)', detected_text)
+                clean_match = _CLEAN_NAME_RE.match(detected_text)
                 if clean_match:
                     clean_name = clean_match.group(1)
                     # Create new result with corrected end position
-                    new_result = RecognizerResult(
-                        entity_type="PERSON",
-                        start=result.start,
-                        end=result.start + len(clean_name),
-                        score=result.score
-                    )
+                    new_result = with_bounds(result, result.start, result.start + len(clean_name))
                     cleaned.append(new_result)
                 else:
                     cleaned.append(result)
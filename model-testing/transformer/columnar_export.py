@@ -0,0 +1,293 @@
+import os
+from typing import Iterable, List, Optional, Tuple
+
+# Columnar copy of results rows (see span_record.SpanRecord.to_row) for analytics over
+# many runs. An export is a directory with two tables, as Arrow IPC files (memory-mapped
+# when read) or Parquet:
+#
+#   documents   doc, case, doc_id, pass, text, sparse
+#   detections  doc, entity_type, start, end, score, replacement,
+#               context_start, entity_start, entity_end, context_end
+#
+# entity_type, replacement, case and pass are dictionary-encoded. Instead of the text and
+# left/right context strings of each row, detections hold offsets into the text of their
+# document (documents.text[context_start:entity_start] is the left context). When the
+# source text is not available (e.g. exporting from the case store) text is rebuilt from
+# the rows' context windows: the windows are merged and concatenated, one "\n" between
+# them, and sparse is true. start/end are always offsets in the original text.
+#
+# Dictionaries are built per record batch for Parquet. An Arrow file holds one dictionary
+# per column, extended by deltas, so once a table's dictionary passes max_dictionary
+# entries its file is closed and the table continues in the next part, with new
+# dictionaries: detections.arrow, detections.1.arrow, ... (read_table joins them).
+
+FORMATS = ("arrow", "parquet")
+TABLES = ("documents", "detections")
+SEGMENT_SEPARATOR = "\n"
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("Columnar export requires the pyarrow package (pip install pyarrow)") from e
+    return pyarrow
+
+
+def _schemas(pa):
+    documents = pa.schema([
+        ("doc", pa.int32()),
+        ("case", pa.dictionary(pa.int32(), pa.string())),
+        ("doc_id", pa.int64()),
+        ("pass", pa.dictionary(pa.int8(), pa.string())),
+        ("text", pa.large_string()),
+        ("sparse", pa.bool_()),
+    ])
+    detections = pa.schema([
+        ("doc", pa.int32()),
+        ("entity_type", pa.dictionary(pa.int16(), pa.string())),
+        ("start", pa.int64()),
+        ("end", pa.int64()),
+        ("score", pa.float32()),
+        ("replacement", pa.dictionary(pa.int32(), pa.string())),
+        ("context_start", pa.int64()),
+        ("entity_start", pa.int64()),
+        ("entity_end", pa.int64()),
+        ("context_end", pa.int64()),
+    ])
+    return {"documents": documents, "detections": detections}
+
+
+def table_path(out_dir, table, fmt="arrow", part=0):
+    return os.path.join(out_dir, f"{table}.{part}.{fmt}" if part else f"{table}.{fmt}")
+
+
+def sparse_text(rows: List[dict]) -> Tuple[str, List[int]]:
+    """
+    Text made of the rows' merged context windows, and for each row the offset that maps
+    its original positions into that text (original position + shift).
+    """
+    windows = sorted((row["start"] - len(row.get("left_context") or ""), i) for i, row in enumerate(rows))
+    pieces = []
+    length = 0
+    shifts = [0] * len(rows)
+    segment_start = segment_end = None     # original offsets of the segment being built
+    segment_base = 0                       # where it starts in the output text
+    for window_start, i in windows:
+        row = rows[i]
+        window_text = (row.get("left_context") or "") + (row.get("text") or "") + (row.get("right_context") or "")
+        window_end = window_start + len(window_text)
+        if segment_end is None or window_start > segment_end:
+            # a new segment
+            if segment_end is not None:
+                pieces.append(SEGMENT_SEPARATOR)
+                length += len(SEGMENT_SEPARATOR)
+            segment_start, segment_end, segment_base = window_start, window_start, length
+        if window_end > segment_end:
+            # only the part past what the segment already holds
+            piece = window_text[segment_end - window_start:]
+            pieces.append(piece)
+            length += len(piece)
+            segment_end = window_end
+        shifts[i] = segment_base - segment_start
+    return "".join(pieces), shifts
+
+
+class ColumnarWriter:
+    """
+    Streams documents and their results rows into an export directory.
+
+    Columns are buffered and written as one record batch per batch_rows detections, so
+    memory stays bounded however many documents are exported. Parquet batches get their
+    own dictionaries; Arrow files carry new values as dictionary deltas and start a new
+    part past max_dictionary entries, so no flush rebuilds more than that.
+    """
+    def __init__(self, out_dir, fmt="arrow", batch_rows=65536, max_dictionary=1 << 18):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown export format '{fmt}', expected one of {FORMATS}")
+        self.pa = _pyarrow()
+        self.out_dir = out_dir
+        self.fmt = fmt
+        self.batch_rows = batch_rows
+        self.max_dictionary = max_dictionary
+        self.schemas = _schemas(self.pa)
+        self.documents = 0
+        self.detections = 0
+        self._vocab = {name: {} for name in ("case", "pass", "entity_type", "replacement")}
+        # per dictionary column: its values in code order, and the dictionary last written
+        self._dictionaries = {name: [] for name in self._vocab}
+        self._written = {name: None for name in self._vocab}
+        self._columns = {table: {field.name: [] for field in self.schemas[table]} for table in TABLES}
+
+        os.makedirs(out_dir, exist_ok=True)
+        for table in TABLES:
+            # parts left by an earlier export into this directory
+            part = 1
+            while os.path.exists(table_path(out_dir, table, fmt, part)):
+                os.remove(table_path(out_dir, table, fmt, part))
+                part += 1
+        self._parts = {table: 0 for table in TABLES}
+        self._writers = {table: self._open(table) for table in TABLES}
+
+    def add(self, rows: Iterable[dict], text: Optional[str]=None, case=None, doc_id=None, pass_name=None) -> None:
+        """ One document's results rows; text is its source text, if available """
+        rows = list(rows)
+        if text is None:
+            text, shifts = sparse_text(rows)
+            sparse = True
+        else:
+            shifts = [0] * len(rows)
+            sparse = False
+
+        doc = self.documents
+        self.documents += 1
+        columns = self._columns["documents"]
+        columns["doc"].append(doc)
+        columns["case"].append(self._code("case", None if case is None else str(case)))
+        columns["doc_id"].append(doc_id)
+        columns["pass"].append(self._code("pass", pass_name))
+        columns["text"].append(text)
+        columns["sparse"].append(sparse)
+
+        columns = self._columns["detections"]
+        for row, shift in zip(rows, shifts):
+            start, end = row["start"], row["end"]
+            columns["doc"].append(doc)
+            columns["entity_type"].append(self._code("entity_type", row["entity_type"]))
+            columns["start"].append(start)
+            columns["end"].append(end)
+            columns["score"].append(row["score"])
+            columns["replacement"].append(self._code("replacement", row.get("replacement") or ""))
+            columns["context_start"].append(start - len(row.get("left_context") or "") + shift)
+            columns["entity_start"].append(start + shift)
+            columns["entity_end"].append(end + shift)
+            columns["context_end"].append(end + len(row.get("right_context") or "") + shift)
+        self.detections += len(rows)
+
+        if len(columns["doc"]) >= self.batch_rows:
+            self._flush()
+
+    def close(self) -> None:
+        if self._writers:
+            self._flush()
+            for writer in self._writers.values():
+                writer.close()
+            self._writers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _code(self, name, value):
+        if value is None:
+            return None
+        vocab = self._vocab[name]
+        code = vocab.get(value)
+        if code is None:
+            code = vocab[value] = len(vocab)
+            self._dictionaries[name].append(value)
+        return code
+
+    def _open(self, table):
+        path = table_path(self.out_dir, table, self.fmt, self._parts[table])
+        if self.fmt == "arrow":
+            options = self.pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+            return self.pa.ipc.new_file(path, self.schemas[table], options=options)
+        return self.pa.parquet.ParquetWriter(path, self.schemas[table])
+
+    def _dictionary(self, name):
+        """ The column's dictionary for the next batch: its values so far, as one array """
+        pa = self.pa
+        written = self._written[name]
+        new = pa.array(self._dictionaries[name][0 if written is None else len(written):], type=pa.string())
+        return new if written is None else pa.concat_arrays([written, new])
+
+    def _flush(self):
+        pa = self.pa
+        for table in TABLES:
+            columns = self._columns[table]
+            if not columns["doc"]:
+                continue
+            arrays = []
+            dictionary_fields = []
+            for field in self.schemas[table]:
+                values = columns[field.name]
+                if pa.types.is_dictionary(field.type):
+                    dictionary = self._written[field.name] = self._dictionary(field.name)
+                    arrays.append(pa.DictionaryArray.from_arrays(pa.array(values, type=field.type.index_type), dictionary))
+                    dictionary_fields.append(field.name)
+                else:
+                    arrays.append(pa.array(values, type=field.type))
+            self._writers[table].write_batch(pa.record_batch(arrays, schema=self.schemas[table]))
+            self._columns[table] = {name: [] for name in columns}
+
+            if self.fmt == "parquet" or any(len(self._dictionaries[name]) > self.max_dictionary
+                                            for name in dictionary_fields):
+                # parquet: dictionaries are per batch; arrow: continue in a new part
+                if self.fmt == "arrow":
+                    self._writers[table].close()
+                    self._parts[table] += 1
+                    self._writers[table] = self._open(table)
+                for name in dictionary_fields:
+                    self._vocab[name] = {}
+                    self._dictionaries[name] = []
+                    self._written[name] = None
+
+
+def export_rows(out_dir, documents: Iterable[dict], fmt="arrow", batch_rows=65536) -> Tuple[int, int]:
+    """
+    Writes an export from dicts with "rows" and optionally "text", "case", "doc_id" and
+    "pass" (e.g. CaseStore.get_pass records). Returns (documents, detections).
+    """
+    with ColumnarWriter(out_dir, fmt, batch_rows) as writer:
+        for document in documents:
+            writer.add(document["rows"] if "rows" in document else document["results"], document.get("text"),
+                       document.get("case"), document.get("doc_id"), document.get("pass"))
+    return writer.documents, writer.detections
+
+
+def read_table(out_dir, table, columns=None):
+    """
+    One table of an export as a pyarrow Table. Arrow files are memory-mapped, so nothing
+    is read until a column is used; for Parquet only `columns` are read.
+    """
+    pa = _pyarrow()
+    arrow_path = table_path(out_dir, table, "arrow")
+    if os.path.exists(arrow_path):
+        parts = []
+        while os.path.exists(arrow_path):
+            parts.append(pa.ipc.open_file(pa.memory_map(arrow_path, "r")).read_all())
+            arrow_path = table_path(out_dir, table, "arrow", len(parts))
+        # each part keeps its own dictionaries, as separate chunks
+        data = pa.concat_tables(parts) if len(parts) > 1 else parts[0]
+        return data.select(columns) if columns else data
+    return pa.parquet.read_table(table_path(out_dir, table, "parquet"), columns=columns, memory_map=True)
+
+
+def to_rows(detections, documents, indices=None) -> List[dict]:
+    """ Results rows (as written by log_analysis.iter_rows) for the given detections """
+    texts = documents.column("text")
+    doc_rows = {doc: i for i, doc in enumerate(documents.column("doc").to_pylist())}
+    if indices is not None:
+        detections = detections.take(indices)
+    rows = []
+    cache = {}
+    for d in detections.to_pylist():
+        text = cache.get(d["doc"])
+        if text is None:
+            text = cache[d["doc"]] = texts[doc_rows[d["doc"]]].as_py()
+        rows.append({
+            "entity_type": d["entity_type"],
+            "start": d["start"],
+            "end": d["end"],
+            "score": d["score"],
+            "text": text[d["entity_start"]:d["entity_end"]],
+            "left_context": text[d["context_start"]:d["entity_start"]],
+            "right_context": text[d["entity_end"]:d["context_end"]],
+            "replacement": d["replacement"],
+        })
+    return rows
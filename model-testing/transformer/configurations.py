@@ -119,3 +119,28 @@ BERT_DEID_CONFIGURATION = {
     "ID_SCORE_MULTIPLIER": 0.4,
     "ID_ENTITY_NAME": "ID"
 }
+
+
+# Settings for the first_pass/second_pass orchestration in log_analysis.py
+PIPELINE_CONFIGURATION = {
+    # Ordered post-processing stages run between analyze and anonymize, by name
+    # (see postprocess.STAGES), e.g. ["clean_names", "preserve_clinical",
+    # "false_positives", "resolve_overlaps"]. Empty = use the analyzer results as-is.
+    "POSTPROCESS_STAGES": [],
+    # Compression of the per-run logs in logs/{case}/ (see run_log.RunLog): None for
+    # plain JSONL, or "zstd" (needs the zstandard package).
+    "RUN_LOG_COMPRESSION": None,
+    # Resident memory (MiB) the pipeline may use; PDF pages are rasterized a few at a time
+    # and preview caches shrink to stay under it (see memory_budget.py). None: half of
+    # physical memory. DEID_MEMORY_BUDGET_MB in the environment overrides it.
+    "MEMORY_BUDGET_MB": None,
+    # Rasterizer for PDF pages (see pdf_pages.py): "pymupdf", "pdf2image" (poppler), or
+    # None for PyMuPDF when it is installed.
+    "PDF_RENDERER": None,
+    # Take the words of PDF pages with a usable embedded text layer from the PDF instead of
+    # OCR (see text_layer.py; needs PyMuPDF). Image-only pages are still OCR'd.
+    "PDF_TEXT_LAYER": True,
+    # OCR engine (see ocr_engine.py): "tesserocr" (in-process, one engine per worker),
+    # "pytesseract" (a tesseract process per image), or None for tesserocr when it is installed.
+    "OCR_ENGINE": None,
+}
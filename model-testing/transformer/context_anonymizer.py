@@ -8,11 +8,13 @@ from presidio_anonymizer.operators import Operator
 from faker import Faker
 import random
 import re
+from interval_index import IntervalIndex
+from instrumentation import timed
 
 
 class DemographicContext:
     """Manages demographic coherence across anonymized entities"""
-    def __init__(self, name_groupings: List[set]=None):
+    def __init__(self, name_groupings: List[set]=None, name_group_map: Dict[str, str]=None):
         self.mappings: Dict[str, Dict[str, Any]] = {}
         self.faker = Faker()
         self.names = [
@@ -27,7 +29,10 @@ class DemographicContext:
                 canonical = sorted(group)[0].lower()
                 for variant in group:
                     self.name_group_map[variant.lower()] = canonical
-            print(name_groupings)
+        # canonical names established earlier in the case (see group_entities.NameGroupIndex)
+        # take precedence over ones derived from this document's groupings
+        if name_group_map:
+            self.name_group_map.update(name_group_map)
     
     def get_or_create_identity(self, original_value: str, entity_type: str, **context) -> Dict[str, Any]:
         """Get existing mapping or create new coherent identity"""
@@ -43,7 +48,8 @@ class DemographicContext:
         """Generate consistent key for value"""
         if entity_type == 'PERSON' and value.lower() in self.name_group_map:
             value = self.name_group_map[value.lower()]
-        return hashlib.sha256(value.encode()).hexdigest()
+        # typed, so the same text detected as two types never shares an identity
+        return hashlib.sha256(f"{entity_type}:{value}".encode()).hexdigest()
     
     
     def _create_coherent_identity(self, original_value: str, entity_type: str, **context) -> Dict[str, Any]:
@@ -71,25 +77,27 @@ class DemographicContext:
 
 
 class ContextAwareAnonymizer:
-    def __init__(self, name_groupings: List[set]=None):
-        self.context = DemographicContext(name_groupings)
+    def __init__(self, name_groupings: List[set]=None, name_group_map: Dict[str, str]=None):
+        self.context = DemographicContext(name_groupings, name_group_map)
         self.anonymizer = AnonymizerEngine()
         self.replacements = {}
     
+    @timed("anonymize")
     def anonymize(self, text: str, analyzer_results: List, patient_id: str = None) -> str:
         """
         Anonymize text by replacing ONLY the exact positions in analyzer_results.
         Does NOT use Presidio's anonymizer to avoid re-analysis.
         """
         
-        # Sort results by position (reverse order so we replace from end to start)
-        # This prevents position shifts when replacing
-        sorted_results = sorted(analyzer_results, key=lambda r: r.start, reverse=True)
+        # Walk results in position order and build the output from pieces in one pass.
+        # Where results overlap, the first (longest at equal start) is spliced in; a result
+        # inside it is not, and one reaching past it replaces its own uncovered tail, so no
+        # detected character is left in the clear.
+        spans = IntervalIndex.from_spans(analyzer_results)
+        pieces = []
+        cursor = 0
         
-        # Work with the text as a list for easier manipulation
-        result_text = text
-        
-        for result in sorted_results:
+        for _, _, result in spans:
             entity_type = result.entity_type
             entity_text = text[result.start:result.end]
             replacement = None
@@ -161,14 +169,24 @@ class ContextAwareAnonymizer:
                 replacement = "*"
             
             # Replace the text at this exact position
-            if replacement is not None:
-                result_text = result_text[:result.start] + replacement + result_text[result.end:]
+            if replacement is not None and result.start >= cursor:
+                pieces.append(text[cursor:result.start])
+                pieces.append(replacement)
+                cursor = result.end
+            elif replacement is not None and result.end > cursor:
+                # partial overlap with what is already replaced: keep the whitespace
+                # between the two, replace the rest
+                tail = text[cursor:result.end]
+                pieces.append(tail[:len(tail) - len(tail.lstrip())])
+                pieces.append(replacement)
+                cursor = result.end
         
             # print(f"Replaced '{entity_text}' ({entity_type}) with '{replacement}'")
             self.replacements[entity_text] = replacement
             # print(self.replacements)
 
-        return result_text
+        pieces.append(text[cursor:])
+        return "".join(pieces)
     
     def _shift_date(self, date_str: str, shift_days: int) -> str:
         """Helper to shift dates"""
@@ -207,9 +225,13 @@ class ContextAwareAnonymizer:
         with open(filepath, 'w') as f:
             json.dump(self.context.mappings, f, indent=2, default=str)
     
-    def get_context_summary(self, original_value: str) -> Optional[Dict]:
-        key = self.context._get_key(original_value)
-        return self.context.mappings.get(key)
+    def get_context_summary(self, original_value: str, entity_type: str=None) -> Optional[Dict]:
+        # identities are keyed by type; without one, return the first type that has it
+        for etype in [entity_type] if entity_type else ['PERSON', 'LOCATION', 'DATE_TIME']:
+            key = self.context._get_key(original_value, etype)
+            if key in self.context.mappings:
+                return self.context.mappings[key]
+        return None
 
 
 if __name__ == "__main__":
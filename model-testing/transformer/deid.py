@@ -0,0 +1,357 @@
+# Command line entry point for de-identifying a directory of documents.
+# Usage (from model-testing/transformer):
+#   python deid.py batch <input_dir> <output_dir> [--workers 2] [--retry-failed] [--profile [DIR]]
+#   python deid.py pages <input.pdf> <output_dir> [--queue-depth 2] [--render-threads 1]
+#   python deid.py stream <input.txt> <output.txt> [--results results.jsonl]
+#   python deid.py export <output_dir> [--store logs/cases.db] [--case NAME] [--format arrow]
+#
+# Each input file (PDF, image, DICOM or .txt) goes through OCR -> analyze -> anonymize ->
+# render in a worker process, and its outputs land in <output_dir>/<relative path>/.
+# Progress is recorded in <output_dir>/manifest.jsonl, one line per finished file, so
+# re-running the same command skips everything already done.
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+TEXT_EXTENSIONS = {".txt"}
+# must match what output_layout.render_file renders
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".tiff", ".bmp", ".gif"}
+SUPPORTED_EXTENSIONS = {".pdf", ".dcm"} | IMAGE_EXTENSIONS | TEXT_EXTENSIONS
+MANIFEST = "manifest.jsonl"
+
+# Loaded once per worker process by _init_worker (models_config builds the analyzer at import)
+_ANALYZER = None
+# per-file CPU/memory profiles go here when set (see profiling.py)
+_PROFILE_DIR = None
+
+
+def _init_worker(verbose, metrics_dir=None, profile_dir=None):
+    global _ANALYZER, _PROFILE_DIR
+    if not verbose:
+        # the OCR/render helpers print per page; keep the parent's progress report readable
+        sys.stdout = open(os.devnull, "w")
+    if metrics_dir:
+        import instrumentation
+        instrumentation.enable(metrics_dir)
+    from models_config import stanford_model
+    _ANALYZER = stanford_model
+    _PROFILE_DIR = profile_dir
+
+
+def discover(input_dir):
+    """ Supported files under input_dir as sorted relative paths """
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in SUPPORTED_EXTENSIONS:
+                yield os.path.relpath(os.path.join(root, name), input_dir)
+
+
+def file_state(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def load_manifest(path):
+    """ relative path -> last manifest record for it """
+    records = {}
+    if not os.path.exists(path):
+        return records
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # a run killed mid-write leaves a partial last line
+                continue
+            records[record["path"]] = record
+    return records
+
+
+def _collect_records(rows, records):
+    """ Yields rows unchanged, keeping each one's SpanRecord in records """
+    from span_record import SpanRecord
+    for row in rows:
+        records.append(SpanRecord.from_row(row))
+        yield row
+
+
+def process_file(input_dir, rel_path, output_dir):
+    """ OCR -> analyze -> anonymize -> link -> render one file. Runs in a worker. """
+    from log_analysis import deidentify, write_json
+    from instrumentation import document
+    from profiling import profiled
+    from memory_budget import peak_rss_mb, reset_peak
+
+    t0 = time.perf_counter()
+    # the peak of this file alone where the OS allows (workers run one file at a time)
+    reset_peak()
+    src = os.path.join(input_dir, rel_path)
+    record = {"path": rel_path, **file_state(src)}
+    extension = os.path.splitext(rel_path)[1].lower()
+    base_name = os.path.splitext(os.path.basename(rel_path))[0]
+    file_dir = os.path.join(output_dir, os.path.splitext(rel_path)[0])
+
+    try:
+        # stage timings for this file go to the metrics directory, if enabled
+        with profiled(os.path.basename(output_dir), rel_path, _PROFILE_DIR), \
+                document(os.path.basename(output_dir), rel_path, "batch"):
+            os.makedirs(file_dir, exist_ok=True)
+            if extension in TEXT_EXTENSIONS:
+                with open(src, "r", encoding="utf-8") as f:
+                    text = f.read()
+                pages = []
+            else:
+                # OCR/imaging dependencies are only needed for non-text inputs
+                from tesseract_test import ocr_file
+                pages = ocr_file(src, os.path.join(file_dir, "ocr"))
+                text = "\n".join(page_text for _, page_text in pages)
+
+            anonymized_text, rows, _, _ = deidentify(_ANALYZER, text)
+
+            with open(os.path.join(file_dir, f"{base_name}_deid.txt"), "w", encoding="utf-8") as f:
+                f.write(anonymized_text)
+            results_path = os.path.join(file_dir, "results.json")
+            if os.path.exists(results_path):
+                # left by an interrupted run; write_json appends
+                os.remove(results_path)
+            # rows are streamed into the results file; linking only needs their spans
+            records = []
+            write_json(results_path, _collect_records(rows, records))
+
+            # DICOM pixel text is analyzed but not burned back in: output_layout only
+            # redacts DICOM metadata from an edited metadata file
+            output = None
+            if pages and extension != ".dcm":
+                from match_results import link_records
+                from output_layout import render_file
+                json_files = [json_file for json_file, _ in pages]
+                link_records(records, json_files)
+                data_path = json_files[0] if extension in IMAGE_EXTENSIONS else os.path.dirname(json_files[0])
+                output = render_file(src, data_path, file_dir)
+                if output is None:
+                    # otherwise the manifest says done and a re-run skips a file with no redacted copy
+                    raise RuntimeError(f"no redacted output written for {rel_path}")
+
+        record.update(status="done", pages=len(pages), entities=len(records), output=output)
+    except Exception as e:
+        record.update(status="error", error=f"{type(e).__name__}: {e}")
+
+    record["seconds"] = round(time.perf_counter() - t0, 3)
+    record["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    return record
+
+
+class Progress:
+    """ Throughput and ETA, printed at most every `interval` seconds """
+    def __init__(self, total, interval=5.0, stream=sys.stderr):
+        self.total = total
+        self.interval = interval
+        self.stream = stream
+        self.done = 0
+        self.failed = 0
+        self.pages = 0
+        self.peak_rss_mb = 0.0      # largest per-file peak reported by the workers
+        self.start = time.perf_counter()
+        self.last_report = 0.0
+        self.last_done = -1
+
+    def update(self, record):
+        self.done += 1
+        self.failed += record["status"] != "done"
+        self.pages += record.get("pages", 0)
+        self.peak_rss_mb = max(self.peak_rss_mb, record.get("peak_rss_mb", 0))
+        self.report()
+
+    def report(self, force=False):
+        now = time.perf_counter()
+        if self.done == self.last_done or (not force and now - self.last_report < self.interval):
+            return
+        self.last_report, self.last_done = now, self.done
+        elapsed = max(now - self.start, 1e-9)
+        rate = self.done / elapsed
+        eta = (self.total - self.done) / rate if rate else float("inf")
+        eta_text = time.strftime("%H:%M:%S", time.gmtime(eta)) if eta != float("inf") else "--:--:--"
+        print(f"[{self.done}/{self.total}] {rate:.2f} files/s, {self.pages / elapsed:.2f} pages/s, "
+              f"{self.failed} failed, peak RSS {self.peak_rss_mb:.0f} MiB, elapsed {time.strftime('%H:%M:%S', time.gmtime(elapsed))}, ETA {eta_text}",
+              file=self.stream, flush=True)
+
+
+def batch(args):
+    input_dir = os.path.abspath(args.input_dir)
+    output_dir = os.path.abspath(args.output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST)
+
+    # resume: skip files finished in an earlier run unless they changed since
+    previous = load_manifest(manifest_path)
+    pending = []
+    skipped = 0
+    for rel_path in discover(input_dir):
+        record = previous.get(rel_path)
+        if record and (record["status"] == "done" or not args.retry_failed):
+            if {k: record.get(k) for k in ("size", "mtime_ns")} == file_state(os.path.join(input_dir, rel_path)):
+                skipped += 1
+                continue
+        pending.append(rel_path)
+
+    print(f"{len(pending)} files to process, {skipped} already recorded in {manifest_path}", file=sys.stderr)
+    if not pending:
+        return 0
+
+    progress = Progress(len(pending), interval=args.report_interval)
+    # a bounded number of files in flight keeps memory flat on 100k-file runs
+    max_in_flight = args.workers * 2
+    queue = iter(pending)
+    failed = 0
+
+    with open(manifest_path, "a", encoding="utf-8") as manifest, \
+            ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                                initargs=(args.verbose, args.metrics_dir, args.profile)) as pool:
+        in_flight = {}
+
+        def submit_next():
+            rel_path = next(queue, None)
+            if rel_path is not None:
+                in_flight[pool.submit(process_file, input_dir, rel_path, output_dir)] = rel_path
+
+        for _ in range(max_in_flight):
+            submit_next()
+
+        broken = []
+        while in_flight:
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            if broken:
+                # the pool is gone: collect whatever else finished, fail the rest
+                finished = list(in_flight)
+            for future in finished:
+                rel_path = in_flight.pop(future)
+                try:
+                    record = future.result()
+                except BrokenProcessPool:
+                    # a worker died (e.g. out of memory on one page). Which of the files in
+                    # flight killed it is unknown, so all of them are recorded as failed:
+                    # re-runs skip them instead of crashing on the same file again, and
+                    # --retry-failed redoes them
+                    broken.append(rel_path)
+                    record = {"path": rel_path, **file_state(os.path.join(input_dir, rel_path)),
+                              "status": "error", "error": "worker died"}
+                manifest.write(json.dumps(record, ensure_ascii=False) + "\n")
+                manifest.flush()
+                failed += record["status"] != "done"
+                progress.update(record)
+                if not broken:
+                    submit_next()
+
+    progress.report(force=True)
+    if broken:
+        print(f"Worker process died with {', '.join(broken)} in flight; recorded as failed, "
+              f"re-run to resume (--retry-failed to redo them)", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def pages(args):
+    from models_config import stanford_model
+    from page_pipeline import PagePipeline
+
+    pipeline = PagePipeline(stanford_model, args.output_dir, queue_depth=args.queue_depth, dpi=args.dpi,
+                            render_threads=args.render_threads)
+    output = pipeline.run(args.input_pdf)
+    report = pipeline.report
+    busy = ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in report["busy"].items())
+    print(f"{report['pages']} pages in {report['seconds']:.1f}s (busy: {busy}, queue depth {report['queue_depth']}, "
+          f"peak RSS {report['peak_rss_mb']:.0f} MiB) -> {output}", file=sys.stderr)
+    return 0
+
+
+def stream(args):
+    from models_config import stanford_model
+    from streaming import stream_deidentify
+    from log_analysis import write_json
+
+    on_results = None
+    if args.results:
+        if os.path.exists(args.results):
+            os.remove(args.results)
+        # one JSON line of rows per window
+        on_results = lambda rows: write_json(args.results, rows)
+
+    t0 = time.perf_counter()
+    written = 0
+    with open(args.output, "w", encoding="utf-8") as out:
+        for chunk in stream_deidentify(stanford_model, args.input, window=args.window, on_results=on_results):
+            out.write(chunk)
+            written += len(chunk)
+    print(f"Wrote {written:,} characters to {args.output} in {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+    return 0
+
+
+def export(args):
+    from case_store import CaseStore
+    from columnar_export import export_rows
+
+    t0 = time.perf_counter()
+    with CaseStore(args.store) as store:
+        documents, detections = export_rows(args.output_dir, store.iter_passes(args.case, args.pass_name),
+                                            fmt=args.format)
+    print(f"Exported {detections:,} detections from {documents:,} documents to {args.output_dir} "
+          f"in {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="deid", description="De-identify clinical documents")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    batch_parser = commands.add_parser("batch", help="de-identify every supported file under a directory")
+    batch_parser.add_argument("input_dir")
+    batch_parser.add_argument("output_dir")
+    batch_parser.add_argument("--workers", type=int, default=2,
+                              help="worker processes; each loads its own copy of the NER model")
+    batch_parser.add_argument("--retry-failed", action="store_true",
+                              help="reprocess files recorded as failed in the manifest")
+    batch_parser.add_argument("--report-interval", type=float, default=5.0,
+                              help="seconds between progress lines")
+    batch_parser.add_argument("--verbose", action="store_true", help="keep per-page output from workers")
+    batch_parser.add_argument("--metrics-dir", help="write per-file stage timings (stages.jsonl) and "
+                                                    "Prometheus metrics here (see instrumentation.py)")
+    batch_parser.add_argument("--profile", nargs="?", const="profiles", metavar="DIR",
+                              help="write a flame graph (collapsed stacks, speedscope) and tracemalloc top "
+                                   "allocations per file here (default: profiles; see profiling.py)")
+    batch_parser.set_defaults(func=batch)
+
+    pages_parser = commands.add_parser("pages", help="de-identify one PDF with OCR, NER and rendering overlapped per page")
+    pages_parser.add_argument("input_pdf")
+    pages_parser.add_argument("output_dir")
+    pages_parser.add_argument("--queue-depth", type=int, default=2,
+                              help="pages buffered between stages; bounds memory")
+    pages_parser.add_argument("--dpi", type=int, default=300)
+    pages_parser.add_argument("--render-threads", type=int, default=1,
+                              help="pages rasterized concurrently, pdf2image backend only (see pdf_pages.py)")
+    pages_parser.set_defaults(func=pages)
+
+    stream_parser = commands.add_parser("stream", help="de-identify a text file of any size in windows")
+    stream_parser.add_argument("input")
+    stream_parser.add_argument("output")
+    stream_parser.add_argument("--results", help="also write results rows (JSON lines, one per window)")
+    stream_parser.add_argument("--window", type=int, default=20000, help="characters analyzed per window")
+    stream_parser.set_defaults(func=stream)
+
+    export_parser = commands.add_parser("export", help="write results from the case store as Arrow/Parquet tables")
+    export_parser.add_argument("output_dir")
+    export_parser.add_argument("--store", default=os.path.join("logs", "cases.db"))
+    export_parser.add_argument("--case", help="only this case (default: every case)")
+    export_parser.add_argument("--pass", dest="pass_name", default="second", help="which pass to export")
+    export_parser.add_argument("--format", choices=("arrow", "parquet"), default="arrow")
+    export_parser.set_defaults(func=export)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
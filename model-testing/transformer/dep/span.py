@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from interval_index import IntervalIndex
 
 # Helper functions to run parallel PII/PHI deidentification-
 # Stanford model is trained on radiology & biomedical documents
@@ -41,34 +42,34 @@ def merge_spans(spans_a, spans_b, prefer=None):
     # 
     all_spans.sort(key=lambda s: (s.start, -(s.length), -s.score))
 
-    merged = []
+    # merged spans indexed as they are accepted; all_spans is in start order, so each
+    # candidate is appended after everything already indexed
+    merged = IntervalIndex()
     for s in all_spans:
         overlap = False
-        for m in merged:
-            if not (s.end <= m.start or s.start >= m.end):
-                # overlapping spans -> decide winner
-                overlap = True
-
-                # if we select an entity to be preferred
-                if prefer and s.entity_type in prefer:
-                    winner = s if prefer[s.entity_type] == s.source else m
-                    loser  = m if winner is s else s
+        hits = merged.overlapping(s.start, s.end)
+        if hits:
+            # overlapping spans -> decide winner against the first one
+            overlap = True
+            i = hits[0]
+            m = merged.values[i]
 
+            # if we select an entity to be preferred
+            if prefer and s.entity_type in prefer:
+                winner = s if prefer[s.entity_type] == s.source else m
+            else:
+                if s.length != m.length:
+                    winner = s if s.length > m.length else m
                 else:
-                    if s.length != m.length:
-                        winner = s if s.length > m.length else m
-                        loser  = m if winner is s else s
-                    else:
-                        winner = s if s.score > m.score else m
-                        loser  = m if winner is s else s
+                    winner = s if s.score > m.score else m
 
-                if winner is s:
-                    merged.remove(loser)
-                    merged.append(winner)
-                break
+            if winner is s:
+                merged.discard(i)
+                merged.append(s.start, s.end, s)
 
         if not overlap:
-            merged.append(s)
+            merged.append(s.start, s.end, s)
 
+    merged = [m for _, _, m in merged]
     merged.sort(key=lambda s: (s.start, s.end))
     return merged
@@ -0,0 +1,190 @@
+# Benchmarks for ClinicalDataFilter on large synthetic detection sets:
+#   overlap resolution against the previous O(n^2) code, and
+#   filter_results throughput (results filtered per second) against the previous rule code
+# Usage (from model-testing/transformer): python eval/bench_clinical_filter.py [--sizes 1000 10000 20000]
+import os
+import re
+import sys
+import glob
+import time
+import random
+import argparse
+
+from presidio_analyzer import RecognizerResult
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from clinical_filter import ClinicalDataFilter
+
+
+def legacy_resolve(results):
+    """ The previous _resolve_conflicts + _remove_nested_entities, kept as the reference. """
+    by_position = {}
+    for result in results:
+        by_position.setdefault((result.start, result.end), []).append(result)
+    priority = ClinicalDataFilter.ENTITY_PRIORITY
+    resolved = [max(c, key=lambda r: priority.get(r.entity_type, 0)) for c in by_position.values()]
+
+    keep = []
+    for result in sorted(resolved, key=lambda r: (r.end - r.start), reverse=True):
+        nested = any(
+            k.entity_type in ClinicalDataFilter.CONTAINER_TYPES
+            and k.start <= result.start and result.end <= k.end
+            and result.entity_type in ClinicalDataFilter.NESTED_TYPES
+            for k in keep
+        )
+        if not nested:
+            keep.append(result)
+    return sorted(keep, key=lambda r: r.start)
+
+
+def legacy_should_preserve(detected_text, full_text, result):
+    """ The previous _should_preserve, kept as the reference. """
+    if result.entity_type == "DATE_TIME":
+        if detected_text.lower() in ClinicalDataFilter.RELATIVE_TIMES:
+            return True
+        for pattern in ClinicalDataFilter.DURATION_PATTERNS:
+            if re.match(pattern, detected_text, re.IGNORECASE):
+                return True
+        context_before = full_text[max(0, result.start - 20):result.start].lower()
+        if any(word in context_before for word in ['in ', 'for ', 'x ', 'x~']):
+            if re.search(r'\d+\s+(week|day|month|year)s?', detected_text, re.IGNORECASE):
+                return True
+        context_before_expanded = full_text[max(0, result.start - 50):result.start].lower()
+        history_keywords = ['began', 'started', 'onset', 'quit', 'stopped',
+                            'diagnosed', 'since', 'symptoms', 'history']
+        if any(keyword in context_before_expanded for keyword in history_keywords):
+            return True
+    if result.entity_type == "AGE":
+        age_match = re.search(r'\d+', detected_text)
+        if age_match and int(age_match.group()) < 89:
+            return True
+    return False
+
+
+def legacy_is_false_positive(detected_text, entity_type):
+    """ The previous _is_false_positive, kept as the reference. """
+    text_lower = detected_text.lower().strip()
+    if text_lower in ClinicalDataFilter.MEDICAL_TERMS:
+        return True
+    if len(text_lower) <= 2 and entity_type in ['PERSON', 'ORGANIZATION', 'LOCATION']:
+        return True
+    if entity_type == "DATE_TIME":
+        if re.match(r'^(week|day|month|year)s?$', detected_text, re.IGNORECASE):
+            return True
+        if re.match(r'^\d{5}$', detected_text):
+            return True
+        if re.match(r'^\d+$', detected_text) and len(detected_text) > 4:
+            return True
+    if entity_type == 'ORGANIZATION':
+        if re.match(r'^[A-Z]{2}$', detected_text):
+            return True
+        if re.search(r'x\s*~?\s*\d+', detected_text):
+            return True
+    if entity_type == 'PERSON' and len(detected_text.split()) == 1:
+        med_suffixes = ['pril', 'statin', 'olol', 'pine', 'cillin', 'mycin', 'oxacin']
+        if any(text_lower.endswith(suffix) for suffix in med_suffixes):
+            return True
+    return False
+
+
+def legacy_keep(text, results):
+    kept = []
+    for result in results:
+        detected_text = text[result.start:result.end].strip()
+        if legacy_should_preserve(detected_text, text, result):
+            continue
+        if legacy_is_false_positive(detected_text, result.entity_type):
+            continue
+        kept.append(result)
+    return kept
+
+
+def new_keep(text, results):
+    """ filter_results step 2 only (no name cleaning or overlap resolution) """
+    return ClinicalDataFilter._apply_rules(
+        text, results, ClinicalDataFilter.PRESERVE_RULES, ClinicalDataFilter.FALSE_POSITIVE_RULES)
+
+
+def make_note_detections(n, seed=0):
+    """ Sample clinical notes concatenated, with n detections on 1-3 word spans of it. """
+    rng = random.Random(seed)
+    sample_dir = os.path.join(os.path.dirname(__file__), '..', '..', 'sample_data')
+    text = "\n".join(open(f, encoding="utf-8").read() for f in sorted(glob.glob(os.path.join(sample_dir, "*.txt"))))
+    words = [m.span() for m in re.finditer(r"\S+", text)]
+    types = ['DATE_TIME'] * 4 + ['PERSON'] * 3 + ['AGE', 'ORGANIZATION', 'LOCATION', 'PHONE_NUMBER', 'MRN']
+    results = []
+    for _ in range(n):
+        i = rng.randrange(len(words) - 3)
+        start, end = words[i][0], words[i + rng.randint(0, 2)][1]
+        results.append(RecognizerResult(rng.choice(types), start, end, rng.random()))
+    return text, results
+
+
+def make_detections(n, partial_overlaps=True, seed=0):
+    """ n raw detections laid out like analyzer output on a long note: mostly disjoint
+    spans, plus duplicates tagged with a second type, entities nested in containers and,
+    optionally, partially overlapping spans from different recognizers.
+    """
+    rng = random.Random(seed)
+    types = list(ClinicalDataFilter.ENTITY_PRIORITY)
+    results = []
+    pos = 0
+    while len(results) < n:
+        length = rng.randint(4, 40)
+        etype = rng.choice(types)
+        results.append(RecognizerResult(etype, pos, pos + length, rng.random()))
+        roll = rng.random()
+        if roll < 0.15:
+            results.append(RecognizerResult(rng.choice(types), pos, pos + length, rng.random()))
+        elif roll < 0.30 and length > 6:
+            inner = pos + rng.randint(1, length - 3)
+            results.append(RecognizerResult(rng.choice(types), inner, inner + 2, rng.random()))
+        elif roll < 0.40 and partial_overlaps:
+            results.append(RecognizerResult(rng.choice(types), pos + length // 2, pos + length + 5, rng.random()))
+        pos += length + rng.randint(6, 30)
+    rng.shuffle(results)
+    return results
+
+
+def _keys(results):
+    return sorted((r.start, r.end, r.entity_type) for r in results)
+
+
+def _timed(func, *args):
+    t0 = time.perf_counter()
+    out = func(*args)
+    return out, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 20000])
+    args = parser.parse_args()
+
+    print(f"{'detections':>10} {'legacy (s)':>11} {'sweep (s)':>10} {'kept':>7} {'same w/o partial':>17}")
+    for n in args.sizes:
+        # equivalence is only defined where the legacy code is complete (no partial overlaps)
+        clean = make_detections(n, partial_overlaps=False)
+        expected = legacy_resolve(clean)
+        same = _keys(ClinicalDataFilter.resolve_overlaps("", clean)) == _keys(expected)
+
+        results = make_detections(n)
+        _, legacy_time = _timed(legacy_resolve, results)
+        kept, sweep_time = _timed(ClinicalDataFilter.resolve_overlaps, "", results)
+
+        print(f"{n:>10} {legacy_time:>11.3f} {sweep_time:>10.3f} {len(kept):>7} {'yes' if same else 'NO':>17}")
+
+    print()
+    print(f"{'detections':>10} {'legacy (res/s)':>15} {'table (res/s)':>14} {'filter_results (res/s)':>23} {'same':>5}")
+    for n in args.sizes:
+        text, results = make_note_detections(n)
+        expected, legacy_time = _timed(legacy_keep, text, results)
+        kept, new_time = _timed(new_keep, text, results)
+        _, full_time = _timed(ClinicalDataFilter.filter_results, text, results)
+        same = [id(r) for r in kept] == [id(r) for r in expected]
+        print(f"{n:>10} {n / legacy_time:>15,.0f} {n / new_time:>14,.0f} {n / full_time:>23,.0f} {'yes' if same else 'NO':>5}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# Scaling benchmark for group_entities.group_names
+# Usage (from model-testing/transformer): python eval/bench_group_names.py [--sizes 10 100 1000 10000]
+import os
+import sys
+import time
+import random
+import argparse
+
+from faker import Faker
+from rapidfuzz import fuzz
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from group_entities import group_names
+
+
+def legacy_group_names(entities, score_cutoff=60):
+    """ Pairwise double loop + adjacency list, kept here only as the reference implementation. """
+    names = [t.replace(" ", "").lower() for t in entities]
+    name_to_entity = dict(zip(names, entities))
+
+    sim_list = {}
+    for str1 in names:
+        for str2 in names:
+            if str1 != str2 and (str1, str2) not in sim_list and (str2, str1) not in sim_list:
+                sim_list[(str1, str2)] = fuzz.WRatio(str1, str2, score_cutoff=score_cutoff)
+    matches = [m[0] for m in sorted(sim_list.items(), key=lambda x: x[1], reverse=True) if m[1] > 0]
+
+    adj = {}
+    for u, v in matches:
+        adj.setdefault(u, []).append(v)
+        adj.setdefault(v, []).append(u)
+
+    buckets = []
+    visited = set()
+    for node in adj:
+        if node in visited:
+            continue
+        component = {name_to_entity[node]}
+        stack = [node]
+        visited.add(node)
+        while stack:
+            for neighbor in adj[stack.pop()]:
+                if neighbor not in visited:
+                    visited.add(neighbor)
+                    stack.append(neighbor)
+                    component.add(name_to_entity[neighbor])
+        buckets.append(component)
+
+    for name in set(names) - visited:
+        buckets.append({name_to_entity[name]})
+    return buckets
+
+
+def make_mentions(n, seed=0, with_people=False):
+    """ n PERSON mentions drawn from roughly n/4 people, with the variants clinical notes use.
+    with_people=True also returns the index of the person behind each mention.
+    """
+    fake = Faker()
+    Faker.seed(seed)
+    rng = random.Random(seed)
+    people = [(fake.first_name(), fake.last_name()) for _ in range(max(1, n // 4))]
+    variants = [
+        lambda f, l: f"{f} {l}",
+        lambda f, l: f"Dr. {l}",
+        lambda f, l: l,
+        lambda f, l: f"{f[0]}. {l}",
+        lambda f, l: f"{l}, {f}",
+    ]
+    owners = [rng.randrange(len(people)) for _ in range(n)]
+    mentions = [rng.choice(variants)(*people[p]) for p in owners]
+    return (mentions, owners) if with_people else mentions
+
+
+def _as_partition(buckets):
+    return {frozenset(b) for b in buckets}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--legacy-max", type=int, default=1000,
+                        help="largest size the pairwise reference is run on")
+    parser.add_argument("--score-cutoff", type=int, default=60)
+    args = parser.parse_args()
+
+    print(f"{'mentions':>9} {'unique':>7} {'groups':>7} {'cdist (s)':>10} {'legacy (s)':>11} {'same':>5}")
+    for n in args.sizes:
+        mentions = make_mentions(n)
+        unique = len({m.replace(" ", "").lower() for m in mentions})
+
+        t0 = time.perf_counter()
+        groups = group_names(mentions, score_cutoff=args.score_cutoff)
+        new_time = time.perf_counter() - t0
+
+        legacy_time, same = "-", "-"
+        if n <= args.legacy_max:
+            t0 = time.perf_counter()
+            expected = legacy_group_names(mentions, score_cutoff=args.score_cutoff)
+            legacy_time = f"{time.perf_counter() - t0:.3f}"
+            same = "yes" if _as_partition(groups) == _as_partition(expected) else "NO"
+
+        print(f"{n:>9} {unique:>7} {len(groups):>7} {new_time:>10.3f} {legacy_time:>11} {same:>5}")
+
+
+if __name__ == "__main__":
+    main()
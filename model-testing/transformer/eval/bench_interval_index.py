@@ -0,0 +1,184 @@
+# Benchmarks for the IntervalIndex-based span code against the code it replaced:
+#   word -> entity linking (match_results.link_json), model span merging (dep/span.merge_spans)
+#   and splicing replacements into the text (ContextAwareAnonymizer.anonymize)
+# "link+wide" links the same document with one page-wide span added at the start (an
+# address block, a whole-page ORGANIZATION), which the old pointer walk mislinks; its
+# time should stay close to "link".
+# Usage (from model-testing/transformer): python eval/bench_interval_index.py [--sizes 1000 10000 100000]
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from interval_index import IntervalIndex
+from dep.span import Span, merge_spans
+
+
+def legacy_link(words, entities):
+    """ The previous link_json pointer walk, kept as the reference. """
+    entities = sorted(entities, key=lambda e: e["start"])
+    out = {}
+    k = 0
+    for n, (word_start, word_end) in enumerate(words):
+        while k < len(entities) and word_start >= entities[k]["end"]:
+            k += 1
+        if k >= len(entities):
+            break
+        es, ee = entities[k]["start"], entities[k]["end"]
+        if word_start < ee and word_end > es:
+            out[n] = entities[k]["replacement"] if word_start <= es < word_end else ""
+    return out
+
+
+def new_link(words, entities):
+    index = IntervalIndex.from_spans(entities, key=lambda e: (e["start"], e["end"]))
+    out = {}
+    for n, (word_start, word_end) in enumerate(words):
+        hits = index.overlapping(word_start, word_end)
+        if hits:
+            entity = index.values[hits[0]]
+            out[n] = entity["replacement"] if word_start <= entity["start"] < word_end else ""
+    return out
+
+
+def legacy_merge_spans(spans_a, spans_b, prefer=None):
+    """ The previous merge_spans (linear scan of everything merged so far), kept as the reference. """
+    all_spans = sorted(list(spans_a) + list(spans_b), key=lambda s: (s.start, -(s.length), -s.score))
+    merged = []
+    for s in all_spans:
+        overlap = False
+        for m in merged:
+            if not (s.end <= m.start or s.start >= m.end):
+                overlap = True
+                if prefer and s.entity_type in prefer:
+                    winner = s if prefer[s.entity_type] == s.source else m
+                elif s.length != m.length:
+                    winner = s if s.length > m.length else m
+                else:
+                    winner = s if s.score > m.score else m
+                if winner is s:
+                    merged.remove(m)
+                    merged.append(s)
+                break
+        if not overlap:
+            merged.append(s)
+    merged.sort(key=lambda s: (s.start, s.end))
+    return merged
+
+
+def legacy_splice(text, spans):
+    """ The previous anonymize splice: reverse order, one string copy per replacement. """
+    for start, end, replacement in sorted(spans, reverse=True):
+        text = text[:start] + replacement + text[end:]
+    return text
+
+
+def new_splice(text, spans):
+    index = IntervalIndex.from_spans(spans, key=lambda s: (s[0], s[1]))
+    pieces, cursor = [], 0
+    for start, end, (_, _, replacement) in index:
+        pieces.append(text[cursor:start])
+        pieces.append(replacement)
+        cursor = end
+    pieces.append(text[cursor:])
+    return "".join(pieces)
+
+
+def make_document(n, seed=0):
+    """ n disjoint entities over a document of words: (text, word spans, entity dicts) """
+    rng = random.Random(seed)
+    words, entities, parts = [], [], []
+    pos = 0
+    while len(entities) < n:
+        length = rng.randint(2, 10)
+        words.append((pos, pos + length))
+        parts.append("x" * length + " ")
+        if rng.random() < 0.2:
+            # entities cover 1-3 consecutive words
+            extra = rng.randint(0, 2)
+            end = pos + length
+            for _ in range(extra):
+                end += 1
+                length = rng.randint(2, 10)
+                words.append((end, end + length))
+                parts.append("y" * length + " ")
+                end += length
+            entities.append({"start": pos, "end": end, "replacement": f"<{len(entities)}>"})
+            pos = end + 1
+        else:
+            pos += length + 1
+    return "".join(parts), words, entities
+
+
+def _span(start, end, entity_type, score, source):
+    return Span(start, end, end - start, entity_type, score, source)
+
+
+def make_model_spans(n, seed=0):
+    """ two models' detections over the same text: same spans, shifted edges, extra spans """
+    rng = random.Random(seed)
+    spans_a, spans_b = [], []
+    pos = 0
+    for _ in range(n):
+        length = rng.randint(3, 30)
+        spans_a.append(_span(pos, pos + length, "PERSON", rng.random(), "presidio"))
+        roll = rng.random()
+        if roll < 0.5:
+            shift = rng.randint(-2, 2)
+            spans_b.append(_span(max(0, pos + shift), pos + length + rng.randint(-2, 4), "PERSON", rng.random(), "stanford"))
+        elif roll < 0.6:
+            spans_b.append(_span(pos + length + 1, pos + length + 4, "ID", rng.random(), "stanford"))
+        pos += length + rng.randint(5, 20)
+    return spans_a, spans_b
+
+
+def _timed(func, *args):
+    t0 = time.perf_counter()
+    out = func(*args)
+    return out, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--legacy-max", type=int, default=20000,
+                        help="largest size the quadratic merge/splice references are run on")
+    args = parser.parse_args()
+
+    print(f"{'spans':>7} {'task':>9} {'legacy (s)':>11} {'index (s)':>10} {'same':>5}")
+    for n in args.sizes:
+        text, words, entities = make_document(n)
+        expected, legacy_time = _timed(legacy_link, words, entities)
+        linked, new_time = _timed(new_link, words, entities)
+        print(f"{n:>7} {'link':>9} {legacy_time:>11.3f} {new_time:>10.3f} {'yes' if linked == expected else 'NO':>5}")
+
+        wide = [{"start": 0, "end": len(text), "replacement": "<WIDE>"}] + entities
+        linked, new_time = _timed(new_link, words, wide)
+        # every word is under the wide span, which starts before all of them
+        same = "yes" if linked == {n: "<WIDE>" if n == 0 else "" for n in range(len(words))} else "NO"
+        print(f"{n:>7} {'link+wide':>9} {'-':>11} {new_time:>10.3f} {same:>5}")
+
+        spans_a, spans_b = make_model_spans(n)
+        merged, new_time = _timed(merge_spans, spans_a, spans_b)
+        legacy_time, same = "-", "-"
+        if n <= args.legacy_max:
+            expected, legacy_time = _timed(legacy_merge_spans, spans_a, spans_b)
+            legacy_time = f"{legacy_time:.3f}"
+            same = "yes" if [(s.start, s.end, s.source) for s in merged] == [(s.start, s.end, s.source) for s in expected] else "NO"
+        print(f"{n:>7} {'merge':>9} {legacy_time:>11} {new_time:>10.3f} {same:>5}")
+
+        splices = [(e["start"], e["end"], e["replacement"]) for e in entities]
+        spliced, new_time = _timed(new_splice, text, splices)
+        legacy_time, same = "-", "-"
+        if n <= args.legacy_max:
+            expected, legacy_time = _timed(legacy_splice, text, splices)
+            legacy_time = f"{legacy_time:.3f}"
+            same = "yes" if spliced == expected else "NO"
+        print(f"{n:>7} {'splice':>9} {legacy_time:>11} {new_time:>10.3f} {same:>5}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# Recall/speed of group_names(blocking=True) against the exhaustive all-pairs mode
+# on synthetic Faker rosters.
+# Usage (from model-testing/transformer): python eval/bench_name_blocking.py [--sizes 1000 5000 20000]
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from group_entities import group_names, _normalize
+from bench_group_names import make_mentions
+
+
+def group_of(buckets):
+    """ normalized name -> group number """
+    lookup = {}
+    for g, bucket in enumerate(buckets):
+        for entity in bucket:
+            lookup[_normalize(entity)] = g
+    return lookup
+
+
+def same_person_recall(mentions, owners, exhaustive, blocked):
+    """ Of the mention pairs that refer to the same roster person and that the exhaustive
+    mode groups together, the share that blocking also groups together.
+    """
+    ex_group, bl_group = group_of(exhaustive), group_of(blocked)
+    by_person = {}
+    for mention, owner in zip(mentions, owners):
+        by_person.setdefault(owner, set()).add(_normalize(mention))
+
+    expected = found = 0
+    for names in by_person.values():
+        names = sorted(names)
+        for i, a in enumerate(names):
+            for b in names[i + 1:]:
+                if ex_group[a] == ex_group[b]:
+                    expected += 1
+                    found += bl_group[a] == bl_group[b]
+    return found / expected if expected else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--score-cutoff", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'mentions':>9} {'exhaustive (s)':>15} {'blocking (s)':>13} {'recall':>7} {'groups ex/bl':>13}")
+    for n in args.sizes:
+        mentions, owners = make_mentions(n, seed=args.seed, with_people=True)
+
+        t0 = time.perf_counter()
+        exhaustive = group_names(mentions, score_cutoff=args.score_cutoff)
+        ex_time = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        blocked = group_names(mentions, score_cutoff=args.score_cutoff, blocking=True)
+        bl_time = time.perf_counter() - t0
+
+        # blocking only removes candidate pairs, so its groups refine the exhaustive ones
+        # and recall is the only number that can move
+        recall = same_person_recall(mentions, owners, exhaustive, blocked)
+        print(f"{n:>9} {ex_time:>15.3f} {bl_time:>13.3f} {recall:>7.4f} {len(exhaustive):>6}/{len(blocked):<6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# Pages per second of PDF OCR (tesseract_test.ocr_file) against the number of worker
+# processes. The text layer is turned off so every page is rendered and OCR'd; --copies
+# repeats the PDF to get a longer document. Each worker count must write the same text as
+# one worker, page for page. --engine compares in-process tesserocr with a tesseract
+# process per page (see ocr_engine.py).
+# Usage (from model-testing/transformer):
+#   python eval/bench_ocr_workers.py [--pdf data/sample_pdf.pdf] [--copies 4] [--workers 1 2 4] [--trials 3]
+#                                    [--engine tesserocr|pytesseract]
+import os
+import sys
+import time
+import argparse
+import tempfile
+import contextlib
+import statistics
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from configurations import PIPELINE_CONFIGURATION
+from ocr_engine import ENGINES, default_engine
+from pdf_pages import _pymupdf
+from tesseract_test import ocr_file
+
+
+def repeated_pdf(pdf_path, copies, out_path):
+    pymupdf = _pymupdf()
+    if pymupdf is None:
+        raise ImportError("--copies needs PyMuPDF: pip install pymupdf")
+    with pymupdf.open(pdf_path) as src, pymupdf.open() as out:
+        for _ in range(copies):
+            out.insert_pdf(src)
+        out.save(out_path)
+        return out.page_count
+
+
+def default_workers():
+    cores = os.cpu_count() or 1
+    counts = [1]
+    while counts[-1] * 2 <= cores:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != cores:
+        counts.append(cores)
+    return counts
+
+
+def run(pdf_path, workers, out_dir):
+    # ocr_file prints per page
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        t0 = time.perf_counter()
+        results = ocr_file(pdf_path, out_dir, workers=workers)
+        seconds = time.perf_counter() - t0
+    return seconds, [text for _, text in results]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pdf", default=os.path.join(os.path.dirname(__file__), '..', 'data', 'sample_pdf.pdf'))
+    parser.add_argument("--copies", type=int, default=1, help="repeat the PDF this many times")
+    parser.add_argument("--workers", type=int, nargs="+", default=default_workers())
+    parser.add_argument("--trials", type=int, default=3)
+    parser.add_argument("--engine", choices=ENGINES, help="default: PIPELINE_CONFIGURATION['OCR_ENGINE']")
+    args = parser.parse_args()
+
+    PIPELINE_CONFIGURATION["PDF_TEXT_LAYER"] = False
+    if args.engine:
+        PIPELINE_CONFIGURATION["OCR_ENGINE"] = args.engine
+    with tempfile.TemporaryDirectory(prefix="bench_ocr_") as tmp:
+        pdf_path = args.pdf
+        if args.copies > 1:
+            pdf_path = os.path.join(tmp, "document.pdf")
+            pages = repeated_pdf(args.pdf, args.copies, pdf_path)
+        else:
+            with _pymupdf().open(pdf_path) as doc:
+                pages = doc.page_count
+        print(f"{pages} pages, {default_engine()}, {os.cpu_count()} cores, median of {args.trials} trials")
+
+        # warm-up: imports, the language model in the page cache
+        _, reference = run(pdf_path, 1, os.path.join(tmp, "warmup"))
+        print(f"{'workers':>7} {'seconds':>8} {'pages/s':>8} {'speedup':>8} {'same text':>10}")
+        base = None
+        for workers in args.workers:
+            times = []
+            same = True
+            for trial in range(args.trials):
+                seconds, texts = run(pdf_path, workers, os.path.join(tmp, f"w{workers}_{trial}"))
+                times.append(seconds)
+                same = same and texts == reference
+            seconds = statistics.median(times)
+            base = base or seconds
+            print(f"{workers:>7} {seconds:>8.2f} {pages / seconds:>8.2f} {base / seconds:>7.2f}x {'yes' if same else 'NO':>10}")
+
+
+if __name__ == "__main__":
+    main()
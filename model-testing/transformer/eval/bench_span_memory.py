@@ -0,0 +1,140 @@
+# Peak memory of the post-analysis pipeline on a long document (default 500 pages):
+#   before: Presidio RecognizerResults (with explanations) all the way through, and every
+#           JSON row built in a list before writing the results file
+#   after:  SpanRecords from analysis on, rows streamed into the results file
+# Both runs post-process, group, anonymize and write the same results file.
+# Usage (from model-testing/transformer): python eval/bench_span_memory.py [--pages 500] [--per-page 60]
+import os
+import re
+import sys
+import glob
+import json
+import time
+import random
+import argparse
+import tempfile
+import contextlib
+import tracemalloc
+
+from faker import Faker
+from presidio_analyzer import RecognizerResult, AnalysisExplanation
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from postprocess import PostProcessingPipeline
+from context_anonymizer import ContextAwareAnonymizer
+from group_entities import group_names
+from log_analysis import iter_rows, write_json
+from span_record import to_records
+
+PAGE_CHARS = 3000
+TYPES = ['DATE_TIME'] * 4 + ['PERSON'] * 3 + ['AGE', 'ORGANIZATION', 'LOCATION', 'PHONE_NUMBER', 'MRN']
+
+
+def make_document(pages):
+    sample_dir = os.path.join(os.path.dirname(__file__), '..', '..', 'sample_data')
+    sample = "\n".join(open(f, encoding="utf-8").read() for f in sorted(glob.glob(os.path.join(sample_dir, "*.txt"))))
+    text = (sample * (pages * PAGE_CHARS // len(sample) + 1))[:pages * PAGE_CHARS]
+    return text
+
+
+def word_spans(text):
+    return [m.span() for m in re.finditer(r"\S+", text)]
+
+
+def analyze(text, words, per_page, seed=0):
+    """ Stand-in for analyzer.analyze(): RecognizerResults shaped like Presidio's, with an
+    AnalysisExplanation and recognition_metadata on each, over 1-3 word spans of text.
+    """
+    rng = random.Random(seed)
+    results = []
+    for _ in range(per_page * len(text) // PAGE_CHARS):
+        i = rng.randrange(len(words) - 3)
+        start, end = words[i][0], words[i + rng.randint(0, 2)][1]
+        # the same text may come out as several types, as with overlapping recognizers;
+        # DemographicContext keys identities by f"{entity_type}:{value}"
+        etype = rng.choice(TYPES)
+        score = rng.random()
+        explanation = AnalysisExplanation(
+            recognizer=f"{etype.title()}Recognizer", original_score=score,
+            pattern_name=f"{etype.lower()} (medium)", pattern=r"\b\d{1,2}/\d{1,2}/\d{2,4}\b",
+            textual_explanation=f"Identified as {etype} by {etype.title()}Recognizer")
+        results.append(RecognizerResult(etype, start, end, score, analysis_explanation=explanation,
+                                        recognition_metadata={"recognizer_name": f"{etype.title()}Recognizer",
+                                                              "recognizer_identifier": f"{etype.title()}Recognizer_{id(explanation)}"}))
+    return results
+
+
+def run(text, words, per_page, compact, out_path):
+    results = analyze(text, words, per_page)
+    if compact:
+        results = to_records(results)
+    results = PostProcessingPipeline().run(text, results)
+    groups = group_names([text[r.start:r.end] for r in results if r.entity_type == "PERSON"])
+    anonymizer = ContextAwareAnonymizer(groups)
+    anonymizer.anonymize(text=text, analyzer_results=results)
+    rows = iter_rows(text, results, anonymizer.replacements)
+    if not compact:
+        rows = list(rows)
+    write_json(out_path, rows)
+    return len(results)
+
+
+def measure(text, words, per_page, compact):
+    with tempfile.TemporaryDirectory() as tmp:
+        out_path = os.path.join(tmp, "results")
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        # DemographicContext prints the name groupings; keep them off the report
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            kept = run(text, words, per_page, compact, out_path)
+        seconds = time.perf_counter() - t0
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        with open(out_path, encoding="utf-8") as f:
+            rows = json.load(f)
+    return peak, seconds, kept, rows
+
+
+def retained(results_factory):
+    """ bytes held by a list of detections while it is alive """
+    tracemalloc.start()
+    results = results_factory()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current, len(results)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--per-page", type=int, default=60, help="raw detections per page")
+    args = parser.parse_args()
+
+    text = make_document(args.pages)
+    words = word_spans(text)
+    print(f"{args.pages} pages, {len(text):,} chars, {args.per_page * args.pages:,} raw detections")
+
+    raw = analyze(text, words, args.per_page)
+    held_raw, n = retained(lambda: analyze(text, words, args.per_page))
+    held_compact, _ = retained(lambda: to_records(raw))
+    print(f"held per detection: RecognizerResult {held_raw / n:.0f} B, SpanRecord {held_compact / n:.0f} B")
+    del raw
+
+    print(f"{'pipeline':>14} {'peak (MiB)':>11} {'seconds':>8} {'kept':>7}")
+    outputs = {}
+    # ContextAwareAnonymizer draws surrogates from Faker; seed both runs the same way
+    for name, compact in (("RecognizerResult", False), ("SpanRecord", True)):
+        Faker.seed(0)
+        peak, seconds, kept, rows = measure(text, words, args.per_page, compact)
+        outputs[name] = rows
+        print(f"{name:>14} {peak / 2**20:>11.1f} {seconds:>8.2f} {kept:>7}")
+
+    # surrogates are random, so compare everything but the replacement text
+    strip = lambda rows: [{k: v for k, v in row.items() if k != "replacement"} for row in rows]
+    same = strip(outputs["RecognizerResult"]) == strip(outputs["SpanRecord"])
+    print(f"same results rows: {'yes' if same else 'NO'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+# Regression gate between two eval/eval.py result files.
+#   Speed: per suite and stage, the ratio of median latency candidate/baseline with a
+#          bootstrap confidence interval (trials resampled, then documents within each
+#          trial). A stage is a regression when the whole interval is above 1 + --max-slowdown
+#          and its median grew by more than --min-delta-ms (sub-millisecond stages are noisy).
+#   Recall: per entity type on the synth suite, candidate minus baseline recall with a
+#          bootstrap interval over documents (paired when both runs scored the same
+#          documents). A type is a regression when the whole interval is below minus --max-recall-drop.
+# If recognizers.py, clinical_filter.py, the model or pipeline configuration changed between
+# the runs, both must include the synth suite, so recall is never skipped.
+# Exit status: 0 no regression, 1 regression (or recall not evaluated).
+# Usage (from model-testing/transformer):
+#   python eval/compare_runs.py <baseline.json> <candidate.json> [--max-slowdown 0.05] [--min-delta-ms 0.25]
+#                               [--max-recall-drop 0] [--confidence 0.95] [--resamples 2000] [--json report.json]
+import sys
+import json
+import argparse
+
+import numpy as np
+
+# a change to any of these must be evaluated for recall, not only speed
+RECALL_SENSITIVE_FILES = {"recognizers.py", "clinical_filter.py", "configurations.py", "models_config.py"}
+MIN_SAMPLES = 5
+
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def interval(values, confidence):
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.percentile(values, [tail, 100 - tail])
+    return float(low), float(high)
+
+
+def bootstrap_median(trials, rng, resamples):
+    """ Medians of `resamples` two-level resamples: trials with replacement, then each
+    chosen trial's samples with replacement """
+    trials = [np.asarray(t, dtype=float) for t in trials if len(t)]
+    medians = np.empty(resamples)
+    for i in range(resamples):
+        chosen = rng.integers(len(trials), size=len(trials))
+        medians[i] = np.median(np.concatenate([trials[t][rng.integers(len(trials[t]), size=len(trials[t]))]
+                                               for t in chosen]))
+    return medians
+
+
+def compare_latency(baseline, candidate, args, rng):
+    """ One row per stage present in both runs of a suite """
+    rows = []
+    stages = sorted(set(baseline["trials"][0]["latency"]) & set(candidate["trials"][0]["latency"]))
+    for stage in stages:
+        base = [t["latency"].get(stage, []) for t in baseline["trials"]]
+        cand = [t["latency"].get(stage, []) for t in candidate["trials"]]
+        n_base, n_cand = sum(map(len, base)), sum(map(len, cand))
+        row = {"stage": stage, "n_baseline": n_base, "n_candidate": n_cand,
+               "baseline_p50": float(np.median(np.concatenate(base))) if n_base else None,
+               "candidate_p50": float(np.median(np.concatenate(cand))) if n_cand else None}
+        if n_base < MIN_SAMPLES or n_cand < MIN_SAMPLES or not row["baseline_p50"]:
+            row.update(ratio=None, low=None, high=None, regression=False, note="too few samples")
+            rows.append(row)
+            continue
+        ratios = bootstrap_median(cand, rng, args.resamples) / np.maximum(bootstrap_median(base, rng, args.resamples), 1e-12)
+        low, high = interval(ratios, args.confidence)
+        delta_ms = (row["candidate_p50"] - row["baseline_p50"]) * 1e3
+        row.update(ratio=row["candidate_p50"] / row["baseline_p50"], low=low, high=high,
+                   regression=low > 1 + args.max_slowdown and delta_ms > args.min_delta_ms)
+        rows.append(row)
+    return rows
+
+
+def _counts(per_document, label):
+    """ tp and fn arrays over documents for one label """
+    tp = np.array([doc.get(label, (0, 0, 0))[0] for doc in per_document], dtype=float)
+    fn = np.array([doc.get(label, (0, 0, 0))[2] for doc in per_document], dtype=float)
+    return tp, fn
+
+
+def _recall(tp, fn):
+    gold = tp.sum(axis=-1) + fn.sum(axis=-1)
+    return np.divide(tp.sum(axis=-1), gold, out=np.full(np.shape(gold), np.nan), where=gold > 0)
+
+
+def compare_recall(baseline, candidate, args, rng):
+    """ One row per entity type with gold spans in the baseline """
+    base_docs = baseline["accuracy_per_document"]
+    cand_docs = candidate["accuracy_per_document"]
+    # same documents in the same order: resample them together
+    paired = len(base_docs) == len(cand_docs)
+    rows = []
+    for label, totals in sorted(baseline["accuracy"].items()):
+        if totals["tp"] + totals["fn"] == 0:
+            continue
+        cand_totals = candidate["accuracy"].get(label, {"tp": 0, "fn": 0})
+        base_tp, base_fn = _counts(base_docs, label)
+        cand_tp, cand_fn = _counts(cand_docs, label)
+        base_index = rng.integers(len(base_docs), size=(args.resamples, len(base_docs)))
+        cand_index = base_index if paired else rng.integers(len(cand_docs), size=(args.resamples, len(cand_docs)))
+        diffs = _recall(cand_tp[cand_index], cand_fn[cand_index]) - _recall(base_tp[base_index], base_fn[base_index])
+        diffs = diffs[~np.isnan(diffs)]
+        base_recall = float(_recall(base_tp, base_fn))
+        cand_recall = float(_recall(cand_tp, cand_fn))
+        row = {"entity_type": label, "baseline_recall": base_recall, "candidate_recall": cand_recall,
+               "baseline_tp": totals["tp"], "candidate_tp": cand_totals["tp"],
+               "gold": totals["tp"] + totals["fn"], "paired": paired}
+        if len(diffs) == 0 or np.isnan(cand_recall):
+            row.update(difference=None, low=None, high=None, regression=False, note="no gold spans in candidate")
+        else:
+            low, high = interval(diffs, args.confidence)
+            row.update(difference=cand_recall - base_recall, low=low, high=high,
+                       regression=high < -args.max_recall_drop)
+        rows.append(row)
+    return rows
+
+
+def changed_files(baseline, candidate):
+    base = baseline["meta"].get("tracked_files", {})
+    cand = candidate["meta"].get("tracked_files", {})
+    return sorted(name for name in set(base) | set(cand) if base.get(name) != cand.get(name))
+
+
+def compare(baseline, candidate, args):
+    rng = np.random.default_rng(args.seed)
+    report = {"baseline": baseline["meta"], "candidate": candidate["meta"], "changed_files": changed_files(baseline, candidate),
+              "latency": {}, "recall": None, "warnings": [], "regressions": []}
+    if baseline["meta"].get("pipeline_configuration") != candidate["meta"].get("pipeline_configuration"):
+        report["changed_files"].append("PIPELINE_CONFIGURATION")
+    if baseline["meta"].get("analyzer") != candidate["meta"].get("analyzer"):
+        report["changed_files"].append("analyzer")
+
+    for name in sorted(set(baseline["suites"]) | set(candidate["suites"])):
+        if name not in baseline["suites"] or name not in candidate["suites"]:
+            report["warnings"].append(f"suite '{name}' is only in one run; not compared")
+            continue
+        base, cand = baseline["suites"][name], candidate["suites"][name]
+        if base["documents"] != cand["documents"]:
+            report["warnings"].append(f"suite '{name}': {base['documents']} baseline vs {cand['documents']} candidate documents")
+        rows = report["latency"][name] = compare_latency(base, cand, args, rng)
+        report["regressions"] += [f"{name}/{r['stage']}: {r['ratio']:.2f}x slower (CI {r['low']:.2f}-{r['high']:.2f})"
+                                  for r in rows if r["regression"]]
+
+        if "accuracy_per_document" in base and "accuracy_per_document" in cand:
+            if base.get("iou") != cand.get("iou"):
+                report["warnings"].append(f"suite '{name}': scored at IoU {base.get('iou')} vs {cand.get('iou')}")
+            rows = report["recall"] = compare_recall(base, cand, args, rng)
+            report["regressions"] += [f"{name}/{r['entity_type']}: recall {r['baseline_recall']:.3f} -> "
+                                      f"{r['candidate_recall']:.3f} (CI {r['low']:+.3f} to {r['high']:+.3f})"
+                                      for r in rows if r["regression"]]
+
+    sensitive = [name for name in report["changed_files"]
+                 if name in RECALL_SENSITIVE_FILES or name in ("PIPELINE_CONFIGURATION", "analyzer")]
+    if sensitive and report["recall"] is None:
+        report["regressions"].append(f"{', '.join(sensitive)} changed but recall was not evaluated "
+                                     f"(run eval/eval.py with the synth suite for both)")
+    return report
+
+
+def print_report(report, args):
+    print(f"baseline  {report['baseline'].get('commit') or '?'} ({report['baseline']['ts']})")
+    print(f"candidate {report['candidate'].get('commit') or '?'} ({report['candidate']['ts']})"
+          f"{'  [uncommitted changes]' if report['candidate'].get('dirty') else ''}")
+    if report["changed_files"]:
+        print(f"changed: {', '.join(report['changed_files'])}")
+    for warning in report["warnings"]:
+        print(f"warning: {warning}")
+
+    confidence = f"{args.confidence:.0%} CI"
+    for name, rows in report["latency"].items():
+        print(f"\n[{name}] median latency, candidate / baseline")
+        print(f"  {'stage':<20} {'base ms':>9} {'cand ms':>9} {'ratio':>6} {confidence:>15}")
+        for r in rows:
+            if r["ratio"] is None:
+                print(f"  {r['stage']:<20} {'':>9} {'':>9} {'':>6} {r['note']:>15}")
+                continue
+            flag = "  SLOWER" if r["regression"] else ""
+            print(f"  {r['stage']:<20} {r['baseline_p50'] * 1e3:>9.2f} {r['candidate_p50'] * 1e3:>9.2f} "
+                  f"{r['ratio']:>6.2f} {r['low']:>7.2f}-{r['high']:<7.2f}{flag}")
+
+    if report["recall"] is not None:
+        print(f"\n[synth] recall, candidate - baseline")
+        print(f"  {'type':<16} {'base':>6} {'cand':>6} {'diff':>7} {confidence:>17} {'tp':>11}")
+        for r in report["recall"]:
+            tp = f"{r['baseline_tp']}->{r['candidate_tp']}/{r['gold']}"
+            if r["difference"] is None:
+                print(f"  {r['entity_type']:<16} {r['baseline_recall']:>6.3f} {'-':>6} {'':>7} {r['note']:>17} {tp:>11}")
+                continue
+            flag = "  DROP" if r["regression"] else ""
+            print(f"  {r['entity_type']:<16} {r['baseline_recall']:>6.3f} {r['candidate_recall']:>6.3f} "
+                  f"{r['difference']:>+7.3f} {r['low']:>+8.3f} {r['high']:>+8.3f} {tp:>11}{flag}")
+
+    if report["regressions"]:
+        print(f"\n{len(report['regressions'])} regression(s):")
+        for regression in report["regressions"]:
+            print(f"  {regression}")
+    else:
+        print("\nno regressions")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two eval/eval.py result files; exit 1 on regressions")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--max-slowdown", type=float, default=0.05,
+                        help="relative slowdown a stage may have before it counts (0.05 = 5%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=0.25,
+                        help="smallest growth of a stage's median latency that counts, in milliseconds")
+    parser.add_argument("--max-recall-drop", type=float, default=0.0,
+                        help="absolute recall drop an entity type may have before it counts")
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--resamples", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the comparison here")
+    args = parser.parse_args()
+
+    report = compare(load(args.baseline), load(args.candidate), args)
+    print_report(report, args)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+    sys.exit(1 if report["regressions"] else 0)
+
+
+if __name__ == "__main__":
+    main()
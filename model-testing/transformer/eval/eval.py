@@ -1 +1,389 @@
-#TODO turn notebook into script to evaluate on Faker data
+# End-to-end benchmark of the de-identification pipeline. Suites:
+#   text   model-testing/sample_data/*.txt through deidentify (analyze -> post-process ->
+#          group -> anonymize): throughput and per-stage latency
+#   synth  the 1,500 records of synth_dataset.json, same path, plus entity-level
+#          precision/recall per type against the gold spans
+#   ocr    ocr/image_samples and data/sample_pdf.pdf through deid.process_file
+#          (OCR -> analyze -> anonymize -> link -> render): pages/s and per-stage latency
+# Every suite runs --trials times. Stage latencies come from instrumentation.py (one
+# sample per document and stage), peak RSS is reset between suites where the OS allows.
+# Results go to a JSON file (default eval/results/bench_<timestamp>.json) that
+# eval/compare_runs.py can compare against another run.
+# Usage (from model-testing/transformer):
+#   python eval/eval.py [--suites text synth ocr] [--trials 3] [--limit 200] [--out results.json]
+#                       [--analyzer models_config:stanford_model]
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import platform
+import importlib
+import resource
+import tempfile
+import subprocess
+from collections import defaultdict
+from datetime import datetime
+
+from faker import Faker
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import instrumentation
+from configurations import PIPELINE_CONFIGURATION
+from log_analysis import deidentify
+from memory_budget import peak_rss_mb, reset_peak
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TRANSFORMER_DIR = os.path.dirname(HERE)
+REPO_DIR = os.path.dirname(os.path.dirname(TRANSFORMER_DIR))
+SAMPLE_DIR = os.path.join(TRANSFORMER_DIR, '..', 'sample_data')
+SYNTH_PATH = os.path.join(SAMPLE_DIR, 'synth_dataset.json')
+OCR_INPUTS = [os.path.join(REPO_DIR, 'ocr', 'image_samples'), os.path.join(TRANSFORMER_DIR, 'data', 'sample_pdf.pdf')]
+# files whose changes should always be benchmarked; their hashes go into the results
+TRACKED_FILES = ['recognizers.py', 'clinical_filter.py', 'configurations.py', 'models_config.py', 'postprocess.py']
+
+# synth_dataset.json labels -> the entity types this pipeline emits; None = not PHI here, not scored
+GOLD_TYPES = {
+    "PERSON": "PERSON", "STREET_ADDRESS": "ADDRESS", "GPE": "LOCATION", "ORGANIZATION": "ORGANIZATION",
+    "PHONE_NUMBER": "PHONE_NUMBER", "CREDIT_CARD": "CREDIT_CARD", "DATE_TIME": "DATE_TIME", "AGE": "AGE",
+    "EMAIL_ADDRESS": "EMAIL_ADDRESS", "ZIP_CODE": "ZIPCODE", "DOMAIN_NAME": "URL", "IBAN_CODE": "IBAN_CODE",
+    "US_SSN": "SSN", "IP_ADDRESS": "IP_ADDRESS", "US_DRIVER_LICENSE": "LICENSE", "NRP": None, "TITLE": None,
+}
+# predicted types that name the same thing differently (Presidio vs MedicalRecognizers vs the model)
+PREDICTED_ALIASES = {
+    "US_SSN": "SSN", "ZIP": "ZIPCODE", "EMAIL": "EMAIL_ADDRESS", "US_DRIVER_LICENSE": "LICENSE",
+    "GPE": "LOCATION", "US_CITY": "LOCATION", "DATE": "DATE_TIME", "DOB": "DATE_TIME",
+    "MEDICAL_RECORD_NUMBER": "MRN",
+}
+
+
+# --- measurement helpers ---
+
+def percentile(values, q):
+    """ q in [0, 100], linear interpolation between closest ranks """
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * q / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def children_peak_rss_mb():
+    """ Largest child process so far (tesseract, pdftoppm) """
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return peak / (2**20 if sys.platform == "darwin" else 1024)
+
+
+def read_stage_samples(metrics_dir):
+    """ stages.jsonl -> ({stage: [seconds per document]}, [total seconds per document], counts,
+    highest document peak RSS) """
+    stages = defaultdict(list)
+    totals = []
+    counts = defaultdict(int)
+    peak = 0.0
+    path = os.path.join(metrics_dir, "stages.jsonl")
+    if not os.path.exists(path):
+        return stages, totals, counts, peak
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            totals.append(record["seconds"])
+            for stage, timing in record["stages"].items():
+                stages[stage].append(timing["seconds"])
+            for name, n in record["counts"].items():
+                counts[name] += n
+            peak = max(peak, record.get("peak_rss_mb", 0.0))
+    return stages, totals, counts, peak
+
+
+def run_trial(name, items, process, metrics_root, trial):
+    """ Runs process(item) for every item inside an instrumented document; returns the
+    trial record with throughput, per-document stage samples and peak RSS """
+    metrics_dir = os.path.join(metrics_root, f"{name}_{trial}")
+    if trial == 0 and items:
+        # untimed: lazy imports, regex compilation and model warm-up would land in trial 0 only
+        process(items[0], 0)
+    instrumentation.enable(metrics_dir)
+    reset_peak()
+    # surrogates are drawn from Faker; same draws every trial
+    Faker.seed(0)
+
+    chars = pages = failed = 0
+    errors = []
+    outputs = []
+    t0 = time.perf_counter()
+    for i, item in enumerate(items):
+        output = process(item, i)
+        outputs.append(output)
+        chars += output.get("chars", 0)
+        pages += output.get("pages", 0)
+        if output.get("error"):
+            failed += 1
+            if len(errors) < 5:
+                errors.append(output["error"])
+    seconds = time.perf_counter() - t0
+    instrumentation.disable()
+
+    # instrumentation restarts the peak at every document
+    stages, totals, counts, document_peak = read_stage_samples(metrics_dir)
+    elapsed = max(seconds, 1e-9)
+    trial_record = {
+        "seconds": round(seconds, 4),
+        "documents": len(items),
+        "failed": failed,
+        "chars": chars,
+        "pages": pages,
+        "docs_per_s": round(len(items) / elapsed, 3),
+        "chars_per_s": round(chars / elapsed, 1),
+        "pages_per_s": round(pages / elapsed, 3),
+        "peak_rss_mb": round(max(document_peak, peak_rss_mb()), 1),
+        "children_peak_rss_mb": round(children_peak_rss_mb(), 1),
+        "latency": {"document": totals, **stages},
+        "counts": dict(counts),
+    }
+    if errors:
+        trial_record["errors"] = errors
+    return trial_record, outputs
+
+
+def summarize(trials):
+    """ Medians over trials of throughput, and p50/p95 per stage over every document of every trial """
+    summary = {}
+    for key in ("docs_per_s", "chars_per_s", "pages_per_s", "peak_rss_mb"):
+        summary[key] = percentile([t[key] for t in trials], 50)
+    latency = defaultdict(list)
+    for trial in trials:
+        for stage, samples in trial["latency"].items():
+            latency[stage].extend(samples)
+    summary["latency"] = {stage: {"p50": percentile(s, 50), "p95": percentile(s, 95), "n": len(s)}
+                          for stage, s in sorted(latency.items())}
+    return summary
+
+
+# --- accuracy ---
+
+def iou(a, b):
+    inter = min(a[1], b[1]) - max(a[0], b[0])
+    if inter <= 0:
+        return 0.0
+    return inter / (max(a[1], b[1]) - min(a[0], b[0]))
+
+
+def score_document(gold_spans, rows, threshold):
+    """ Greedy one-to-one matching per type at IoU >= threshold, plus type-agnostic "PHI".
+    Returns {label: {"tp", "fp", "fn"}} """
+    tally = defaultdict(lambda: {"tp": 0, "fp": 0, "fn": 0})
+    gold = []
+    ignored = []
+    for span in gold_spans:
+        etype = GOLD_TYPES.get(span["entity_type"], span["entity_type"])
+        bounds = (span["start_position"], span["end_position"])
+        (ignored if etype is None else gold).append((etype, bounds))
+    predicted = [(PREDICTED_ALIASES.get(r["entity_type"], r["entity_type"]), (r["start"], r["end"])) for r in rows]
+    # a prediction on a span we do not score (NRP, TITLE) is neither right nor wrong
+    predicted = [p for p in predicted if not any(iou(p[1], b) >= threshold for _, b in ignored)]
+
+    for typed in (True, False):
+        used = set()
+        for etype, bounds in gold:
+            label = etype if typed else "PHI"
+            best, best_iou = None, threshold
+            for j, (ptype, pbounds) in enumerate(predicted):
+                if j in used or (typed and ptype != etype):
+                    continue
+                overlap = iou(bounds, pbounds)
+                if overlap >= best_iou:
+                    best, best_iou = j, overlap
+            if best is None:
+                tally[label]["fn"] += 1
+            else:
+                used.add(best)
+                tally[label]["tp"] += 1
+        for j, (ptype, _) in enumerate(predicted):
+            if j not in used:
+                tally[ptype if typed else "PHI"]["fp"] += 1
+    return tally
+
+
+def accuracy_table(documents):
+    """ Totals over per-document tallies, with precision/recall/f1 per label """
+    tally = defaultdict(lambda: {"tp": 0, "fp": 0, "fn": 0})
+    for scores in documents:
+        for label, c in scores.items():
+            for key, n in c.items():
+                tally[label][key] += n
+    table = {}
+    for label, c in sorted(tally.items()):
+        precision = c["tp"] / (c["tp"] + c["fp"]) if c["tp"] + c["fp"] else None
+        recall = c["tp"] / (c["tp"] + c["fn"]) if c["tp"] + c["fn"] else None
+        f1 = 2 * precision * recall / (precision + recall) if precision and recall else None
+        table[label] = {**c, "precision": precision, "recall": recall, "f1": f1}
+    return table
+
+
+# --- suites ---
+
+def text_suite(analyzer, args, metrics_root):
+    texts = [open(path, encoding="utf-8").read() for path in sorted(glob.glob(os.path.join(SAMPLE_DIR, "*.txt")))]
+
+    def process(text, i):
+        with instrumentation.document("bench-text", i):
+            anonymized, rows, _, _ = deidentify(analyzer, text)
+            list(rows)
+        return {"chars": len(text)}
+
+    trials = [run_trial("text", texts, process, metrics_root, t)[0] for t in range(args.trials)]
+    return {"documents": len(texts), "trials": trials, "summary": summarize(trials)}
+
+
+def synth_suite(analyzer, args, metrics_root):
+    with open(SYNTH_PATH, encoding="utf-8") as f:
+        records = json.load(f)
+    if args.limit:
+        records = records[:args.limit]
+
+    def process(record, i):
+        with instrumentation.document("bench-synth", i):
+            _, rows, _, _ = deidentify(analyzer, record["full_text"])
+            rows = list(rows)
+        return {"chars": len(record["full_text"]), "rows": rows}
+
+    trials = []
+    scores = None
+    for t in range(args.trials):
+        trial, outputs = run_trial("synth", records, process, metrics_root, t)
+        trials.append(trial)
+        if scores is None:
+            # detections do not depend on the trial; score the first
+            scores = [score_document(record["spans"], output["rows"], args.iou)
+                      for record, output in zip(records, outputs)]
+    # per document {label: [tp, fp, fn]}, for confidence intervals over documents (eval/compare_runs.py)
+    per_document = [{label: [c["tp"], c["fp"], c["fn"]] for label, c in doc.items()} for doc in scores]
+    return {"documents": len(records), "iou": args.iou, "trials": trials, "summary": summarize(trials),
+            "accuracy": accuracy_table(scores), "accuracy_per_document": per_document}
+
+
+def ocr_suite(analyzer, args, metrics_root):
+    import deid
+    deid._ANALYZER = analyzer
+
+    inputs = []
+    for path in OCR_INPUTS:
+        if os.path.isdir(path):
+            inputs += [(path, rel) for rel in deid.discover(path)]
+        elif os.path.exists(path):
+            inputs.append((os.path.dirname(path), os.path.basename(path)))
+    inputs = [(d, rel) for d, rel in inputs if os.path.splitext(rel)[1].lower() not in deid.TEXT_EXTENSIONS]
+
+    def process(item, i):
+        input_dir, rel_path = item
+        output_dir = tempfile.mkdtemp(prefix="bench_ocr_")
+        try:
+            record = deid.process_file(input_dir, rel_path, output_dir)
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+        return {"pages": record.get("pages", 0),
+                "error": f"{rel_path}: {record['error']}" if record["status"] != "done" else None}
+
+    trials = [run_trial("ocr", inputs, process, metrics_root, t)[0] for t in range(args.trials)]
+    return {"documents": len(inputs), "inputs": [rel for _, rel in inputs], "trials": trials,
+            "summary": summarize(trials)}
+
+
+SUITES = {"text": text_suite, "synth": synth_suite, "ocr": ocr_suite}
+
+
+# --- run ---
+
+def load_analyzer(spec):
+    module_name, _, attribute = spec.partition(":")
+    return getattr(importlib.import_module(module_name), attribute or "analyzer")
+
+
+def run_metadata(args):
+    def git(*command):
+        try:
+            return subprocess.run(["git", *command], cwd=TRANSFORMER_DIR, capture_output=True, text=True,
+                                  timeout=10).stdout.strip() or None
+        except (OSError, subprocess.SubprocessError):
+            return None
+
+    tracked = {}
+    for name in TRACKED_FILES:
+        path = os.path.join(TRANSFORMER_DIR, name)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                tracked[name] = hashlib.sha256(f.read()).hexdigest()[:16]
+    return {
+        "ts": datetime.now().isoformat(timespec="seconds"),
+        "commit": git("rev-parse", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "analyzer": args.analyzer,
+        "trials": args.trials,
+        "limit": args.limit,
+        "pipeline_configuration": PIPELINE_CONFIGURATION,
+        "tracked_files": tracked,
+    }
+
+
+def print_summary(name, suite):
+    s = suite["summary"]
+    print(f"\n[{name}] {suite['documents']} documents x {len(suite['trials'])} trials: "
+          f"{s['docs_per_s']:.2f} docs/s, {s['chars_per_s']:,.0f} chars/s, {s['pages_per_s']:.2f} pages/s, "
+          f"peak RSS {s['peak_rss_mb']:.0f} MiB")
+    failed = suite["trials"][0]["failed"]
+    if failed:
+        print(f"  {failed} failed, e.g. {suite['trials'][0]['errors'][0]}")
+    print(f"  {'stage':<20} {'p50 ms':>9} {'p95 ms':>9} {'n':>6}")
+    for stage, lat in s["latency"].items():
+        print(f"  {stage:<20} {lat['p50'] * 1e3:>9.2f} {lat['p95'] * 1e3:>9.2f} {lat['n']:>6}")
+    if suite.get("accuracy"):
+        print(f"  {'type':<16} {'precision':>9} {'recall':>7} {'f1':>6} {'tp':>5} {'fp':>5} {'fn':>5}")
+        fmt = lambda v: f"{v:.3f}" if v is not None else "-"
+        for label, a in suite["accuracy"].items():
+            print(f"  {label:<16} {fmt(a['precision']):>9} {fmt(a['recall']):>7} {fmt(a['f1']):>6} "
+                  f"{a['tp']:>5} {a['fp']:>5} {a['fn']:>5}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--suites", nargs="+", choices=list(SUITES), default=list(SUITES))
+    parser.add_argument("--trials", type=int, default=3)
+    parser.add_argument("--limit", type=int, help="only the first N synth_dataset.json records")
+    parser.add_argument("--iou", type=float, default=0.7, help="IoU for a predicted span to match a gold span")
+    parser.add_argument("--analyzer", default="models_config:stanford_model",
+                        help="module:attribute of the AnalyzerEngine to benchmark")
+    parser.add_argument("--out", help="results file (default eval/results/bench_<timestamp>.json)")
+    args = parser.parse_args()
+
+    analyzer = load_analyzer(args.analyzer)
+    results = {"meta": run_metadata(args), "suites": {}}
+    with tempfile.TemporaryDirectory(prefix="bench_metrics_") as metrics_root:
+        for name in args.suites:
+            # the OCR/render helpers print per page
+            with open(os.devnull, "w") as devnull:
+                stdout, sys.stdout = sys.stdout, devnull
+                try:
+                    results["suites"][name] = SUITES[name](analyzer, args, metrics_root)
+                finally:
+                    sys.stdout = stdout
+            print_summary(name, results["suites"][name])
+
+    out = args.out or os.path.join(HERE, "results", f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=1)
+    print(f"\nResults written to {out}")
+
+
+if __name__ == "__main__":
+    main()
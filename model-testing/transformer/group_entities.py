@@ -1,63 +1,371 @@
+import os
+import re
+import json
+import tempfile
+from pathlib import Path
+import numpy as np
 from rapidfuzz import fuzz, process
-from pprint import pprint
-import itertools
 
-def _get_similarity_list(strings, score_cutoff=0):
-    results = {}
-    for str1 in strings:
-        for str2 in strings:
-            if str1 != str2 and (str1, str2) not in results and (str2, str1) not in results:
-                score = fuzz.WRatio(str1, str2, score_cutoff=score_cutoff)
-                results[(str1, str2)] = score
+# honorifics/credentials that say nothing about who the person is
+TITLES = {'dr', 'mr', 'mrs', 'ms', 'miss', 'mx', 'prof', 'md', 'do', 'rn', 'np', 'pa', 'phd', 'jr', 'sr'}
 
-    return results
+_SOUNDEX_CODES = {c: str(d) for d, letters in enumerate(
+    ['aeiouyhw', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r']) for c in letters}
 
-def group_names(entities: list[str], score_cutoff=60) -> list[set]:
+
+JOURNAL_SUFFIX = ".log"
+
+
+def _normalize(entity: str) -> str:
+    return entity.replace(" ", "").lower()
+
+
+def _soundex(word: str) -> str:
+    """ American Soundex code, e.g. Smith/Smyth -> s530 """
+    codes = [_SOUNDEX_CODES.get(c, '') for c in word]
+    out = []
+    prev = codes[0]
+    for c, code in zip(word[1:], codes[1:]):
+        if code and code != '0' and code != prev:
+            out.append(code)
+        # h/w do not separate letters with the same code, vowels do
+        if c not in 'hw':
+            prev = code
+    return (word[0] + ''.join(out) + '000')[:4]
+
+
+def _blocking_keys(entity: str) -> set:
+    """ Cheap keys two mentions of the same person are likely to share:
+    surname phonetic code, first initial + surname prefix, and each name token.
+    """
+    words = re.findall(r"[a-z]+", entity.lower())
+    tokens = [w for w in words if w not in TITLES] or words
+    if not tokens:
+        return {'raw:' + _normalize(entity)}
+
+    # "Smith, John" puts the surname first
+    surname = tokens[0] if ',' in entity else tokens[-1]
+    keys = {'sx:' + _soundex(surname)}
+    if len(tokens) > 1:
+        first = tokens[1] if ',' in entity else tokens[0]
+        keys.add('fi:' + first[0] + surname[:3])
+    keys.update('tok:' + t for t in tokens if len(t) > 2)
+    return keys
+
+
+def _find(parent, i):
+    # path halving keeps the trees flat without recursion
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def _union(parent, i, j):
+    ri, rj = _find(parent, i), _find(parent, j)
+    if ri == rj:
+        return
+    # attach to the smaller index so roots follow first-seen order
+    if ri < rj:
+        parent[rj] = ri
+    else:
+        parent[ri] = rj
+
+
+def _similar_pairs(names, score_cutoff=0, workers=-1, block_size=256):
+    """ (i, j) index arrays, i < j, of every pair of names whose WRatio reaches score_cutoff.
+    Rows are scored in blocks with rapidfuzz.process.cdist against the names from the
+    block on, so the score matrix never has to be held for all names at once and little
+    more than the upper triangle is scored.
+    """
+    rows, cols = [np.empty(0, dtype=np.intp)], [np.empty(0, dtype=np.intp)]
+    for lo in range(0, len(names), block_size):
+        hi = min(lo + block_size, len(names))
+        # scores below score_cutoff come back as 0, same as fuzz.WRatio(..., score_cutoff=...);
+        # float32 keeps fractional scores, so a fractional score_cutoff is honoured exactly
+        scores = process.cdist(names[lo:hi], names[lo:], scorer=fuzz.WRatio,
+                               score_cutoff=score_cutoff, dtype=np.float32, workers=workers)
+        # upper triangle only, WRatio is compared once per unordered pair
+        i, j = np.nonzero(np.triu(scores, k=1))
+        rows.append(i + lo)
+        cols.append(j + lo)
+    return np.concatenate(rows), np.concatenate(cols)
+
+
+def _blocked_pairs(names, blocks, score_cutoff=0, workers=-1):
+    """ Same contract as _similar_pairs, but only scores pairs that share a block.
+    blocks: iterable of lists of indices into names
+    """
+    rows, cols = [np.empty(0, dtype=np.intp)], [np.empty(0, dtype=np.intp)]
+    for members in blocks:
+        if len(members) < 2:
+            continue
+        block_names = [names[i] for i in members]
+        scores = process.cdist(block_names, block_names, scorer=fuzz.WRatio,
+                               score_cutoff=score_cutoff, dtype=np.float32, workers=workers)
+        i, j = np.nonzero(np.triu(scores, k=1))
+        members = np.asarray(members, dtype=np.intp)
+        rows.append(members[i])
+        cols.append(members[j])
+    return np.concatenate(rows), np.concatenate(cols)
+
+
+def _components(n, rows, cols):
+    """ Connected components of n nodes joined by the edges (rows[k], cols[k]), as the
+    smallest node of each node's component (the root _union would give it).
+    Vectorised union-find: every root is hooked onto the smallest label across its
+    edges, then labels are pointer-jumped to their roots, until no edge joins two labels.
+    """
+    labels = np.arange(n)
+    while len(rows):
+        low = np.minimum(labels[rows], labels[cols])
+        hooked = labels.copy()
+        np.minimum.at(hooked, labels[rows], low)
+        np.minimum.at(hooked, labels[cols], low)
+        jumped = hooked[hooked]
+        while not np.array_equal(jumped, hooked):
+            hooked, jumped = jumped, jumped[jumped]
+        if np.array_equal(hooked, labels):
+            break
+        labels = hooked
+    return labels
+
+
+def group_names(entities: list[str], score_cutoff=60, workers=-1, blocking=False) -> list[set]:
     """ Groups similar named entities together using fuzzy matching.
     Params:
     entities: list of named entity strings
-    
+    score_cutoff: minimum WRatio score for two names to be linked
+    workers: threads used by rapidfuzz.process.cdist (-1 = all cores)
+    blocking: only compare names sharing a blocking key (see _blocking_keys) instead of
+              all pairs. Use for case-scale rosters; may miss links the exhaustive mode finds.
+
     Returns:
     buckets: list of sets, each set containing similar named entities
     """
-    buckets = []
-    
-    names = [t.replace(" ", "").lower() for t in entities]
-    name_to_entity = dict(zip(names, entities))
-
-    sim_list = _get_similarity_list(names, score_cutoff=score_cutoff)
-    matches = [m[0] for m in list(sorted(sim_list.items(), key=lambda x: x[1], reverse=True)) if m[1] > 0]
-
-    adj = {}
-    for u, v in matches:
-        if u not in adj: adj[u] = []
-        if v not in adj: adj[v] = []
-        adj[u].append(v)
-        adj[v].append(u)
-    
-    visited = set()
-    
-    for node in adj:
-        if node not in visited:
-            component = set()
-            stack = [node]
-            visited.add(node)
-
-            entity = name_to_entity[node]
-            component.add(entity)
-            while stack:
-                curr = stack.pop()
-                for neighbor in adj[curr]:
-                    if neighbor not in visited:
-                        visited.add(neighbor)
-                        stack.append(neighbor)
-
-                        entity = name_to_entity[neighbor]
-                        component.add(entity)
-            buckets.append(component)
-
-    rest = set(names) - visited
-    for name in rest:
-        buckets.append(set([name_to_entity[name]]))
-
-    return buckets
+    # dedupe on the normalized form, the last spelling seen represents it
+    name_to_entity = {}
+    for entity in entities:
+        name_to_entity[_normalize(entity)] = entity
+    names = list(name_to_entity)
+
+    if not names:
+        return []
+
+    if blocking:
+        blocks = {}
+        for i, name in enumerate(names):
+            for key in _blocking_keys(name_to_entity[name]):
+                blocks.setdefault(key, []).append(i)
+        rows, cols = _blocked_pairs(names, blocks.values(), score_cutoff=score_cutoff, workers=workers)
+    else:
+        rows, cols = _similar_pairs(names, score_cutoff=score_cutoff, workers=workers)
+
+    components = {}
+    for name, root in zip(names, _components(len(names), rows, cols).tolist()):
+        components.setdefault(root, set()).add(name_to_entity[name])
+
+    return list(components.values())
+
+
+class NameGroupIndex:
+    """ Case-level name groups that grow one document at a time.
+
+    New mentions are only scored against names already in the index that share a
+    blocking key, so adding a document costs time proportional to its new mentions
+    rather than to the size of the case. Groups are never split; when a mention links
+    two groups they merge and the older group's canonical name wins, so canonical names
+    handed to DemographicContext stay stable across documents.
+
+    Usage:
+    index = NameGroupIndex.open(f"logs/{case}/name_groups.json")
+    index.add(tagged_person)
+    ContextAwareAnonymizer(index.groups(), name_group_map=index.canonical_map())
+    index.save()
+
+    Callers that keep a name_group_map current page by page apply what add() returns,
+    the spellings whose canonical name changed, instead of rebuilding the whole map.
+
+    save() appends the mentions added since the last save to a journal next to the index
+    file (<path>.log, one JSON list per save) and open() replays it, so saving after each
+    document costs time proportional to its new mentions. Once the journal holds more
+    mentions than the index file has spellings, save() rewrites the index file
+    (atomically) and empties the journal, so rewrites are amortized over the mentions.
+    """
+    def __init__(self, score_cutoff=60, path=None):
+        self.score_cutoff = score_cutoff
+        self.path = path
+        self.entities = []   # first spelling seen, per member id
+        self.names = []      # normalized form, per member id
+        self.parent = []
+        self.name_ids = {}   # normalized form -> member id
+        self.spellings = {}  # lower-cased spelling -> member id
+        self.blocks = {}     # blocking key -> member ids
+        self.group_spellings = {}  # group root -> lower-cased spellings in the group
+        self._unsaved = []         # mentions that changed the index since the last save
+        self._journaled = 0        # mentions in the journal at path
+        self._written = 0          # spellings in the index file at path
+
+    def __len__(self):
+        return len(self.entities)
+
+    def add(self, entities: list[str]) -> dict:
+        """ Adds PERSON mentions from a new document to the index. Returns the spellings
+        whose canonical name changed (new spellings and the members of groups merged into
+        an older one) as lower-cased spelling -> canonical name, the update for a
+        name_group_map built from canonical_map(). """
+        changed = set()
+        for entity in entities:
+            name = _normalize(entity)
+            if name in self.name_ids:
+                if entity.lower() in self.spellings:
+                    continue
+                self._add_spelling(entity.lower(), self.name_ids[name], changed)
+            else:
+                self._add_member(entity, name, changed)
+            self._unsaved.append(entity)
+        return {spelling: self.entities[_find(self.parent, self.spellings[spelling])].lower()
+                for spelling in changed}
+
+    def _add_spelling(self, spelling, i, changed):
+        if spelling in self.spellings:
+            return
+        self.spellings[spelling] = i
+        self.group_spellings.setdefault(_find(self.parent, i), []).append(spelling)
+        changed.add(spelling)
+
+    def _merge(self, i, j, changed):
+        ri, rj = _find(self.parent, i), _find(self.parent, j)
+        if ri == rj:
+            return
+        _union(self.parent, ri, rj)
+        # the younger group takes the older one's canonical name
+        moved = self.group_spellings.pop(max(ri, rj), [])
+        self.group_spellings.setdefault(min(ri, rj), []).extend(moved)
+        changed.update(moved)
+
+    def _add_member(self, entity, name, changed):
+        new_id = len(self.entities)
+        self.entities.append(entity)
+        self.names.append(name)
+        self.parent.append(new_id)
+        self.name_ids[name] = new_id
+        self._add_spelling(entity.lower(), new_id, changed)
+
+        candidates = set()
+        for key in _blocking_keys(entity):
+            members = self.blocks.setdefault(key, [])
+            candidates.update(members)
+            members.append(new_id)
+        if not candidates:
+            return
+
+        candidates = sorted(candidates)
+        matches = process.extract(name, [self.names[i] for i in candidates], scorer=fuzz.WRatio,
+                                  score_cutoff=self.score_cutoff, limit=None)
+        for _, score, pos in matches:
+            if score > 0:
+                self._merge(candidates[pos], new_id, changed)
+
+    def groups(self) -> list[set]:
+        """ Same shape as group_names(): one set of spellings per person. """
+        components = {}
+        for i, entity in enumerate(self.entities):
+            components.setdefault(_find(self.parent, i), set()).add(entity)
+        return list(components.values())
+
+    def canonical(self, entity: str) -> str:
+        """ Canonical (lower-cased) name of the group entity belongs to, or entity itself if unseen. """
+        i = self.spellings.get(entity.lower(), self.name_ids.get(_normalize(entity)))
+        if i is None:
+            return entity.lower()
+        return self.entities[_find(self.parent, i)].lower()
+
+    def canonical_map(self) -> dict:
+        """ Lower-cased spelling -> canonical name, the format of DemographicContext.name_group_map """
+        return {spelling: self.entities[_find(self.parent, i)].lower()
+                for spelling, i in self.spellings.items()}
+
+    def to_dict(self) -> dict:
+        return {
+            "score_cutoff": self.score_cutoff,
+            "entities": self.entities,
+            "parent": [_find(self.parent, i) for i in range(len(self.parent))],
+            "spellings": self.spellings,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict, path=None) -> "NameGroupIndex":
+        index = cls(score_cutoff=data["score_cutoff"], path=path)
+        index.entities = list(data["entities"])
+        index.parent = list(data["parent"])
+        index.spellings = dict(data["spellings"])
+        for spelling, i in index.spellings.items():
+            index.group_spellings.setdefault(_find(index.parent, i), []).append(spelling)
+        for i, entity in enumerate(index.entities):
+            name = _normalize(entity)
+            index.names.append(name)
+            index.name_ids[name] = i
+            for key in _blocking_keys(entity):
+                index.blocks.setdefault(key, []).append(i)
+        return index
+
+    @classmethod
+    def open(cls, path, score_cutoff=60) -> "NameGroupIndex":
+        """ Loads the index saved at path and replays its journal, or starts an empty one
+        that will be saved there. """
+        if not os.path.exists(path):
+            return cls(score_cutoff=score_cutoff, path=path)
+        with open(path, "r", encoding="utf-8") as f:
+            index = cls.from_dict(json.load(f), path=path)
+        index._written = len(index.spellings)
+        journal = os.fspath(path) + JOURNAL_SUFFIX
+        if os.path.exists(journal):
+            with open(journal, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entities = json.loads(line)
+                    except json.JSONDecodeError:
+                        # partial last line from a killed process
+                        continue
+                    # replaying add() is deterministic, and a no-op for mentions already in
+                    # the index file
+                    index.add(entities)
+                    index._journaled += len(entities)
+        index._unsaved = []
+        return index
+
+    def save(self, path=None) -> None:
+        """ Saves to self.path by appending to its journal (see the class docstring), or
+        writes the whole index to another path """
+        if path is not None and os.fspath(path) != os.fspath(self.path or ""):
+            self._write(path)
+            return
+        if not self._unsaved and os.path.exists(self.path):
+            return
+        if not os.path.exists(self.path) or self._journaled + len(self._unsaved) > self._written:
+            self._write(self.path)
+            self._journaled = 0
+            self._written = len(self.spellings)
+        else:
+            with open(os.fspath(self.path) + JOURNAL_SUFFIX, "a", encoding="utf-8") as f:
+                f.write(json.dumps(self._unsaved, ensure_ascii=False) + "\n")
+            self._journaled += len(self._unsaved)
+        self._unsaved = []
+
+    def _write(self, path) -> None:
+        """ The whole index to path, replaced atomically; path's journal is then obsolete """
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                        prefix=os.path.basename(path) + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self.to_dict(), f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        journal = os.fspath(path) + JOURNAL_SUFFIX
+        if os.path.exists(journal):
+            os.remove(journal)
@@ -0,0 +1,259 @@
+import os
+import json
+import time
+import atexit
+import threading
+import functools
+from collections import defaultdict
+from datetime import datetime
+
+from memory_budget import rss_mb, peak_rss_mb, reset_peak
+
+# Per-stage timings and counters for the pipeline.
+#
+#   with span("ocr"): ...              time a block as a stage
+#   @timed("render")                   time every call of a function
+#   count("tokens", len(tokens))       add to a counter (pages, tokens, entities)
+#   with document(case, doc_id): ...   collect the spans/counters of one document
+#
+# Disabled by default, in which case span() returns a shared no-op and timed() adds one
+# flag check per call. enable(out_dir), or DEID_METRICS_DIR=<dir> in the environment
+# (inherited by worker processes), turns it on and writes to out_dir:
+#
+#   stages.jsonl             one line per document: stage seconds/calls, RSS at the end
+#                            of the stage (highest) and its growth, counters, and the
+#                            document's peak RSS
+#   metrics_<pid>.prom       Prometheus text format, totals for this process, rewritten
+#                            after every document (a node_exporter textfile collector
+#                            can read the directory)
+
+ENV_VAR = "DEID_METRICS_DIR"
+
+_enabled = False
+_out_dir = None
+_lock = threading.Lock()
+_local = threading.local()
+
+# process totals for the Prometheus file
+_stage_seconds = defaultdict(float)
+_stage_calls = defaultdict(int)
+_counters = defaultdict(int)
+_stage_rss = defaultdict(float)
+_documents = 0
+_peak_rss = 0.0
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span:
+    __slots__ = ("stage", "t0", "rss0")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.rss0 = rss_mb()
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        _record(self.stage, time.perf_counter() - self.t0, self.rss0)
+        return False
+
+
+class _Document:
+    """ Stage totals and counters of one document on this thread """
+    def __init__(self, case, doc_id, pass_name):
+        self.case = case
+        self.doc_id = doc_id
+        self.pass_name = pass_name
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counts = defaultdict(int)
+        self.rss = defaultdict(float)
+        self.grew = defaultdict(float)
+        self.t0 = None
+
+    def __enter__(self):
+        if not _stack():
+            # peak_rss_mb of this document alone, where the OS allows
+            reset_peak()
+        self.t0 = time.perf_counter()
+        _stack().append(self)
+        return self
+
+    def __exit__(self, *exc):
+        total = time.perf_counter() - self.t0
+        _stack().pop()
+        _finish(self, total, failed=exc[0] is not None)
+        return False
+
+
+def enable(out_dir) -> None:
+    """ Turns instrumentation on for this process, writing to out_dir """
+    global _enabled, _out_dir
+    os.makedirs(out_dir, exist_ok=True)
+    _out_dir = out_dir
+    _enabled = True
+
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def span(stage):
+    """ Context manager timing a block as `stage` """
+    return _Span(stage) if _enabled else _NO_SPAN
+
+
+def timed(stage):
+    """ Decorator timing every call of the function as `stage` """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            rss0 = rss_mb()
+            t0 = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _record(stage, time.perf_counter() - t0, rss0)
+        return wrapper
+    return decorator
+
+
+def count(name, n=1) -> None:
+    """ Adds n to counter `name` (pages, tokens, entities, ...) """
+    if not _enabled:
+        return
+    stack = _stack()
+    if stack:
+        stack[-1].counts[name] += n
+    with _lock:
+        _counters[name] += n
+
+
+def document(case, doc_id, pass_name=None):
+    """ Context manager collecting everything timed/counted on this thread into one
+    stages.jsonl record for (case, doc_id). Nested documents are recorded separately. """
+    return _Document(case, doc_id, pass_name) if _enabled else _NO_SPAN
+
+
+def instrument_analyzer(analyzer) -> None:
+    """ Times the NLP engine (the transformer) and the context enhancer of a Presidio
+    AnalyzerEngine as their own stages. Safe to call more than once. """
+    if not _enabled or getattr(analyzer, "_instrumented", False):
+        return
+    nlp_engine = getattr(analyzer, "nlp_engine", None)
+    if nlp_engine is not None:
+        nlp_engine.process_text = timed("nlp")(nlp_engine.process_text)
+    enhancer = getattr(analyzer, "context_aware_enhancer", None)
+    if enhancer is not None:
+        enhancer.enhance_using_context = timed("context_enhancer")(enhancer.enhance_using_context)
+    analyzer._instrumented = True
+
+
+def _stack():
+    stack = getattr(_local, "documents", None)
+    if stack is None:
+        stack = _local.documents = []
+    return stack
+
+
+def _record(stage, seconds, rss_before):
+    rss = rss_mb()
+    stack = _stack()
+    if stack:
+        document = stack[-1]
+        document.seconds[stage] += seconds
+        document.calls[stage] += 1
+        document.rss[stage] = max(document.rss[stage], rss)
+        document.grew[stage] += rss - rss_before
+    with _lock:
+        _stage_seconds[stage] += seconds
+        _stage_calls[stage] += 1
+        _stage_rss[stage] = max(_stage_rss[stage], rss)
+
+
+def _finish(document, total, failed):
+    global _documents, _peak_rss
+    peak = peak_rss_mb()
+    record = {
+        "ts": datetime.now().isoformat(timespec="seconds"),
+        "case": document.case,
+        "doc_id": document.doc_id,
+        "pass": document.pass_name,
+        "pid": os.getpid(),
+        "seconds": round(total, 6),
+        "failed": failed,
+        "stages": {stage: {"seconds": round(seconds, 6), "calls": document.calls[stage],
+                           "rss_mb": round(document.rss[stage], 1), "grew_mb": round(document.grew[stage], 1)}
+                   for stage, seconds in document.seconds.items()},
+        "counts": dict(document.counts),
+        "peak_rss_mb": round(peak, 1),
+    }
+    with _lock:
+        _documents += 1
+        _peak_rss = max(_peak_rss, peak)
+        # one write per line: lines from concurrent workers do not interleave
+        with open(os.path.join(_out_dir, "stages.jsonl"), "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+        _write_prometheus()
+
+
+def _write_prometheus():
+    lines = [
+        "# HELP deid_stage_seconds_total Wall time spent in each pipeline stage.",
+        "# TYPE deid_stage_seconds_total counter",
+        *(f'deid_stage_seconds_total{{stage="{stage}"}} {seconds:.6f}' for stage, seconds in sorted(_stage_seconds.items())),
+        "# HELP deid_stage_calls_total Calls of each pipeline stage.",
+        "# TYPE deid_stage_calls_total counter",
+        *(f'deid_stage_calls_total{{stage="{stage}"}} {calls}' for stage, calls in sorted(_stage_calls.items())),
+        "# HELP deid_items_total Pages, tokens and entities processed.",
+        "# TYPE deid_items_total counter",
+        *(f'deid_items_total{{kind="{name}"}} {n}' for name, n in sorted(_counters.items())),
+        "# HELP deid_documents_total Documents processed.",
+        "# TYPE deid_documents_total counter",
+        f"deid_documents_total {_documents}",
+        "# HELP deid_stage_rss_bytes Highest resident set size at the end of each stage.",
+        "# TYPE deid_stage_rss_bytes gauge",
+        *(f'deid_stage_rss_bytes{{stage="{stage}"}} {int(rss * 2**20)}' for stage, rss in sorted(_stage_rss.items())),
+        "# HELP deid_document_peak_rss_bytes Highest peak resident set size of a document.",
+        "# TYPE deid_document_peak_rss_bytes gauge",
+        f"deid_document_peak_rss_bytes {int(_peak_rss * 2**20)}",
+    ]
+    path = os.path.join(_out_dir, f"metrics_{os.getpid()}.prom")
+    # write-then-rename so a scraper never reads half a file
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(path + ".tmp", path)
+
+
+def _flush_at_exit():
+    # totals from spans outside any document (e.g. a plain OCR run)
+    if _enabled and _stage_calls:
+        with _lock:
+            _write_prometheus()
+
+
+atexit.register(_flush_at_exit)
+
+if os.environ.get(ENV_VAR):
+    enable(os.environ[ENV_VAR])
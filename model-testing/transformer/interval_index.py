@@ -0,0 +1,168 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from typing import Any, Callable, Iterable, List, Tuple
+
+# leaf value of a discarded span (and of unused leaves): below any end
+_NO_END = -(1 << 62)
+
+
+class IntervalIndex:
+    """
+    Compact index of half-open character spans [start, end) shared by the pipeline
+    (entity-to-OCR linking, ClinicalDataFilter overlap resolution, model span merging and
+    anonymization).
+
+    Spans are kept sorted by start in parallel arrays, together with the running maximum
+    of ends. Because both starts and running max ends are non-decreasing, any query is two
+    bisects that bound the candidate range; the range is then checked span by span when
+    it is short (at most SCAN spans), else searched in a segment tree of the maximum end
+    of the live spans under each node, which skips every subtree that ends too early.
+    The tree keeps one long span near the start (a page-wide ORGANIZATION, an address
+    block) from turning every later query into a scan of everything after it: a query
+    costs O((k + 1) log n) for k results.
+
+    - overlapping(start, end): spans sharing at least one character with [start, end)
+    - stabbing(pos):           spans containing position pos
+    - enclosing(start, end):   spans that contain all of [start, end)
+
+    Results come back as positions into the index, in start order; the object stored
+    with a span is self.values[i]. Sweeps that visit spans in start order can grow the
+    index with append() and drop spans with discard().
+    """
+    SCAN = 32
+
+    def __init__(self):
+        self.starts = array("q")
+        self.ends = array("q")
+        self.max_ends = array("q")
+        self.values = []
+        self.alive = bytearray()
+        # segment tree: node n covers the leaves under it, leaf i is _tree[_capacity + i]
+        self._capacity = 1
+        self._tree = array("q", [_NO_END, _NO_END])
+
+    @classmethod
+    def from_spans(cls, spans: Iterable[Any], key: Callable[[Any], Tuple[int, int]]=None) -> "IntervalIndex":
+        """ Builds an index over objects with .start/.end (or key(obj) -> (start, end)).
+        Equal starts are ordered longest first, so containers come before their contents.
+        """
+        key = key or (lambda s: (s.start, s.end))
+        index = cls()
+        keyed = [(*key(span), span) for span in spans]
+        keyed.sort(key=lambda k: (k[0], -k[1]))
+        index.starts = array("q", [k[0] for k in keyed])
+        index.ends = array("q", [k[1] for k in keyed])
+        index.max_ends = array("q", accumulate(index.ends, max))
+        index.values = [k[2] for k in keyed]
+        index.alive = bytearray(b"\x01") * len(keyed)
+        index._build()
+        return index
+
+    def _build(self):
+        n = len(self.ends)
+        capacity = 1
+        while capacity < n:
+            capacity *= 2
+        leaves = array("q", (end if alive else _NO_END for end, alive in zip(self.ends, self.alive)))
+        tree = array("q", [_NO_END]) * capacity + leaves + array("q", [_NO_END]) * (capacity - n)
+        for node in range(capacity - 1, 0, -1):
+            left, right = tree[2 * node], tree[2 * node + 1]
+            tree[node] = left if left > right else right
+        self._capacity, self._tree = capacity, tree
+
+    def _set_leaf(self, i, end):
+        tree = self._tree
+        node = self._capacity + i
+        tree[node] = end
+        node //= 2
+        while node:
+            best = max(tree[2 * node], tree[2 * node + 1])
+            if tree[node] == best:
+                break
+            tree[node] = best
+            node //= 2
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        """ (start, end, value) of the live spans in start order """
+        for i, value in enumerate(self.values):
+            if self.alive[i]:
+                yield self.starts[i], self.ends[i], value
+
+    def append(self, start: int, end: int, value: Any=None) -> int:
+        """ Adds a span that starts at or after every span already indexed; returns its position """
+        if self.starts and start < self.starts[-1]:
+            raise ValueError(f"IntervalIndex.append out of order: {start} < {self.starts[-1]}")
+        self.starts.append(start)
+        self.ends.append(end)
+        self.max_ends.append(max(end, self.max_ends[-1]) if self.max_ends else end)
+        self.values.append(value)
+        self.alive.append(1)
+        i = len(self.values) - 1
+        if i >= self._capacity:
+            # doubling: rebuilt O(log n) times over all appends
+            self._build()
+        else:
+            self._set_leaf(i, end)
+        return i
+
+    def discard(self, i: int) -> None:
+        """ Hides span i from later queries (its bounds still count towards max_ends) """
+        if self.alive[i]:
+            self.alive[i] = 0
+            self._set_leaf(i, _NO_END)
+
+    def overlapping(self, start: int, end: int) -> List[int]:
+        lo = bisect_right(self.max_ends, start)  # first span whose running max end > start
+        hi = bisect_left(self.starts, end)       # first span starting at or after end
+        return self._ending_after(lo, hi, start)
+
+    def stabbing(self, pos: int) -> List[int]:
+        lo = bisect_right(self.max_ends, pos)
+        hi = bisect_right(self.starts, pos)
+        return self._ending_after(lo, hi, pos)
+
+    def enclosing(self, start: int, end: int) -> List[int]:
+        lo = bisect_left(self.max_ends, end)     # first span whose running max end >= end
+        hi = bisect_right(self.starts, start)
+        # ends are integers: end >= e is end > e - 1
+        return self._ending_after(lo, hi, end - 1)
+
+    def _ending_after(self, lo, hi, bound):
+        """ Positions in [lo, hi) of the live spans with end > bound, in order """
+        if hi - lo <= self.SCAN:
+            ends, alive = self.ends, self.alive
+            return [i for i in range(lo, hi) if alive[i] and ends[i] > bound]
+        tree, capacity = self._tree, self._capacity
+        # the O(log n) subtrees that exactly cover [lo, hi), left to right
+        left, right = [], []
+        l, r = lo + capacity, hi + capacity
+        while l < r:
+            if l & 1:
+                left.append(l)
+                l += 1
+            if r & 1:
+                r -= 1
+                right.append(r)
+            l //= 2
+            r //= 2
+        found = []
+        for root in left + right[::-1]:
+            if tree[root] <= bound:
+                continue
+            stack = [root]
+            while stack:
+                node = stack.pop()
+                if node >= capacity:
+                    found.append(node - capacity)
+                    continue
+                node *= 2
+                # right child pushed first, so the left one is reported first
+                if tree[node + 1] > bound:
+                    stack.append(node + 1)
+                if tree[node] > bound:
+                    stack.append(node)
+        return found
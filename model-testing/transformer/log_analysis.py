@@ -2,99 +2,152 @@ import json
 from datetime import datetime
 from presidio_anonymizer import AnonymizerEngine
 from presidio_analyzer import PatternRecognizer
-from pathlib import Path
 from context_anonymizer import ContextAwareAnonymizer
 from group_entities import group_names
-from clinical_filter import ClinicalDataFilter
+from postprocess import PostProcessingPipeline
+from configurations import PIPELINE_CONFIGURATION
+from span_record import to_records, to_recognizer_results
+from run_log import run_log_for
+from instrumentation import span, count, document, instrument_analyzer
+from profiling import profiled
+
+def iter_rows(text, results, replacements={}, window=40):
+    """ JSON rows one at a time, so a results file never holds every row (and its context strings) at once """
+    for r in to_records(results):
+        original_text = text[r.start:r.end]
+        yield r.to_row(text, window, replacements.get(original_text) if len(replacements) > 0 else None)
 
 def results_to_json(text, results, replacements={}, window=40):
-    rows = []
-    print(replacements)
-    for r in results:
-        original_text = text[r.start:r.end]
-        # print(original_text, replacements[original_text])
-        rows.append({
-            "entity_type": r.entity_type,
-            "start": r.start,
-            "end": r.end,
-            "score": float(r.score),
-            "text": original_text,
-            "left_context": text[max(0, r.start-window):r.start],
-            "right_context": text[r.end:r.end+window],
-            "replacement": replacements[original_text] if len(replacements) > 0 and original_text in replacements else ""
-        })
-    return rows
+    return list(iter_rows(text, results, replacements, window))
 
 def write_json(path, rows):
+    # same line json.dumps(list(rows)) would write, built row by row
     with open(path, "a", encoding="utf-8") as f:
-        # for row in rows:
-        f.write(json.dumps(rows, ensure_ascii=False) + "\n")
-
-def first_pass(analyzer, text, doc_id, case, language="en", allow_list=[], deny_list=[], window=40):
+        f.write("[")
+        for i, row in enumerate(rows):
+            if i:
+                f.write(", ")
+            f.write(json.dumps(row, ensure_ascii=False))
+        f.write("]\n")
+
+def _analyze(analyzer, text, language, allow_list, deny_list, postprocess):
+    """ analyze + configured post-processing. Returns (results, post-processing report) """
     if len(deny_list) > 0:
         deny_recognizer = PatternRecognizer(supported_entity="HITL", deny_list=deny_list)
         analyzer.registry.add_recognizer(deny_recognizer)
 
-    results = analyzer.analyze(text=text, language=language, allow_list=allow_list)
-    
-    # filtered_results = ClinicalDataFilter.filter_results(text, results)
+    # the transformer and the context enhancer are timed as their own stages inside "analyze"
+    instrument_analyzer(analyzer)
+    # compact records from here on; RecognizerResults are rebuilt only for AnonymizerEngine
+    with span("analyze"):
+        results = to_records(analyzer.analyze(text=text, language=language, allow_list=allow_list))
+    count("detections", len(results))
+
+    # stage names, a PostProcessingPipeline, or None for PIPELINE_CONFIGURATION
+    if postprocess is None:
+        postprocess = PostProcessingPipeline.from_config(PIPELINE_CONFIGURATION)
+    elif not isinstance(postprocess, PostProcessingPipeline):
+        postprocess = PostProcessingPipeline(postprocess)
+
+    if postprocess:
+        with span("postprocess"):
+            results = postprocess.run(text, results)
+    count("entities", len(results))
+    return results, postprocess.report
+
+def _group(text, results, name_index):
+    with span("group_names"):
+        return _group_names(text, results, name_index)
+
+def _group_names(text, results, name_index):
     tagged_person = [text[r.start:r.end] for r in results if r.entity_type == "PERSON"]
     # tagged_location = [text[r.start:r.end] for r in results if r.entity_type in ["LOCATION", "GPE", "US_CITY"]]
 
-    groups = group_names(tagged_person)
-
-    anonymized_text = AnonymizerEngine().anonymize(text=text,analyzer_results=results).text
-    Path(f"logs/{case}/{doc_id}").mkdir(parents=True, exist_ok=True)
-
-    json_results = results_to_json(text, results, window=window)
-    
-    # if doc_id == 1:
-    #     with open(f"logs/{case}/original_text.txt", "w", encoding="utf-8") as f:
-    #         f.write(text)
-    with open(f"logs/{case}/{doc_id}/anonymized_text_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt", "w", encoding="utf-8") as f:
-        f.write(anonymized_text)
-
-    with open(f"logs/{case}/{doc_id}/params.txt", "w", encoding="utf-8") as f:
-        f.write(f"language: {language}\n")
-        f.write(f"allow_list: {allow_list}\n")
-        f.write(f"deny_list: {deny_list}\n")
-    
-    write_json(f"logs/{case}/{doc_id}/results_{datetime.now().strftime('%Y%m%d_%H%M%S')}", json_results)
+    if name_index is not None:
+        # case-level grouping: reuse canonical names from earlier documents
+        name_index.add(tagged_person)
+        if name_index.path:
+            # appends this document's new mentions to the index's journal
+            name_index.save()
+        return name_index.groups()
+    return group_names(tagged_person)
+
+def _write_logs(case, doc_id, pass_name, anonymized_text, json_results, language, allow_list, deny_list,
+                postprocess_report, run_log=None, store=None):
+    """ One record per pass call in the case's run log (see run_log.RunLog), and in the
+    case store if one is given (see case_store.CaseStore) """
+    with span("write_logs"):
+        _write_records(case, doc_id, pass_name, anonymized_text, json_results, language, allow_list, deny_list,
+                       postprocess_report, run_log, store)
+
+def _write_records(case, doc_id, pass_name, anonymized_text, json_results, language, allow_list, deny_list,
+                   postprocess_report, run_log, store):
+    params = {
+        "language": language,
+        "allow_list": list(allow_list),
+        "deny_list": list(deny_list),
+        # per stage: time spent and how many results it removed
+        "postprocess": postprocess_report or [],
+    }
+    # rows are consumed once: the store inserts each as it comes and the run log keeps
+    # only its JSON text, never the row dicts all at once
+    encoded = []
+
+    def encode(rows):
+        for row in rows:
+            encoded.append(json.dumps(row, ensure_ascii=False))
+            yield row
+
+    if store is not None:
+        store.record_pass(doc_id, pass_name, anonymized_text, encode(json_results), params)
+    else:
+        encoded.extend(json.dumps(row, ensure_ascii=False) for row in json_results)
+    run_log = run_log if run_log is not None else run_log_for(case)
+    run_log.append({
+        "doc_id": doc_id,
+        "pass": pass_name,
+        "ts": datetime.now().isoformat(timespec="seconds"),
+        "params": params,
+        "anonymized_text": anonymized_text,
+    }, encoded_results=encoded)
+
+def first_pass(analyzer, text, doc_id, case, language="en", allow_list=[], deny_list=[], window=40, name_index=None,
+               postprocess=None, run_log=None, store=None, profile=None):
+    """ profile: directory for a CPU/memory profile of this call (see profiling.py) """
+    with profiled(case, doc_id, profile), document(case, doc_id, "first"):
+        results, postprocess_report = _analyze(analyzer, text, language, allow_list, deny_list, postprocess)
+        groups = _group(text, results, name_index)
+
+        with span("anonymize"):
+            anonymized_text = AnonymizerEngine().anonymize(text=text,analyzer_results=to_recognizer_results(results)).text
+
+        json_results = iter_rows(text, results, window=window)
+        _write_logs(case, doc_id, "first", anonymized_text, json_results, language, allow_list, deny_list,
+                    postprocess_report, run_log, store)
     return anonymized_text, groups, doc_id + 1
 
-def second_pass(analyzer, text, doc_id, case, language="en", allow_list=[], deny_list=[], window=40):
-    if len(deny_list) > 0:
-        deny_recognizer = PatternRecognizer(supported_entity="HITL", deny_list=deny_list)
-        analyzer.registry.add_recognizer(deny_recognizer)
+def deidentify(analyzer, text, language="en", allow_list=[], deny_list=[], window=40, name_index=None,
+               postprocess=None):
+    """ analyze + post-process + ContextAwareAnonymizer without writing logs.
+    Returns (anonymized_text, results rows (a one-shot iterator), groups, post-processing report)
+    """
+    results, postprocess_report = _analyze(analyzer, text, language, allow_list, deny_list, postprocess)
+    groups = _group(text, results, name_index)
 
-    results = analyzer.analyze(text=text, language=language, allow_list=allow_list)
-    
-    # filtered_results = ClinicalDataFilter.filter_results(text, results)
-    tagged_person = [text[r.start:r.end] for r in results if r.entity_type == "PERSON"]
-    # tagged_location = [text[r.start:r.end] for r in results if r.entity_type in ["LOCATION", "GPE", "US_CITY"]]
-
-    groups = group_names(tagged_person)
-
-    anonymizer = ContextAwareAnonymizer(groups)
+    anonymizer = ContextAwareAnonymizer(groups, name_group_map=name_index.canonical_map() if name_index is not None else None)
 
     anonymized_text = anonymizer.anonymize(text=text,analyzer_results=results)
 
     replacements_dict = anonymizer.replacements
 
-    Path(f"logs/{case}/{doc_id}").mkdir(parents=True, exist_ok=True)
-
-    json_results = results_to_json(text, results, replacements_dict, window=window)
-    
-    # if doc_id == 1:
-    #     with open(f"logs/{case}/original_text.txt", "w", encoding="utf-8") as f:
-    #         f.write(text)
-    with open(f"logs/{case}/{doc_id}/anonymized_text_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt", "w", encoding="utf-8") as f:
-        f.write(anonymized_text)
-
-    with open(f"logs/{case}/{doc_id}/params.txt", "w", encoding="utf-8") as f:
-        f.write(f"language: {language}\n")
-        f.write(f"allow_list: {allow_list}\n")
-        f.write(f"deny_list: {deny_list}\n")
-    
-    write_json(f"logs/{case}/{doc_id}/results_{datetime.now().strftime('%Y%m%d_%H%M%S')}", json_results)
+    json_results = iter_rows(text, results, replacements_dict, window=window)
+    return anonymized_text, json_results, groups, postprocess_report
+
+def second_pass(analyzer, text, doc_id, case, language="en", allow_list=[], deny_list=[], window=40, name_index=None,
+                postprocess=None, run_log=None, store=None):
+    with document(case, doc_id, "second"):
+        anonymized_text, json_results, groups, postprocess_report = deidentify(
+            analyzer, text, language, allow_list, deny_list, window, name_index, postprocess)
+        _write_logs(case, doc_id, "second", anonymized_text, json_results, language, allow_list, deny_list,
+                    postprocess_report, run_log, store)
     return anonymized_text, groups, doc_id + 1
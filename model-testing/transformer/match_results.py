@@ -2,23 +2,58 @@ import os
 import json
 import operator
 from pprint import pprint
+from interval_index import IntervalIndex
+from span_record import SpanRecord
+from instrumentation import timed
 
 def read_json_file(path):
     with open(path, 'r', encoding="utf-8") as f:
         return json.load(f)
 
-def link_json(output_dir, input_json_path):
-    with open(input_json_path, 'r', encoding="utf-8") as f:
-        input_data = json.load(f)
-
-    # sort entities by global start index
-    input_json = sorted(input_data, key=operator.itemgetter("start"))
-
+def page_json_files(output_dir):
     # get all JSON files and sort them by page number
     # get only page OCR JSON files (skip replacements.json and anything else)
     json_files = [f for f in os.listdir(output_dir) if f.endswith(".json") and "_page" in f and f.endswith("_ocr.json")]
     json_files.sort(key=lambda x: int(x.split('_page')[1].split('_')[0]))
+    return [os.path.join(output_dir, f) for f in json_files]
 
+def link_json(output_dir, input_json_path):
+    with open(input_json_path, 'r', encoding="utf-8") as f:
+        rows = json.load(f)
+    link_rows(rows, page_json_files(output_dir))
+
+def link_tokens(entities, tokens, offset=0):
+    """ Sets word["replacement"] on the tokens of one page from an IntervalIndex of SpanRecords.
+    offset is where the page text starts in the text the entities were found in.
+    """
+    for word in tokens:
+        word_start = word["char_start"] + offset
+        word_end = word["char_end"] + offset
+
+        # overlap test: [word_start, word_end) overlaps [es, ee)
+        hits = entities.overlapping(word_start, word_end)
+        if hits:
+            entity = entities.values[hits[0]]
+            # first token that contains entity start gets replacement; rest blank
+            if word_start <= entity.start < word_end:
+                word["replacement"] = entity.replacement
+            else:
+                word["replacement"] = ""
+    return tokens
+
+def link_rows(rows, json_files):
+    """
+    Writes each entity's replacement onto the OCR tokens it covers.
+
+    rows: results rows (results_to_json / iter_rows) with offsets into the page texts joined by "\n"
+    json_files: page OCR JSON files in page order; updated in place
+    """
+    link_records([SpanRecord.from_row(row) for row in rows], json_files)
+
+@timed("link")
+def link_records(entities, json_files):
+    """ link_rows for SpanRecords (with their replacements), e.g. collected while the rows
+    were streamed into a results file """
 
     # load pages and compute global offsets per page using full_text length
     # sep must match how you built the global text for input_json offsets
@@ -26,8 +61,7 @@ def link_json(output_dir, input_json_path):
     pages = []
     global_offset = 0
 
-    for filename in json_files:
-        filepath = os.path.join(output_dir, filename)
+    for filepath in json_files:
         with open(filepath, 'r', encoding="utf-8") as file:
             json_page = json.load(file)
 
@@ -35,7 +69,7 @@ def link_json(output_dir, input_json_path):
         page_text_len = len(json_page.get("full_text", ""))  # page-local length
 
         pages.append({
-            "filename": filename,
+            "filename": os.path.basename(filepath),
             "filepath": filepath,
             "json_page": json_page,
             "tokens": tokens,
@@ -44,40 +78,14 @@ def link_json(output_dir, input_json_path):
 
         global_offset += page_text_len + sep
 
-    k = 0  # entity index
+    # entities indexed by global span; each word takes the first entity (by start) it overlaps
+    entities = IntervalIndex.from_spans(entities)
 
     for i, page in enumerate(pages):
-
-        offset = page["offset"]
-        tokens = page["tokens"]
-
-        for word in tokens:
-            if k >= len(input_json):
-                break
-
-            word_start = word["char_start"] + offset
-            word_end = word["char_end"] + offset
-
-            # advance k until current entity could overlap this word
-            while k < len(input_json) and word_start >= input_json[k]["end"]:
-                k += 1
-
-            if k >= len(input_json):
-                break
-
-            es = input_json[k]["start"]
-            ee = input_json[k]["end"]
-
-            # overlap test: [word_start, word_end) overlaps [es, ee)
-            if (word_start < ee) and (word_end > es):
-                # first token that contains entity start gets replacement; rest blank
-                if word_start <= es < word_end:
-                    word["replacement"] = input_json[k]["replacement"]
-                else:
-                    word["replacement"] = ""
+        link_tokens(entities, page["tokens"], page["offset"])
 
         # write back updated page json (overwrite the page file)
-        page["json_page"]["tokens"] = tokens
+        page["json_page"]["tokens"] = page["tokens"]
         with open(page["filepath"], "w", encoding="utf-8") as f:
             json.dump(page["json_page"], f, ensure_ascii=False, indent=2)
 
@@ -0,0 +1,194 @@
+import os
+import sys
+import time
+import array
+import struct
+import hashlib
+import tempfile
+
+# Large medical vocabulary (drug names, lab tests, abbreviations, anatomy) used by
+# ClinicalDataFilter to drop PERSON/ORGANIZATION detections that are really clinical terms.
+# The file is local (not shipped): one term per line, extra tab-separated columns and
+# lines starting with '#' are ignored.
+DEFAULT_VOCAB_PATH = os.environ.get(
+    "DEID_MEDICAL_VOCAB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "medical_vocab.txt")
+)
+INDEX_SUFFIX = ".fpidx"
+# .fpidx header: magic/version, slot count, term count (native byte order, like the slots)
+INDEX_MAGIC = b"FPIDX\x01\x00\x00"
+_INDEX_HEADER = struct.Struct("=8sQQ")
+
+
+def normalize_term(term: str) -> str:
+    return " ".join(term.lower().split())
+
+
+def fingerprint(term: str) -> int:
+    """ Stable 64-bit fingerprint of a normalized term (never 0, which marks an empty slot). """
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little") | 1
+
+
+class FingerprintSet:
+    """
+    Open-addressing hash table of 64-bit term fingerprints stored in a single array('Q').
+
+    8 bytes per slot at a load factor of at most 1/2, so ~16 bytes per term instead of the
+    ~100 a Python set of str costs, with O(1) expected lookups. Two different terms share
+    a fingerprint with probability ~n/2^64, which is negligible for a false-positive filter.
+    """
+    def __init__(self, expected_items=0):
+        capacity = 8
+        while capacity < 2 * expected_items:
+            capacity *= 2
+        self.slots = array.array("Q", bytes(8 * capacity))
+        self.count = 0
+
+    def _probe(self, fp):
+        mask = len(self.slots) - 1
+        # skip the low bit, fingerprint() forces it to 1
+        i = (fp >> 1) & mask
+        while self.slots[i] and self.slots[i] != fp:
+            i = (i + 1) & mask
+        return i
+
+    def add(self, term: str) -> None:
+        fp = fingerprint(term)
+        i = self._probe(fp)
+        if not self.slots[i]:
+            if 2 * (self.count + 1) > len(self.slots):
+                self._grow()
+                i = self._probe(fp)
+            self.slots[i] = fp
+            self.count += 1
+
+    def _grow(self):
+        old = self.slots
+        self.slots = array.array("Q", bytes(16 * len(old)))
+        for fp in old:
+            if fp:
+                self.slots[self._probe(fp)] = fp
+
+    def __contains__(self, term: str) -> bool:
+        return self.slots[self._probe(fingerprint(term))] != 0
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def nbytes(self):
+        return len(self.slots) * self.slots.itemsize
+
+    def save(self, path) -> None:
+        """ Writes the table to a temporary file next to path and renames it into place, so
+        a concurrent reader sees the previous file or the complete new one """
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                        prefix=os.path.basename(path) + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(_INDEX_HEADER.pack(INDEX_MAGIC, len(self.slots), self.count))
+                self.slots.tofile(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path) -> "FingerprintSet":
+        """ Raises ValueError unless path holds a complete table written by save() """
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) < _INDEX_HEADER.size:
+            raise ValueError(f"{path}: truncated fingerprint index")
+        magic, slots, count = _INDEX_HEADER.unpack_from(data)
+        # the probe mask needs a power-of-two slot count
+        if (magic != INDEX_MAGIC or slots < 8 or slots & (slots - 1)
+                or len(data) != _INDEX_HEADER.size + 8 * slots):
+            raise ValueError(f"{path}: not a complete fingerprint index")
+        table = cls()
+        table.slots = array.array("Q")
+        table.slots.frombytes(memoryview(data)[_INDEX_HEADER.size:])
+        table.count = len(table.slots) - table.slots.count(0)
+        if table.count != count:
+            raise ValueError(f"{path}: fingerprint index holds {table.count} terms, header says {count}")
+        return table
+
+
+class MedicalVocabulary:
+    """
+    Lazily loaded membership index over a medical vocabulary file.
+
+    Nothing is read until the first lookup. The fingerprint table is cached next to the
+    vocabulary as <path>.fpidx and reused while it is newer than the vocabulary file, so
+    later processes load it with a single read; an unreadable or incomplete cache is
+    rebuilt. A missing vocabulary file is not an error: the index is empty and every
+    lookup returns False.
+    """
+    def __init__(self, path=DEFAULT_VOCAB_PATH):
+        self.path = path
+        self._table = None
+
+    @property
+    def table(self) -> FingerprintSet:
+        if self._table is None:
+            self._table = self._load()
+        return self._table
+
+    def _load(self) -> FingerprintSet:
+        if not self.path or not os.path.exists(self.path):
+            return FingerprintSet()
+
+        index_path = self.path + INDEX_SUFFIX
+        if os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(self.path):
+            try:
+                return FingerprintSet.load(index_path)
+            except (OSError, ValueError):
+                # an older format, or damaged: rebuilt and replaced below
+                pass
+
+        table = build_index(self.path)
+        try:
+            table.save(index_path)
+        except OSError:
+            pass
+        return table
+
+    def __contains__(self, term: str) -> bool:
+        return normalize_term(term) in self.table
+
+    def __len__(self):
+        return len(self.table)
+
+
+def iter_terms(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            term = normalize_term(line.split("\t", 1)[0])
+            if term:
+                yield term
+
+
+def build_index(path) -> FingerprintSet:
+    # size the table up front from the line count so it never has to grow
+    with open(path, "rb") as f:
+        lines = sum(1 for _ in f)
+    table = FingerprintSet(expected_items=lines)
+    for term in iter_terms(path):
+        table.add(term)
+    return table
+
+
+MEDICAL_VOCABULARY = MedicalVocabulary()
+
+
+if __name__ == "__main__":
+    # Build (or rebuild) the cached index: python medical_vocab.py [vocab.txt]
+    path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_VOCAB_PATH
+    t0 = time.perf_counter()
+    table = build_index(path)
+    table.save(path + INDEX_SUFFIX)
+    print(f"Indexed {len(table)} terms from {path} in {time.perf_counter() - t0:.2f}s "
+          f"({table.nbytes / 2**20:.1f} MiB) -> {path + INDEX_SUFFIX}")
@@ -0,0 +1,137 @@
+import os
+import sys
+import resource
+import threading
+from collections import OrderedDict
+
+from configurations import PIPELINE_CONFIGURATION
+
+# Memory accounting and the memory budget.
+#
+# The budget is the resident memory the process may use: DEID_MEMORY_BUDGET_MB in the
+# environment, else PIPELINE_CONFIGURATION["MEMORY_BUDGET_MB"], else half of physical
+# memory. Stages that hold pages in memory ask it how much room is left:
+#
+#   pdf_pages.iter_pdf_pages       renders no more pages ahead than fit
+#   PageCache                      rendered pages for previews, least recently used evicted
+#                                  past its own limit or when the process is over budget
+#   PagePipeline                   shrinks its queues to what fits
+#
+# rss_mb() is the current resident set; peak_rss_mb() the high-water mark since
+# reset_peak() on Linux, since process start elsewhere.
+
+ENV_VAR = "DEID_MEMORY_BUDGET_MB"
+# pages decoded at a time may use this share of what is left; OCR and rendering need the rest
+PAGE_SHARE = 0.5
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def rss_mb() -> float:
+    """ Current resident set size of this process """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 2**20
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        # only the peak is available; an upper bound
+        return _ru_maxrss_mb()
+
+
+def peak_rss_mb() -> float:
+    """ Peak resident set size since reset_peak() (Linux) or process start """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return _ru_maxrss_mb()
+
+
+def reset_peak() -> bool:
+    """ Restarts peak_rss_mb() from the current RSS; False where the OS does not allow it """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _ru_maxrss_mb():
+    # KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (2**20 if sys.platform == "darwin" else 1024)
+
+
+def budget_mb() -> float:
+    """ The memory budget in MiB; see the module comment """
+    configured = os.environ.get(ENV_VAR) or PIPELINE_CONFIGURATION.get("MEMORY_BUDGET_MB")
+    if configured:
+        return float(configured)
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") / 2**20 / 2
+    except (ValueError, OSError, AttributeError):
+        return 4096.0
+
+
+def available_mb(budget=None) -> float:
+    """ Budget left above the current RSS (negative when over budget) """
+    return (budget if budget is not None else budget_mb()) - rss_mb()
+
+
+def over_budget(budget=None) -> bool:
+    return available_mb(budget) < 0
+
+
+def pages_per_batch(page_mb, page_count, budget=None) -> int:
+    """ Pages that may be decoded at once within the budget (at least one) """
+    room = available_mb(budget) * PAGE_SHARE
+    return max(1, min(page_count, int(room // max(page_mb, 1e-6))))
+
+
+class PageCache:
+    """
+    Least-recently-used cache of rendered page images keyed by anything hashable. Entries
+    are evicted past max_mb, and down to the entry being returned whenever the process is
+    over the memory budget.
+    """
+    def __init__(self, max_mb=256, budget=None):
+        self.max_mb = max_mb
+        self.budget = budget
+        self.size_mb = 0.0
+        self._entries = OrderedDict()      # key -> (image, MiB)
+        self._lock = threading.Lock()
+
+    def get(self, key, render):
+        """ The cached image for key, or render() cached under key """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+        image = render()
+        size = len(image.getbands()) * image.width * image.height / 2**20
+        with self._lock:
+            self._entries[key] = (image, size)
+            self.size_mb += size
+            self._evict()
+        return image
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size_mb = 0.0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict(self):
+        while len(self._entries) > 1 and (self.size_mb > self.max_mb or over_budget(self.budget)):
+            _, (_, size) = self._entries.popitem(last=False)
+            self.size_mb -= size
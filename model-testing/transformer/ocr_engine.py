@@ -0,0 +1,79 @@
+import threading
+
+import pytesseract
+
+from configurations import PIPELINE_CONFIGURATION
+
+# Word-level OCR of a PIL image, as pytesseract's image_to_data dict (text, conf, left,
+# top, width, height, level, page_num, block_num, par_num, line_num, word_num).
+#
+# Engines: "tesserocr" keeps one initialized Tesseract per thread (so one per worker
+# process) and hands it the image in memory, where pytesseract writes a temp file and
+# starts a tesseract process that reloads the language model on every call; "pytesseract"
+# is that subprocess. The default is PIPELINE_CONFIGURATION["OCR_ENGINE"], or tesserocr
+# when it is installed. Both run the same Tesseract, but tesserocr links its own copy of
+# the library, which may be a different version from the tesseract on PATH.
+
+ENGINES = ("tesserocr", "pytesseract")
+TSV_COLUMNS = ("level", "page_num", "block_num", "par_num", "line_num", "word_num",
+               "left", "top", "width", "height", "conf", "text")
+
+_local = threading.local()
+
+
+def _tesserocr():
+    try:
+        import tesserocr
+    except ImportError:
+        return None
+    return tesserocr
+
+
+def default_engine() -> str:
+    configured = PIPELINE_CONFIGURATION.get("OCR_ENGINE")
+    if configured:
+        if configured not in ENGINES:
+            raise ValueError(f"Unknown OCR_ENGINE '{configured}', expected one of {ENGINES}")
+        if configured == "tesserocr" and _tesserocr() is None:
+            raise ImportError("OCR_ENGINE 'tesserocr' needs the tesserocr package: pip install tesserocr")
+        return configured
+    return "tesserocr" if _tesserocr() is not None else "pytesseract"
+
+
+def _api(lang, psm):
+    """ This thread's Tesseract for (lang, psm), initialized on first use; an API object
+    must not be shared between threads """
+    apis = getattr(_local, "apis", None)
+    if apis is None:
+        apis = _local.apis = {}
+    api = apis.get((lang, psm))
+    if api is None:
+        # tesserocr.PSM is a namespace of int constants; the mode is passed as the int
+        api = apis[(lang, psm)] = _tesserocr().PyTessBaseAPI(lang=lang, psm=psm)
+    return api
+
+
+def tsv_to_dict(tsv):
+    """ Tesseract TSV rows (no header) into image_to_data's dict, typed the way pytesseract
+    types them: every column but text as int """
+    data = {column: [] for column in TSV_COLUMNS}
+    for row in tsv.splitlines():
+        if not row:
+            continue
+        cells = row.split("\t", len(TSV_COLUMNS) - 1)
+        # the text cell is missing when the word is empty
+        cells += [""] * (len(TSV_COLUMNS) - len(cells))
+        for column, cell in zip(TSV_COLUMNS[:-1], cells):
+            data[column].append(int(float(cell)))
+        data["text"].append(cells[-1])
+    return data
+
+
+def image_to_data(image, psm=6, lang="eng", engine=None):
+    """ Word boxes of a PIL image in pytesseract's image_to_data dict layout """
+    engine = engine or default_engine()
+    if engine == "tesserocr":
+        api = _api(lang, psm)
+        api.SetImage(image)
+        return tsv_to_dict(api.GetTSVText(0))
+    return pytesseract.image_to_data(image, lang=lang, output_type=pytesseract.Output.DICT, config=f"--psm {psm}")
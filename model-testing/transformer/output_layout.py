@@ -3,10 +3,11 @@ import sys
 import json
 import re
 from PIL import Image, ImageDraw, ImageFont
-from pdf2image import convert_from_path
+from pdf_pages import iter_pdf_pages
 
 from pydicom import dcmread
 from pydicom.tag import Tag
+from instrumentation import timed, count
 
 OUTPUT_DIR = "deid_output"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
@@ -106,6 +107,7 @@ def is_empty(token):
 
 
 #image/PDF
+@timed("render")
 def insert_from_json(image_path, json_path, output_path):
     with open(json_path, "r", encoding="utf-8") as f:
         data = json.load(f)
@@ -116,8 +118,17 @@ def insert_from_json(image_path, json_path, output_path):
         img = Image.open(image_path).convert("RGB")
     except Exception as e:
         print(f"Error: {image_path}, {e}")
-        return
+        return None
 
+    draw_replacements(img, tokens)
+
+    img.save(output_path)
+    count("rendered_pages")
+    print(f"Saved to: {output_path}")
+    return output_path
+
+def draw_replacements(img, tokens):
+    """ Burns token replacements (from match_results.link_rows) into img in place and returns it """
     draw = ImageDraw.Draw(img)
 
     try:
@@ -223,41 +234,47 @@ def insert_from_json(image_path, json_path, output_path):
         draw.text((x, y_offset), replacement_text, font=font, fill="black")
         i+=1
 
-    img.save(output_path)
-    print(f"Saved to: {output_path}")
+    return img
 
 #Main
 
-def main():
-    input_path = sys.argv[1]
-    data_path = sys.argv[2]
+def render_file(input_path, data_path, output_dir=OUTPUT_DIR):
+    """
+    Writes the de-identified copy of input_path into output_dir and returns its path
+    (None if nothing was written).
 
+    data_path is the edited metadata text for a DICOM, the OCR JSON for an image and
+    the directory of page OCR JSON files for a PDF.
+    """
     base_name = os.path.splitext(os.path.basename(input_path))[0]
     extension = os.path.splitext(input_path.strip())[1].lower()
+    os.makedirs(output_dir, exist_ok=True)
 
     # DICOM
     if extension == ".dcm":
-        output_file = os.path.join(OUTPUT_DIR, f"{base_name}_deid.dcm")
+        output_file = os.path.join(output_dir, f"{base_name}_deid.dcm")
         redact_dicom(input_path, data_path, output_file)
-        return
+        return output_file
 
-    # Images
-    if extension in [".png", ".jpg", ".jpeg"]:
-        output_file = os.path.join(OUTPUT_DIR, f"{base_name}_deid.png")
-        insert_from_json(input_path, data_path, output_file)
-        return
+    # Images (anything PIL opens; the output is always PNG)
+    if extension in [".png", ".jpg", ".jpeg", ".tiff", ".bmp", ".gif"]:
+        output_file = os.path.join(output_dir, f"{base_name}_deid.png")
+        return insert_from_json(input_path, data_path, output_file)
 
     # PDFs
     if extension == ".pdf":
-        pdf_output_dir = os.path.join(OUTPUT_DIR, base_name)
+        pdf_output_dir = os.path.join(output_dir, base_name)
         os.makedirs(pdf_output_dir, exist_ok=True)
 
-        pages = convert_from_path(input_path, dpi=300)
-        deid_images = []
+        pdf_output_path = os.path.join(pdf_output_dir, f"{base_name}_deid.pdf")
+        if os.path.exists(pdf_output_path):
+            os.remove(pdf_output_path)
 
-        for idx, page_img in enumerate(pages, start=1):
+        # rasterized and appended to the output PDF one page at a time
+        for idx, page_img in iter_pdf_pages(input_path, dpi=300):
             page_file = os.path.join(pdf_output_dir, f"{base_name}_page{idx}.png")
             page_img.save(page_file)
+            del page_img
 
             json_file = os.path.join(data_path, f"{base_name}_page{idx}_ocr.json")
             if not os.path.isfile(json_file):
@@ -266,16 +283,18 @@ def main():
             output_file = os.path.join(pdf_output_dir, f"{base_name}_page{idx}_deid.png")
             insert_from_json(page_file, json_file, output_file)
 
-            deid_images.append(Image.open(output_file).convert("RGB"))
+            with Image.open(output_file) as deid_image:
+                deid_image.convert("RGB").save(pdf_output_path, append=os.path.exists(pdf_output_path))
 
-        if deid_images:
-            pdf_output_path = os.path.join(pdf_output_dir, f"{base_name}_deid.pdf")
-            deid_images[0].save(
-                pdf_output_path,
-                save_all=True,
-                append_images=deid_images[1:]
-            )
+        if os.path.exists(pdf_output_path):
             print(f"Saved PDF to: {pdf_output_path}")
+            return pdf_output_path
+    return None
+
+def main():
+    input_path = sys.argv[1]
+    data_path = sys.argv[2]
+    render_file(input_path, data_path)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,224 @@
+import os
+import json
+import time
+import queue
+import threading
+from presidio_analyzer import PatternRecognizer
+
+from tesseract_test import ocr_image, save_page
+from output_layout import draw_replacements
+from match_results import link_tokens
+from interval_index import IntervalIndex
+from context_anonymizer import ContextAwareAnonymizer
+from group_entities import NameGroupIndex
+from log_analysis import _analyze, iter_rows, write_json
+from span_record import SpanRecord
+from memory_budget import pages_per_batch, peak_rss_mb, reset_peak
+from pdf_pages import iter_pdf_pages, pdf_info, page_image_mb
+from text_layer import pdf_words
+
+# Marks the end of the page stream on every queue
+_DONE = object()
+
+
+class PagePipeline:
+    """
+    De-identifies a PDF page by page with the stages overlapped:
+
+        rasterize -> OCR -> analyze + anonymize -> link -> render
+
+    Each stage is a thread and stages are connected by queues of at most queue_depth
+    pages, so page N+1 is rasterized and OCR'd (pdftoppm/tesseract subprocesses) while
+    page N is in the NER model, and memory is bounded by the queue depth instead of the
+    page count. The depth is lowered (down to 1) when that many pages do not fit the
+    memory budget (see memory_budget.py). The output PDF is appended one page at a time.
+    Pages with a usable text layer (see text_layer.py) take their words from the PDF and
+    skip Tesseract; they are still rasterized for the output.
+
+    One ContextAwareAnonymizer and one NameGroupIndex are shared by every page, so a
+    name or date gets the same surrogate on every page. Pages are analyzed on their own:
+    an entity split across a page break is seen as two pieces.
+
+    After run(), self.report holds the pages processed, busy seconds per stage, the queue
+    depth used and the peak RSS.
+    """
+    STAGES = ("rasterize", "ocr", "analyze", "link", "render")
+
+    def __init__(self, analyzer, output_dir, queue_depth=2, dpi=300, language="en", allow_list=[],
+                 deny_list=[], name_index=None, postprocess=None, window=40, render_threads=1):
+        self.analyzer = analyzer
+        self.output_dir = output_dir
+        self.queue_depth = queue_depth
+        self.dpi = dpi
+        # pages rasterized concurrently, with the pdf2image backend only (see pdf_pages.iter_pdf_pages)
+        self.render_threads = render_threads
+        self.language = language
+        self.allow_list = allow_list
+        self.postprocess = postprocess
+        self.window = window
+        self.name_index = name_index if name_index is not None else NameGroupIndex()
+        self.anonymizer = ContextAwareAnonymizer(name_group_map=self.name_index.canonical_map())
+        self.report = {}
+
+        # added once here; log_analysis._analyze would add it again for every page
+        if len(deny_list) > 0:
+            analyzer.registry.add_recognizer(PatternRecognizer(supported_entity="HITL", deny_list=deny_list))
+
+    def run(self, pdf_path):
+        """ Returns the path of the de-identified PDF """
+        base_name = os.path.splitext(os.path.basename(pdf_path))[0]
+        out_dir = os.path.join(self.output_dir, base_name)
+        ocr_dir = os.path.join(out_dir, "ocr")
+        os.makedirs(ocr_dir, exist_ok=True)
+        paths = {
+            "pdf": os.path.join(out_dir, f"{base_name}_deid.pdf"),
+            "text": os.path.join(out_dir, f"{base_name}_deid.txt"),
+            "results": os.path.join(out_dir, "results.jsonl"),
+        }
+        for path in paths.values():
+            if os.path.exists(path):
+                os.remove(path)
+
+        page_count, _ = pdf_info(pdf_path)
+        # a decoded page can sit in every stage and every queue slot
+        fits = pages_per_batch(page_image_mb(pdf_path, self.dpi), page_count + len(self.STAGES))
+        queue_depth = max(1, min(self.queue_depth, (fits - len(self.STAGES)) // (len(self.STAGES) - 1)))
+        self.report = {"pages": 0, "seconds": 0.0, "busy": dict.fromkeys(self.STAGES, 0.0),
+                       "queue_depth": queue_depth}
+        self._stop = threading.Event()
+        self._errors = []
+        reset_peak()
+
+        queues = [queue.Queue(maxsize=queue_depth) for _ in self.STAGES[1:]]
+        workers = [
+            (self._rasterize, None, queues[0], (pdf_path, page_count)),
+            (self._ocr, queues[0], queues[1], (base_name, ocr_dir)),
+            (self._analyze, queues[1], queues[2], (paths,)),
+            (self._link, queues[2], queues[3], ()),
+            (self._render, queues[3], None, (paths,)),
+        ]
+        t0 = time.perf_counter()
+        threads = [threading.Thread(target=self._stage, args=(name, *worker), daemon=True)
+                   for name, worker in zip(self.STAGES, workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.report["seconds"] = round(time.perf_counter() - t0, 3)
+        self.report["peak_rss_mb"] = round(peak_rss_mb(), 1)
+
+        if self._errors:
+            raise self._errors[0]
+        return paths["pdf"] if self.report["pages"] else None
+
+    # --- plumbing ---
+
+    def _put(self, q, item):
+        # a bounded put that gives up once another stage has failed
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _stage(self, name, func, inbox, outbox, args):
+        """ Runs func(item, *args) for each item from inbox (or the items func yields when
+        it has no inbox) and forwards the results, then passes _DONE downstream.
+        """
+        busy = self.report["busy"]
+        try:
+            if inbox is None:
+                items = func(*args)
+                while True:
+                    t0 = time.perf_counter()
+                    item = next(items, _DONE)
+                    busy[name] += time.perf_counter() - t0
+                    if item is _DONE or not self._put(outbox, item):
+                        break
+            else:
+                while True:
+                    item = self._get(inbox)
+                    if item is _DONE:
+                        break
+                    t0 = time.perf_counter()
+                    result = func(item, *args)
+                    busy[name] += time.perf_counter() - t0
+                    if outbox is not None and not self._put(outbox, result):
+                        break
+        except Exception as e:
+            self._errors.append(e)
+            self._stop.set()
+        finally:
+            if outbox is not None and not self._stop.is_set():
+                self._put(outbox, _DONE)
+
+    # --- stages; each item is a dict describing one page ---
+
+    def _rasterize(self, pdf_path, page_count):
+        # every page is rasterized for the redacted PDF; pages with a text layer skip OCR
+        layers = pdf_words(pdf_path, self.dpi, last_page=page_count)
+        for page_num, image in iter_pdf_pages(pdf_path, dpi=self.dpi, window=self.render_threads,
+                                              threads=self.render_threads, last_page=page_count):
+            yield {"page_num": page_num, "words": layers[page_num - 1], "image": image}
+
+    def _ocr(self, page, base_name, ocr_dir):
+        words = page.pop("words")
+        if words is not None:
+            # embedded text layer (see text_layer.py); rasterized only to render
+            page["json_file"], page["text"] = save_page(words, base_name, page_num=page["page_num"], output_dir=ocr_dir)
+        else:
+            page["json_file"], page["text"] = ocr_image(page["image"], base_name, page_num=page["page_num"], output_dir=ocr_dir)
+        return page
+
+    def _analyze(self, page, paths):
+        text = page["text"]
+        results, _ = _analyze(self.analyzer, text, self.language, self.allow_list, [], self.postprocess)
+
+        # case-level name groups so far, including this page
+        changed = self.name_index.add([text[r.start:r.end] for r in results if r.entity_type == "PERSON"])
+        self.anonymizer.context.name_group_map.update(changed)
+        # the rows only need this page's replacements; kept across pages it grows with the document
+        self.anonymizer.replacements = {}
+        anonymized_text = self.anonymizer.anonymize(text=text, analyzer_results=results)
+
+        with open(paths["text"], "a", encoding="utf-8") as f:
+            f.write(anonymized_text + "\n")
+        # rows are streamed into the results file; linking only needs their spans
+        records = []
+        write_json(paths["results"], self._page_rows(iter_rows(text, results, self.anonymizer.replacements,
+                                                               window=self.window), page["page_num"], records))
+
+        page["records"] = records
+        return page
+
+    @staticmethod
+    def _page_rows(rows, page_num, records):
+        for row in rows:
+            row["page"] = page_num
+            records.append(SpanRecord.from_row(row))
+            yield row
+
+    def _link(self, page):
+        with open(page["json_file"], "r", encoding="utf-8") as f:
+            json_page = json.load(f)
+        entities = IntervalIndex.from_spans(page.pop("records"))
+        link_tokens(entities, json_page["tokens"])
+        with open(page["json_file"], "w", encoding="utf-8") as f:
+            json.dump(json_page, f, ensure_ascii=False, indent=2)
+        page["tokens"] = json_page["tokens"]
+        return page
+
+    def _render(self, page, paths):
+        image = draw_replacements(page["image"].convert("RGB"), page["tokens"])
+        image.save(paths["pdf"], append=os.path.exists(paths["pdf"]))
+        self.report["pages"] += 1
@@ -0,0 +1,148 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from configurations import PIPELINE_CONFIGURATION
+from memory_budget import pages_per_batch
+
+# PDF pages as PIL images, one at a time.
+#
+#   for page_num, image in iter_pdf_pages(pdf_path, dpi=300):
+#       ocr_image(image, ...)
+#
+# Pages are rendered in order and handed over as they are ready; only the page being
+# consumed plus at most `window` rendered ahead are held, so memory does not grow with the
+# page count. threads > 1 renders the pages ahead concurrently with the pdf2image backend
+# only: each page is its own pdftoppm process, so they run in parallel. PyMuPDF does not
+# support multi-threaded use and holds the GIL while rendering, so with it pages are
+# always rendered one at a time on the calling thread and `threads` is ignored.
+#
+# Backends: "pymupdf" (in-process, no poppler needed; app.py already uses it) or
+# "pdf2image" (pdftoppm, page by page through first_page/last_page). The default is
+# PIPELINE_CONFIGURATION["PDF_RENDERER"], or PyMuPDF when it is installed. The two
+# rasterizers anti-alias differently, so OCR output can differ slightly between them.
+
+BACKENDS = ("pymupdf", "pdf2image")
+# US letter, when the page size is unknown
+DEFAULT_PAGE_SIZE = (612.0, 792.0)
+
+
+def _pymupdf():
+    try:
+        import pymupdf
+    except ImportError:
+        try:
+            # PyMuPDF before 1.24.3
+            import fitz as pymupdf
+        except ImportError:
+            return None
+    return pymupdf
+
+
+def default_backend() -> str:
+    configured = PIPELINE_CONFIGURATION.get("PDF_RENDERER")
+    if configured:
+        if configured not in BACKENDS:
+            raise ValueError(f"Unknown PDF_RENDERER '{configured}', expected one of {BACKENDS}")
+        return configured
+    return "pymupdf" if _pymupdf() is not None else "pdf2image"
+
+
+def pdf_info(pdf_path, backend=None):
+    """ (page count, (width, height) of the first page in points) """
+    backend = backend or default_backend()
+    if backend == "pymupdf":
+        with _pymupdf().open(pdf_path) as doc:
+            rect = doc[0].rect if doc.page_count else None
+            return doc.page_count, (rect.width, rect.height) if rect else DEFAULT_PAGE_SIZE
+    from pdf2image import pdfinfo_from_path
+    info = pdfinfo_from_path(pdf_path)
+    size = info.get("Page size", "").split()
+    # "612 x 792 pts (letter)"
+    page_size = (float(size[0]), float(size[2])) if len(size) >= 3 and size[1] == "x" else DEFAULT_PAGE_SIZE
+    return info["Pages"], page_size
+
+
+def page_image_mb(pdf_path, dpi, channels=3, backend=None) -> float:
+    """ Size of one decoded page image, from the first page's size """
+    _, (width, height) = pdf_info(pdf_path, backend)
+    return (width / 72 * dpi) * (height / 72 * dpi) * channels / 2**20
+
+
+class _Renderer:
+    """ Renders single pages. The PyMuPDF document is opened on first use and must stay
+    on the thread that uses it (see the module comment) """
+    def __init__(self, pdf_path, dpi, backend):
+        self.pdf_path = pdf_path
+        self.dpi = dpi
+        self.backend = backend
+        self._doc = None
+
+    def __call__(self, page_num):
+        if self.backend == "pymupdf":
+            if self._doc is None:
+                self._doc = _pymupdf().open(self.pdf_path)
+            pix = self._doc[page_num - 1].get_pixmap(dpi=self.dpi, alpha=False)
+            # samples_mv: no intermediate bytes copy of the page
+            return Image.frombytes("RGB", (pix.width, pix.height), pix.samples_mv)
+        from pdf2image import convert_from_path
+        return convert_from_path(self.pdf_path, dpi=self.dpi, first_page=page_num, last_page=page_num)[0]
+
+    def close(self):
+        if self._doc is not None:
+            self._doc.close()
+            self._doc = None
+
+
+def render_page(pdf_path, page_num, dpi=300, backend=None):
+    """ One page (1-based) as a PIL image """
+    renderer = _Renderer(pdf_path, dpi, backend or default_backend())
+    try:
+        return renderer(page_num)
+    finally:
+        renderer.close()
+
+
+def iter_pdf_pages(pdf_path, dpi=300, window=2, threads=1, backend=None, first_page=1, last_page=None, pages=None):
+    """
+    (page_num, PIL image) for pages first_page..last_page, or the given page numbers, in
+    order. With pdf2image, at most `window` pages (fewer when they do not fit the memory
+    budget, see memory_budget.py) are rendered ahead of the consumer, by `threads` threads;
+    PyMuPDF renders one page at a time whatever `threads` is. Drop each image when done
+    with it.
+    """
+    backend = backend or default_backend()
+    page_count, _ = pdf_info(pdf_path, backend)
+    last_page = min(last_page or page_count, page_count)
+    page_nums = list(pages) if pages is not None else range(first_page, last_page + 1)
+    renderer = _Renderer(pdf_path, dpi, backend)
+    try:
+        if threads <= 1 or backend != "pdf2image":
+            for page_num in page_nums:
+                yield page_num, renderer(page_num)
+            return
+
+        ahead = min(max(window, threads), pages_per_batch(page_image_mb(pdf_path, dpi, backend=backend), page_count))
+        pages = iter(page_nums)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="pdf-render") as pool:
+            try:
+                for page_num in pages:
+                    pending.append((page_num, pool.submit(renderer, page_num)))
+                    if len(pending) >= ahead:
+                        break
+                while pending:
+                    page_num, future = pending.popleft()
+                    image = future.result()
+                    next_page = next(pages, None)
+                    if next_page is not None:
+                        pending.append((next_page, pool.submit(renderer, next_page)))
+                    yield page_num, image
+                    del image
+            finally:
+                # the consumer stopped early (or failed): drop what was not started
+                for _, future in pending:
+                    future.cancel()
+    finally:
+        renderer.close()
@@ -0,0 +1,67 @@
+import time
+from collections import Counter
+from typing import Callable, List, Union
+from presidio_analyzer import RecognizerResult
+from clinical_filter import ClinicalDataFilter
+
+# Post-processing stages that can run between analyzer.analyze() and anonymization.
+# Each stage takes (text, results) and returns the results to keep.
+# Conflict resolution and nesting are a single sort-and-sweep in ClinicalDataFilter,
+# so they are one stage here.
+STAGES = {
+    "clean_names": ClinicalDataFilter.clean_person_names,
+    "preserve_clinical": ClinicalDataFilter.preserve_clinical,
+    "false_positives": ClinicalDataFilter.remove_false_positives,
+    "resolve_overlaps": ClinicalDataFilter.resolve_overlaps,
+}
+
+# Same order as ClinicalDataFilter.filter_results
+DEFAULT_STAGES = ["clean_names", "preserve_clinical", "false_positives", "resolve_overlaps"]
+
+
+class PostProcessingPipeline:
+    """
+    Ordered list of post-processing stages with per-stage timing and counts.
+
+    After run(), self.report holds one entry per stage:
+    {"stage", "seconds", "in", "out", "removed", "removed_by_type"}
+    """
+    def __init__(self, stages: List[Union[str, Callable]]=None):
+        self.stages = []
+        for stage in DEFAULT_STAGES if stages is None else stages:
+            if isinstance(stage, str):
+                if stage not in STAGES:
+                    raise ValueError(f"Unknown post-processing stage '{stage}', expected one of {list(STAGES)}")
+                self.stages.append((stage, STAGES[stage]))
+            else:
+                self.stages.append((stage.__name__, stage))
+        self.report = []
+
+    def __bool__(self):
+        return bool(self.stages)
+
+    def run(self, text: str, results: List[RecognizerResult]) -> List[RecognizerResult]:
+        self.report = []
+        for name, stage in self.stages:
+            t0 = time.perf_counter()
+            out = stage(text, results)
+            seconds = time.perf_counter() - t0
+
+            # net results dropped per entity type (cleaned/trimmed results count as kept)
+            removed_by_type = Counter(r.entity_type for r in results)
+            removed_by_type.subtract(r.entity_type for r in out)
+
+            self.report.append({
+                "stage": name,
+                "seconds": round(seconds, 6),
+                "in": len(results),
+                "out": len(out),
+                "removed": len(results) - len(out),
+                "removed_by_type": {t: n for t, n in removed_by_type.items() if n},
+            })
+            results = out
+        return results
+
+    @classmethod
+    def from_config(cls, config: dict) -> "PostProcessingPipeline":
+        return cls(config.get("POSTPROCESS_STAGES", []))
@@ -0,0 +1,282 @@
+import os
+import re
+import sys
+import json
+import time
+import linecache
+import threading
+import tracemalloc
+from collections import defaultdict
+
+# CPU and memory profile of one document.
+#
+#   with profiled(case, doc_id, "profiles"):
+#       ...
+#
+# writes, named after the case and document:
+#
+#   profiles/<case>_<doc_id>.collapsed          folded stacks ("a;b;c <microseconds>"), for
+#                                               flamegraph.pl, speedscope or inferno
+#   profiles/<case>_<doc_id>.speedscope.json    the same samples as a speedscope profile
+#   profiles/<case>_<doc_id>.alloc.txt          tracemalloc: peak; memory per pipeline line
+#                                               and top allocation sites, at the peak and
+#                                               still allocated at the end
+#
+# CPU: a sampling thread reads the profiled thread's stack every `interval` seconds and
+# weights each sample by the time since the previous one. It needs the GIL, so time in C
+# code that holds it (regex, tokenizers) lands on the next sample, i.e. on the Python
+# caller. Memory: the sampler also takes a tracemalloc snapshot whenever traced memory has
+# grown PEAK_STEP (or a fifth) past the last one, so the peak is attributed to the sites
+# alive at the highest point it saw (a peak shorter than `interval` can be missed); the
+# profiler's own allocations are left out. tracemalloc slows allocation-heavy code (analyze
+# on a warm model) down by 10x or more, and the CPU profile with it, and each snapshot pauses
+# the profiled thread; memory=False leaves it out. Profile a warm
+# pipeline: a first call also records lazy imports and model loading.
+# profiled(..., out_dir=None) is a no-op, and so is a profile nested in another on the
+# same thread.
+
+PIPELINE_DIR = os.path.dirname(os.path.abspath(__file__))
+PEAK_STEP = 1 << 20
+
+_local = threading.local()
+
+
+class _NoProfile:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_PROFILE = _NoProfile()
+
+
+class _Sampler(threading.Thread):
+    """ Samples the stack of thread `target` until stopped and, with memory, snapshots
+    tracemalloc as traced memory reaches new highs """
+    def __init__(self, target, interval, memory=False):
+        super().__init__(name="profiling-sampler", daemon=True)
+        self.target = target
+        self.interval = interval
+        self.frames = []            # [(name, file, line)]
+        self.samples = []           # [[frame index, root first]]
+        self.weights = []           # seconds per sample
+        self._index = {}            # code object -> frame index
+        self.memory = memory
+        self.peak_snapshot = None   # tracemalloc snapshot at the highest traced memory seen
+        self.peak_snapshot_size = 0
+        self._next_snapshot = 0
+        self.running = threading.Event()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        self.running.set()
+        last = time.perf_counter()
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.target)
+            now = time.perf_counter()
+            if frame is None:
+                return
+            stack = []
+            while frame is not None:
+                stack.append(self._frame(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            self.samples.append(stack)
+            self.weights.append(now - last)
+            if self.memory:
+                self.snapshot_if_higher()
+            last = now
+
+    def watch_memory(self):
+        """ Snapshots from PEAK_STEP above the memory traced now """
+        self._next_snapshot = tracemalloc.get_traced_memory()[0] + PEAK_STEP
+
+    def snapshot_if_higher(self, force=False):
+        current = tracemalloc.get_traced_memory()[0]
+        if current >= self._next_snapshot or (force and current > self.peak_snapshot_size):
+            self.peak_snapshot = tracemalloc.take_snapshot()
+            self.peak_snapshot_size = current
+            self._next_snapshot = current + max(PEAK_STEP, current // 5)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def _frame(self, code):
+        index = self._index.get(code)
+        if index is None:
+            index = self._index[code] = len(self.frames)
+            self.frames.append((getattr(code, "co_qualname", code.co_name), code.co_filename, code.co_firstlineno))
+        return index
+
+
+class _Profile:
+    def __init__(self, case, doc_id, out_dir, interval, memory, top):
+        self.name = profile_name(case, doc_id)
+        self.out_dir = out_dir
+        self.interval = interval
+        self.memory = memory
+        self.top = top
+        self.paths = []
+        self._sampler = None
+        self._started_tracemalloc = False
+
+    def __enter__(self):
+        if getattr(_local, "active", False):
+            # nested: the outer profile already covers this block
+            self.out_dir = None
+            return self
+        _local.active = True
+        self._sampler = _Sampler(threading.get_ident(), self.interval, self.memory)
+        # running before tracing starts, so the sampler thread's own setup is not traced
+        self._sampler.start()
+        self._sampler.running.wait()
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start(25)
+            self._started_tracemalloc = True
+        if self.memory:
+            tracemalloc.reset_peak()
+            self._sampler.watch_memory()
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self._sampler is None:
+            return False
+        _local.active = False
+        self._sampler.stop()
+        seconds = time.perf_counter() - self.t0
+        snapshot = peak = None
+        if self.memory and tracemalloc.is_tracing():
+            # the end is the peak snapshot too if nothing higher was seen
+            self._sampler.snapshot_if_higher(force=True)
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+
+        os.makedirs(self.out_dir, exist_ok=True)
+        base = os.path.join(self.out_dir, self.name)
+        write_collapsed(base + ".collapsed", self._sampler)
+        write_speedscope(base + ".speedscope.json", self._sampler, self.name, seconds)
+        self.paths = [base + ".collapsed", base + ".speedscope.json"]
+        if snapshot is not None:
+            write_allocations(base + ".alloc.txt", snapshot, peak, self.top,
+                              self._sampler.peak_snapshot, self._sampler.peak_snapshot_size)
+            self.paths.append(base + ".alloc.txt")
+        return False
+
+
+def profiled(case, doc_id, out_dir, interval=0.005, memory=True, top=25):
+    """ Context manager profiling the block (this thread) into out_dir; see the module comment """
+    if not out_dir:
+        return _NO_PROFILE
+    return _Profile(case, doc_id, out_dir, interval, memory, top)
+
+
+def profile_name(case, doc_id):
+    # doc ids may be relative paths
+    return re.sub(r"[^\w.-]+", "_", f"{case}_{doc_id}").strip("_")
+
+
+def _frame_label(frame):
+    name, filename, line = frame
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def write_collapsed(path, sampler):
+    stacks = defaultdict(float)
+    for stack, weight in zip(sampler.samples, sampler.weights):
+        stacks[";".join(_frame_label(sampler.frames[i]).replace(";", ":") for i in stack)] += weight
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, weight in sorted(stacks.items()):
+            # flamegraph tools want integer counts; microseconds keep the weights
+            f.write(f"{stack} {max(1, round(weight * 1e6))}\n")
+
+
+def write_speedscope(path, sampler, name, seconds):
+    profile = {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "exporter": "profiling.py",
+        "shared": {"frames": [{"name": frame[0], "file": frame[1], "line": frame[2]} for frame in sampler.frames]},
+        "profiles": [{
+            "type": "sampled",
+            "name": name,
+            "unit": "seconds",
+            "startValue": 0,
+            "endValue": seconds,
+            "samples": sampler.samples,
+            "weights": sampler.weights,
+        }],
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(profile, f)
+
+
+def _pipeline_frame(traceback):
+    """ Innermost frame in this directory: the pipeline line an allocation is charged to """
+    for frame in reversed(traceback):
+        if frame.filename.startswith(PIPELINE_DIR) and not frame.filename.endswith("profiling.py"):
+            return frame
+    return None
+
+
+def _location(filename, lineno):
+    source = linecache.getline(filename, lineno).strip()
+    if filename.startswith(PIPELINE_DIR):
+        filename = os.path.relpath(filename, PIPELINE_DIR)
+    return f"{filename}:{lineno}  {source}"
+
+
+def _without_profiler(snapshot):
+    # all_frames: the sampler thread's allocations, and the thread start in __enter__, have
+    # this file anywhere in their traceback
+    return snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__),
+                                   tracemalloc.Filter(False, __file__, all_frames=True),
+                                   tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                                   tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>")])
+
+
+def _allocation_lines(snapshot, top, title):
+    # frames only in threading.py: thread start/exit bookkeeping, e.g. the sampler's own exit
+    stats = [stat for stat in _without_profiler(snapshot).statistics("traceback")
+             if not all(frame.filename == threading.__file__ for frame in stat.traceback)]
+
+    # traceback frames run from the outermost to the allocating one
+    by_pipeline_line = defaultdict(lambda: [0, 0])
+    for stat in stats:
+        frame = _pipeline_frame(list(stat.traceback))
+        key = (frame.filename, frame.lineno) if frame else None
+        by_pipeline_line[key][0] += stat.size
+        by_pipeline_line[key][1] += stat.count
+
+    lines = ["", f"{title}, by pipeline line (innermost frame in this directory)"]
+    for key, (size, n) in sorted(by_pipeline_line.items(), key=lambda item: item[1][0], reverse=True)[:top]:
+        where = _location(*key) if key else "(outside the pipeline)"
+        lines.append(f"  {size / 2**10:>10.1f} KiB {n:>8} blocks  {where}")
+
+    lines += ["", f"{title}, top allocation sites"]
+    for stat in stats[:top]:
+        frames = list(stat.traceback)
+        pipeline = _pipeline_frame(frames)
+        lines.append(f"  {stat.size / 2**10:>10.1f} KiB {stat.count:>8} blocks  {_location(frames[-1].filename, frames[-1].lineno)}")
+        if pipeline is not None and pipeline != frames[-1]:
+            lines.append(f"  {'':>10}     {'':>8}         from {_location(pipeline.filename, pipeline.lineno)}")
+    return lines
+
+
+def write_allocations(path, snapshot, peak, top, peak_snapshot=None, peak_snapshot_size=0):
+    """ snapshot: taken at the end; peak_snapshot: at the highest traced memory the sampler
+    saw, peak_snapshot_size bytes """
+    current, peak_size = peak
+    lines = [f"peak traced memory {peak_size / 2**20:.1f} MiB, still allocated at the end {current / 2**20:.1f} MiB"]
+    if peak_snapshot is not None:
+        lines += _allocation_lines(peak_snapshot, top, f"at the peak (snapshot at {peak_snapshot_size / 2**20:.1f} MiB)")
+    lines += _allocation_lines(snapshot, top, "still allocated at the end")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
@@ -0,0 +1,240 @@
+import time
+import json
+from collections import defaultdict
+
+import regex
+from presidio_analyzer import RecognizerResult
+
+# Where analyzer.analyze spends its time, and which recognizers earn it.
+#
+#   with RecognizerProfiler(analyzer) as profiler:
+#       for text in texts:
+#           analyzer.analyze(text=text, language="en")
+#   print(profiler.format_report())
+#
+# Attaching wraps, on this analyzer instance only: every recognizer's analyze (time,
+# calls, results returned), the compiled regex of every pattern (time spent matching,
+# raw matches), the NLP engine, the per-recognizer + LemmaContextAwareEnhancer context
+# step, and analyze itself (documents, and which results survive to the output).
+# detach() (or leaving the with block) restores everything.
+#
+# Usage (from model-testing/transformer): python recognizer_profiler.py <file.txt> ... [--json out.json]
+
+
+# recognizers constructed without a name of their own (e.g. MedicalRecognizers) are told
+# apart by their entities
+_GENERIC_NAMES = {"PatternRecognizer", "EntityRecognizer", "LocalRecognizer"}
+
+
+class _Stats:
+    __slots__ = ("calls", "seconds", "hits", "kept", "docs_hit")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.hits = 0        # results returned by the recognizer / raw regex matches
+        self.kept = 0        # results still in analyze()'s output
+        self.docs_hit = 0    # documents with at least one hit
+
+
+class _TimedRegex:
+    """ Stands in for Pattern.compiled_regex; times the lazy finditer iteration """
+    def __init__(self, regex, stats):
+        self._regex = regex
+        self._stats = stats
+
+    def finditer(self, *args, **kwargs):
+        stats = self._stats
+        stats.calls += 1
+        t0 = time.perf_counter()
+        matches = self._regex.finditer(*args, **kwargs)
+        stats.seconds += time.perf_counter() - t0
+        while True:
+            t0 = time.perf_counter()
+            match = next(matches, None)
+            stats.seconds += time.perf_counter() - t0
+            if match is None:
+                return
+            stats.hits += 1
+            yield match
+
+    def __getattr__(self, name):
+        return getattr(self._regex, name)
+
+
+class RecognizerProfiler:
+    def __init__(self, analyzer):
+        self.analyzer = analyzer
+        self.recognizers = defaultdict(_Stats)     # recognizer name -> stats
+        self.patterns = defaultdict(_Stats)        # (recognizer name, pattern name) -> stats
+        self.stages = defaultdict(_Stats)          # "analyze", "nlp", "context", ...
+        self._entities = {}                        # recognizer name -> supported entities
+        self._names = {}                           # recognizer id -> name
+        self._patched = []                         # (object, attribute, previous instance value or _MISSING)
+        self._wrapped = set()                      # ids of recognizers already wrapped
+
+    # --- attach / detach ---
+
+    def attach(self) -> "RecognizerProfiler":
+        analyzer = self.analyzer
+        self._wrap_recognizers()
+        if getattr(analyzer, "nlp_engine", None) is not None:
+            self._patch(analyzer.nlp_engine, "process_text", self._timed(self.stages["nlp"], analyzer.nlp_engine.process_text))
+        # recognizer-level enhancement plus the LemmaContextAwareEnhancer, and the latter alone
+        self._patch(analyzer, "_enhance_using_context",
+                    self._timed(self.stages["context"], analyzer._enhance_using_context))
+        if getattr(analyzer, "context_aware_enhancer", None) is not None:
+            enhancer = analyzer.context_aware_enhancer
+            self._patch(enhancer, "enhance_using_context",
+                        self._timed(self.stages["context_aware_enhancer"], enhancer.enhance_using_context))
+        self._patch(analyzer, "analyze", self._profiled_analyze(analyzer.analyze))
+        return self
+
+    def detach(self) -> None:
+        for obj, name, previous in reversed(self._patched):
+            if previous is _MISSING:
+                delattr(obj, name)
+            else:
+                setattr(obj, name, previous)
+        self._patched = []
+        self._wrapped = set()
+
+    def __enter__(self):
+        return self.attach()
+
+    def __exit__(self, *exc):
+        self.detach()
+
+    def _patch(self, obj, name, value):
+        self._patched.append((obj, name, obj.__dict__.get(name, _MISSING)))
+        setattr(obj, name, value)
+
+    @staticmethod
+    def _timed(stats, func):
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stats.calls += 1
+                stats.seconds += time.perf_counter() - t0
+        return wrapper
+
+    def _wrap_recognizers(self):
+        # also called before every analyze: recognizers added later (the HITL deny list) are picked up
+        for recognizer in self.analyzer.registry.recognizers:
+            if id(recognizer) in self._wrapped:
+                continue
+            self._wrapped.add(id(recognizer))
+            name = recognizer.name
+            if name in _GENERIC_NAMES:
+                name = f"{name} ({', '.join(recognizer.supported_entities)})"
+            self._names[recognizer.id] = name
+            self._entities[name] = recognizer.supported_entities
+            self._patch(recognizer, "analyze", self._recognizer_analyze(self.recognizers[name], recognizer.analyze))
+
+            for pattern in getattr(recognizer, "patterns", None) or []:
+                # compile as PatternRecognizer would, so it keeps our wrapper instead of recompiling
+                flags = recognizer.global_regex_flags
+                if not pattern.compiled_regex or pattern.compiled_with_flags != flags:
+                    pattern.compiled_with_flags = flags
+                    pattern.compiled_regex = regex.compile(pattern.regex, flags=flags)
+                self._patch(pattern, "compiled_regex", _TimedRegex(pattern.compiled_regex, self.patterns[(name, pattern.name)]))
+
+    @staticmethod
+    def _recognizer_analyze(stats, func):
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            results = func(*args, **kwargs)
+            stats.seconds += time.perf_counter() - t0
+            stats.calls += 1
+            if results:
+                stats.hits += len(results)
+                stats.docs_hit += 1
+            return results
+        return wrapper
+
+    def _profiled_analyze(self, func):
+        stats = self.stages["analyze"]
+
+        def wrapper(*args, **kwargs):
+            self._wrap_recognizers()
+            t0 = time.perf_counter()
+            results = func(*args, **kwargs)
+            stats.seconds += time.perf_counter() - t0
+            stats.calls += 1
+            stats.hits += len(results)
+            for result in results:
+                metadata = result.recognition_metadata or {}
+                name = self._names.get(metadata.get(RecognizerResult.RECOGNIZER_IDENTIFIER_KEY))
+                if name in self.recognizers:
+                    self.recognizers[name].kept += 1
+            return results
+        return wrapper
+
+    # --- reporting ---
+
+    def report(self) -> dict:
+        """ Stages, recognizers and patterns, each sorted by time spent (descending) """
+        documents = self.stages["analyze"].calls
+        total = self.stages["analyze"].seconds or 1e-12
+
+        def row(stats, **key):
+            return {**key, "calls": stats.calls, "seconds": round(stats.seconds, 6),
+                    "share": round(stats.seconds / total, 4), "hits": stats.hits}
+
+        recognizers = [
+            {**row(stats, recognizer=name, entities=self._entities.get(name, [])),
+             "kept": stats.kept, "docs_hit": stats.docs_hit,
+             "hit_rate": round(stats.docs_hit / documents, 4) if documents else 0.0}
+            for name, stats in self.recognizers.items()
+        ]
+        return {
+            "documents": documents,
+            "stages": sorted((row(stats, stage=name) for name, stats in self.stages.items()),
+                             key=lambda r: r["seconds"], reverse=True),
+            "recognizers": sorted(recognizers, key=lambda r: r["seconds"], reverse=True),
+            "patterns": sorted((row(stats, recognizer=name, pattern=pattern) for (name, pattern), stats in self.patterns.items()),
+                               key=lambda r: r["seconds"], reverse=True),
+        }
+
+    def format_report(self) -> str:
+        report = self.report()
+        lines = [f"{report['documents']} documents analyzed", "",
+                 f"{'stage':<28} {'calls':>7} {'seconds':>9} {'share':>6}"]
+        lines += [f"{r['stage']:<28} {r['calls']:>7} {r['seconds']:>9.3f} {r['share']:>6.1%}" for r in report["stages"]]
+
+        lines += ["", f"{'recognizer':<36} {'seconds':>9} {'share':>6} {'hits':>7} {'kept':>7} {'hit rate':>8}"]
+        for r in report["recognizers"]:
+            flag = "  never fired" if r["hits"] == 0 else ("  nothing kept" if r["kept"] == 0 else "")
+            lines.append(f"{r['recognizer'][:36]:<36} {r['seconds']:>9.3f} {r['share']:>6.1%} {r['hits']:>7} "
+                         f"{r['kept']:>7} {r['hit_rate']:>8.1%}{flag}")
+
+        if report["patterns"]:
+            lines += ["", f"{'pattern (recognizer / name)':<52} {'seconds':>9} {'matches':>8}"]
+            for r in report["patterns"]:
+                label = f"{r['recognizer']} / {r['pattern']}"[:52]
+                lines.append(f"{label:<52} {r['seconds']:>9.3f} {r['hits']:>8}")
+        return "\n".join(lines)
+
+
+_MISSING = object()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Profile the analyzer's recognizers over text files")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--json", help="also write the report here")
+    args = parser.parse_args()
+
+    from models_config import stanford_model
+
+    with RecognizerProfiler(stanford_model) as profiler:
+        for path in args.files:
+            with open(path, "r", encoding="utf-8") as f:
+                stanford_model.analyze(text=f.read(), language="en")
+    print(profiler.format_report())
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(profiler.report(), f, indent=2)
@@ -0,0 +1,330 @@
+import os
+import json
+import time
+import queue
+import atexit
+import sqlite3
+import contextlib
+import threading
+import urllib.parse
+from datetime import datetime
+
+# Append-only structured log, one per run (process) and case:
+#
+#   logs/{case}/run_<timestamp>_<pid>.jsonl[.zst]   one record per line (or per zstd frame)
+#   logs/{case}/run_<timestamp>_<pid>.idx           {"doc_id", "pass", "offset", "length"} per record
+#   logs/run_index.db                               latest record per (case, doc_id, pass) over all runs
+#
+# Records are serialized by the caller and written by a single writer thread, which
+# fsyncs in batches. The run's .idx gives the byte range of every record; each batch also
+# upserts the run_index.db row of the records it wrote (the newest run wins), so
+# find_record is one indexed query and one seek, whatever the number of runs. Writers
+# create the schema when they open the case index; lookups share one read-only
+# connection per case index.
+
+RUN_PREFIX = "run_"
+INDEX_SUFFIX = ".idx"
+CASE_INDEX_NAME = "run_index.db"
+COMPRESSIONS = (None, "zstd")
+
+_STOP = object()
+
+# case -> the RunLog this process writes for it (see run_log_for)
+_OPEN_LOGS = {}
+_OPEN_LOGS_LOCK = threading.Lock()
+
+# case index path -> read-only connection used by find_record (see _reader)
+_READERS = {}
+_READERS_LOCK = threading.Lock()
+
+_CASE_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    case_name   TEXT NOT NULL,
+    doc_id      NOT NULL,
+    pass        TEXT NOT NULL,
+    run         TEXT NOT NULL,
+    byte_offset INTEGER NOT NULL,
+    length      INTEGER NOT NULL,
+    PRIMARY KEY (case_name, doc_id, pass)
+);
+CREATE INDEX IF NOT EXISTS records_latest ON records (case_name, doc_id, run, byte_offset);
+"""
+
+# run names sort by start time, so a run that closes late cannot replace a newer run's record
+_UPSERT = (
+    "INSERT INTO records (case_name, doc_id, pass, run, byte_offset, length) VALUES (?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (case_name, doc_id, pass) DO UPDATE SET "
+    "run = excluded.run, byte_offset = excluded.byte_offset, length = excluded.length "
+    "WHERE (excluded.run, excluded.byte_offset) > (records.run, records.byte_offset)")
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError("RunLog compression='zstd' requires the zstandard package (pip install zstandard)") from e
+    return zstandard
+
+
+class RunLog:
+    """
+    Buffered, append-only JSONL log written by one background thread.
+
+    append(record) returns immediately; records are written in order and fsync'd every
+    fsync_every records or fsync_interval seconds, whichever comes first, and on
+    flush()/close(). With compression="zstd" every record is its own zstd frame, so a
+    record can still be read back from its index entry alone.
+
+    With case and case_index set (see for_case), every fsync'd batch is also recorded in the
+    case index at case_index (see find_record).
+    """
+    def __init__(self, path, compression=None, fsync_every=64, fsync_interval=1.0, case=None, case_index=None):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown RunLog compression '{compression}', expected one of {COMPRESSIONS}")
+        self.path = path
+        self.index_path = index_path_for(path)
+        self.compression = compression
+        self._compressor = _zstd().ZstdCompressor() if compression == "zstd" else None
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.index = {}
+        self.case = None if case is None else str(case)
+        self.case_index = case_index
+        # used by the writer thread only
+        self._case_conn = _connect(case_index) if case is not None and case_index else None
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._queue = queue.Queue()
+        self._error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._writer, name=f"RunLog({os.path.basename(path)})", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    @classmethod
+    def for_case(cls, case, logs_dir="logs", compression=None, **kwargs) -> "RunLog":
+        """ A new run log under logs_dir/case, recorded in logs_dir's case index """
+        name = f"{RUN_PREFIX}{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.getpid()}.jsonl"
+        if compression == "zstd":
+            name += ".zst"
+        return cls(os.path.join(logs_dir, str(case), name), compression=compression, case=case,
+                   case_index=os.path.join(logs_dir, CASE_INDEX_NAME), **kwargs)
+
+    def append(self, record: dict, encoded_results=None) -> None:
+        """ Queues one record; needs "doc_id" and "pass" keys for the index. encoded_results:
+        the record's "results" list as JSON-encoded items, appended after its other keys,
+        for callers that encode rows as they stream them instead of holding the dicts """
+        if self._error is not None:
+            raise self._error
+        if self._closed:
+            raise ValueError(f"RunLog {self.path} is closed")
+        line = json.dumps(record, ensure_ascii=False)
+        if encoded_results is not None:
+            line = f'{line[:-1]}{", " if record else ""}"results": [{", ".join(encoded_results)}]}}'
+        line = (line + "\n").encode("utf-8")
+        if self._compressor is not None:
+            line = self._compressor.compress(line)
+        self._queue.put(({"doc_id": record.get("doc_id"), "pass": record.get("pass")}, line))
+
+    def flush(self) -> None:
+        """ Blocks until everything appended so far is written and fsync'd """
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+        if self._error is not None:
+            raise self._error
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+        atexit.unregister(self.close)
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, doc_id, pass_name=None):
+        """ Latest record written by this run for doc_id (and pass_name, if given) """
+        self.flush()
+        key = (doc_id, pass_name) if pass_name else self.index.get(("latest", doc_id))
+        entry = self.index.get(key)
+        return read_record(self.path, entry) if entry else None
+
+    # --- writer thread ---
+
+    def _writer(self):
+        pending = []
+        last_sync = time.monotonic()
+        run = os.path.basename(self.path)
+        case_index = self._case_conn
+        with contextlib.closing(case_index) if case_index is not None else contextlib.nullcontext(), \
+                open(self.path, "ab") as log, open(self.index_path, "a", encoding="utf-8") as index:
+            while True:
+                item = self._queue.get()
+                try:
+                    if item is _STOP or isinstance(item, threading.Event):
+                        if pending:
+                            self._sync(log, index, case_index, pending)
+                            pending = []
+                            last_sync = time.monotonic()
+                        if item is _STOP:
+                            return
+                        item.set()
+                        continue
+
+                    key, data = item
+                    offset = log.tell()
+                    log.write(data)
+                    entry = {**key, "offset": offset, "length": len(data)}
+                    index.write(json.dumps(entry) + "\n")
+                    self.index[(key["doc_id"], key["pass"])] = entry
+                    self.index[("latest", key["doc_id"])] = (key["doc_id"], key["pass"])
+                    pending.append((self.case, key["doc_id"], key["pass"] or "", run, offset, len(data)))
+
+                    # batch fsyncs: by count, by time, or when the queue runs dry
+                    if len(pending) >= self.fsync_every or time.monotonic() - last_sync >= self.fsync_interval \
+                            or self._queue.empty():
+                        self._sync(log, index, case_index, pending)
+                        pending = []
+                        last_sync = time.monotonic()
+                except Exception as e:
+                    self._error = e
+                    if isinstance(item, threading.Event):
+                        item.set()
+
+    @staticmethod
+    def _sync(log, index, case_index, pending):
+        log.flush()
+        index.flush()
+        os.fsync(log.fileno())
+        os.fsync(index.fileno())
+        # only after the records are on disk, so the case index never points past the log
+        if case_index is not None:
+            with case_index:
+                case_index.executemany(_UPSERT, pending)
+
+
+def _connect(case_index):
+    os.makedirs(os.path.dirname(case_index) or ".", exist_ok=True)
+    conn = sqlite3.connect(case_index, timeout=30, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    with conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_CASE_INDEX_SCHEMA)
+    return conn
+
+
+def _reader(case_index):
+    """ Cached read-only connection to case_index; callers hold _READERS_LOCK while using it.
+    Each query runs in its own read transaction, so it sees every batch committed so far.
+    """
+    conn = _READERS.get(case_index)
+    if conn is None:
+        uri = "file:" + urllib.parse.quote(os.path.abspath(case_index)) + "?mode=ro"
+        conn = _READERS[case_index] = sqlite3.connect(uri, uri=True, timeout=30, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+    return conn
+
+
+def run_log_for(case, logs_dir="logs", compression=None) -> RunLog:
+    """ This process's run log for case, opened on first use. compression defaults to
+    PIPELINE_CONFIGURATION["RUN_LOG_COMPRESSION"].
+    """
+    key = (logs_dir, str(case))
+    with _OPEN_LOGS_LOCK:
+        log = _OPEN_LOGS.get(key)
+        if log is None or log._closed:
+            if compression is None:
+                from configurations import PIPELINE_CONFIGURATION
+                compression = PIPELINE_CONFIGURATION.get("RUN_LOG_COMPRESSION")
+            log = _OPEN_LOGS[key] = RunLog.for_case(case, logs_dir, compression)
+        return log
+
+
+def index_path_for(path):
+    for suffix in (".jsonl.zst", ".jsonl"):
+        if path.endswith(suffix):
+            return path[:-len(suffix)] + INDEX_SUFFIX
+    return path + INDEX_SUFFIX
+
+
+def read_record(path, entry) -> dict:
+    with open(path, "rb") as f:
+        f.seek(entry["offset"])
+        data = f.read(entry["length"])
+    if path.endswith(".zst"):
+        data = _zstd().ZstdDecompressor().decompress(data)
+    return json.loads(data)
+
+
+def load_index(index_path) -> dict:
+    """ (doc_id, pass) -> index entry; later entries win """
+    entries = {}
+    with open(index_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # partial last line from a killed run
+                continue
+            entries[(entry["doc_id"], entry["pass"])] = entry
+            entries[("latest", entry["doc_id"])] = (entry["doc_id"], entry["pass"])
+    return entries
+
+
+def find_record(case, doc_id, pass_name=None, logs_dir="logs"):
+    """
+    Latest record for doc_id (of pass_name, if given) in any run of the case, newest run
+    first; None if absent. One lookup in logs_dir's case index, then one read of the log.
+    """
+    open_log = _OPEN_LOGS.get((logs_dir, str(case)))
+    if open_log is not None and not open_log._closed:
+        # records this process appended may still be queued
+        open_log.flush()
+    case_index = os.path.join(logs_dir, CASE_INDEX_NAME)
+    if not os.path.exists(case_index):
+        return None
+    query = "SELECT run, byte_offset, length FROM records WHERE case_name = ? AND doc_id = ?"
+    args = [str(case), doc_id]
+    if pass_name:
+        query += " AND pass = ?"
+        args.append(pass_name)
+    with _READERS_LOCK:
+        row = _reader(case_index).execute(query + " ORDER BY run DESC, byte_offset DESC LIMIT 1", args).fetchone()
+    if row is None:
+        return None
+    return read_record(os.path.join(logs_dir, str(case), row["run"]),
+                       {"offset": row["byte_offset"], "length": row["length"]})
+
+
+def reindex_case(case, logs_dir="logs") -> int:
+    """
+    Rebuilds the case index rows of a case from its runs' .idx files (logs written before
+    the case index existed, or by a run killed between its write and its index update).
+    Returns the number of index entries read.
+    """
+    case_dir = os.path.join(logs_dir, str(case))
+    if not os.path.isdir(case_dir):
+        return 0
+    rows = []
+    for name in os.listdir(case_dir):
+        if not (name.startswith(RUN_PREFIX) and name.endswith(INDEX_SUFFIX)):
+            continue
+        stem = name[:-len(INDEX_SUFFIX)]
+        run = next((stem + suffix for suffix in (".jsonl", ".jsonl.zst")
+                    if os.path.exists(os.path.join(case_dir, stem + suffix))), None)
+        if run is None:
+            continue
+        for key, entry in load_index(os.path.join(case_dir, name)).items():
+            if key[0] != "latest":
+                rows.append((str(case), entry["doc_id"], entry["pass"] or "", run, entry["offset"], entry["length"]))
+    with contextlib.closing(_connect(os.path.join(logs_dir, CASE_INDEX_NAME))) as conn, conn:
+        conn.executemany(_UPSERT, rows)
+    return len(rows)
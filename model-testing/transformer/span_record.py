@@ -0,0 +1,82 @@
+from typing import Iterable, List
+from presidio_analyzer import RecognizerResult
+
+
+class SpanRecord:
+    """
+    Compact detection used between analysis and the output boundary.
+
+    Presidio's RecognizerResult carries an AnalysisExplanation and a metadata dict per
+    detection, and every JSON row also holds left/right context strings. Inside the
+    pipeline (post-processing, grouping, anonymization, linking) only the bounds, type,
+    score and replacement are read, so detections are converted to SpanRecord right
+    after analyzer.analyze() and back only where Presidio or a JSON file needs them:
+    to_recognizer_result() for AnonymizerEngine and to_row() for results files.
+
+    Attribute names match RecognizerResult, so code that reads .entity_type/.start/
+    .end/.score works on either.
+    """
+    __slots__ = ("entity_type", "start", "end", "score", "replacement")
+
+    def __init__(self, entity_type: str, start: int, end: int, score: float, replacement: str=None):
+        self.entity_type = entity_type
+        self.start = start
+        self.end = end
+        self.score = score
+        self.replacement = replacement
+
+    def __repr__(self):
+        return f"SpanRecord({self.entity_type!r}, {self.start}, {self.end}, {self.score:.2f})"
+
+    @classmethod
+    def from_recognizer_result(cls, result: RecognizerResult) -> "SpanRecord":
+        return cls(result.entity_type, result.start, result.end, float(result.score))
+
+    @classmethod
+    def from_row(cls, row: dict) -> "SpanRecord":
+        """ From a results_to_json row (results_<timestamp> files) """
+        return cls(row["entity_type"], row["start"], row["end"], row["score"], row.get("replacement"))
+
+    def to_recognizer_result(self) -> RecognizerResult:
+        return RecognizerResult(self.entity_type, self.start, self.end, self.score)
+
+    def to_row(self, text: str, window: int=40, replacement: str=None) -> dict:
+        """ JSON row written to results files, with window characters of context either side """
+        if replacement is None:
+            replacement = self.replacement
+        return {
+            "entity_type": self.entity_type,
+            "start": self.start,
+            "end": self.end,
+            "score": float(self.score),
+            "text": text[self.start:self.end],
+            "left_context": text[max(0, self.start - window):self.start],
+            "right_context": text[self.end:self.end + window],
+            "replacement": replacement or "",
+        }
+
+    def with_bounds(self, start: int, end: int) -> "SpanRecord":
+        return SpanRecord(self.entity_type, start, end, self.score, self.replacement)
+
+
+def to_records(results: Iterable) -> List[SpanRecord]:
+    """ RecognizerResults (or SpanRecords, passed through) -> SpanRecords """
+    return [r if isinstance(r, SpanRecord) else SpanRecord.from_recognizer_result(r) for r in results]
+
+
+def to_recognizer_results(records: Iterable) -> List[RecognizerResult]:
+    return [r.to_recognizer_result() if isinstance(r, SpanRecord) else r for r in records]
+
+
+def with_bounds(result, start: int, end: int):
+    """ Copy of result (SpanRecord or RecognizerResult) with new bounds, of the same type """
+    if isinstance(result, SpanRecord):
+        return result.with_bounds(start, end)
+    return RecognizerResult(
+        entity_type=result.entity_type,
+        start=start,
+        end=end,
+        score=result.score,
+        analysis_explanation=result.analysis_explanation,
+        recognition_metadata=result.recognition_metadata
+    )
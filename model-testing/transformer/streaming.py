@@ -0,0 +1,122 @@
+import re
+from typing import Callable, Iterable, Iterator, List, Union
+
+from context_anonymizer import ContextAwareAnonymizer
+from group_entities import NameGroupIndex
+from log_analysis import _analyze, iter_rows
+from span_record import with_bounds
+
+# Where a window may be cut: after sentence punctuation or at a blank line
+_SENTENCE_END_RE = re.compile(r"[.!?][\"')\]]*\s+|\n\s*\n")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def iter_text(source, block_size=1 << 16) -> Iterator[str]:
+    """ Reads a path or text file object in blocks of block_size characters """
+    if isinstance(source, str):
+        with open(source, "r", encoding="utf-8") as f:
+            yield from iter_text(f, block_size)
+        return
+    while True:
+        block = source.read(block_size)
+        if not block:
+            return
+        yield block
+
+
+def _find_cut(buf, lo, hi):
+    """ Last sentence boundary in buf[lo:hi], else last whitespace, else hi """
+    cut = None
+    for match in _SENTENCE_END_RE.finditer(buf, lo, hi):
+        cut = match.end()
+    if cut is None:
+        for match in _WHITESPACE_RE.finditer(buf, lo, hi):
+            cut = match.end()
+    return cut if cut is not None else hi
+
+
+def stream_deidentify(analyzer, source: Union[str, Iterable[str]], window=20000, lookahead=1000, context=1000,
+                      language="en", allow_list=[], postprocess=None, name_index=None,
+                      on_results: Callable[[List[dict]], None]=None, window_chars=40) -> Iterator[str]:
+    """
+    Anonymizes a text of any size, yielding anonymized chunks in order.
+
+    source is a path, a text file object or any iterable of str blocks. The text is
+    analyzed in windows of about `window` characters cut at sentence boundaries. Each
+    analysis also sees `context` characters before the window (already emitted) and
+    `lookahead` characters after it, so entities on a seam are detected with their full
+    text; an entity that crosses the cut moves the cut to its end. Only entities that
+    start inside the window are anonymized in it.
+
+    One anonymizer and NameGroupIndex are shared by all windows, so surrogates stay
+    consistent. Memory is bounded by window + lookahead + context plus the identity
+    tables, which grow with the number of distinct entities, not with input size.
+
+    on_results, if given, is called per window with the results rows (see
+    log_analysis.iter_rows), offsets relative to the whole input.
+    """
+    if isinstance(source, str) or hasattr(source, "read"):
+        source = iter_text(source)
+    blocks = iter(source)
+
+    name_index = name_index if name_index is not None else NameGroupIndex()
+    anonymizer = ContextAwareAnonymizer(name_group_map=name_index.canonical_map())
+
+    buf = ""         # buf[0:ctx] was already emitted and is kept only as left context
+    ctx = 0
+    offset = 0       # position of buf[0] in the whole input
+    exhausted = False
+
+    while True:
+        while not exhausted and len(buf) - ctx < window + lookahead:
+            block = next(blocks, None)
+            if block is None:
+                exhausted = True
+            else:
+                buf += block
+        if len(buf) == ctx:
+            return
+
+        if exhausted and len(buf) - ctx <= window + lookahead:
+            cut = len(buf)
+        else:
+            cut = _find_cut(buf, ctx + window // 2, ctx + window)
+        end = min(len(buf), cut + lookahead)
+
+        text = buf[:end]
+        results, _ = _analyze(analyzer, text, language, allow_list, [], postprocess)
+
+        # keep entities that start in this window; extend the cut over any that cross it
+        kept = []
+        for result in sorted(results, key=lambda r: r.start):
+            if result.end <= ctx or result.start >= cut:
+                continue
+            if result.start < ctx:
+                # found again with more context; the emitted part cannot change
+                result = with_bounds(result, ctx, result.end)
+            if result.end > cut:
+                cut = result.end
+            kept.append(result)
+
+        segment = buf[ctx:cut]
+        segment_results = [with_bounds(r, r.start - ctx, r.end - ctx) for r in kept]
+
+        changed = name_index.add([segment[r.start:r.end] for r in segment_results if r.entity_type == "PERSON"])
+        anonymizer.context.name_group_map.update(changed)
+        anonymizer.replacements = {}
+        anonymized = anonymizer.anonymize(text=segment, analyzer_results=segment_results)
+
+        if on_results is not None:
+            rows = list(iter_rows(segment, segment_results, anonymizer.replacements, window=window_chars))
+            for row in rows:
+                row["start"] += offset + ctx
+                row["end"] += offset + ctx
+            on_results(rows)
+
+        yield anonymized
+
+        # drop what was emitted, keeping `context` characters of it
+        keep_from = max(0, cut - context)
+        offset += keep_from
+        buf = buf[keep_from:]
+        ctx = cut - keep_from
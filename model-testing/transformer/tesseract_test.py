@@ -1,33 +1,35 @@
-# Dependencies: Tesseract (on PATH), pytesseract, Pillow, pdf2image, pydicom
+# Dependencies: Tesseract (on PATH), pytesseract, Pillow, pdf2image, pydicom; optional: tesserocr (see ocr_engine.py)
 import sys
 import os
 import json
 from PIL import Image
-import pytesseract
-from pdf2image import convert_from_path
 import pydicom
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from configurations import PIPELINE_CONFIGURATION
+from instrumentation import timed, span, count
+from memory_budget import pages_per_batch
+from ocr_engine import image_to_data
+from pdf_pages import page_image_mb, render_page
+from text_layer import iter_pdf_content, pdf_words
 
 OUTPUT_DIR = "ocr_output"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 
+@timed("ocr")
 def ocr_image(image, base_name, page_num=None, output_dir=OUTPUT_DIR, preserve_lines=True, psm=6):
-    # saving both json and text for source file
-    if page_num:
-        json_file = os.path.join(output_dir, f"{base_name}_page{page_num}_ocr.json")
-        text_file = os.path.join(output_dir, f"{base_name}_page{page_num}.txt")
-    else:
-        json_file = os.path.join(output_dir, f"{base_name}_ocr.json")
-        text_file = os.path.join(output_dir, f"{base_name}.txt")
+    with span("tesseract"):
+        data = image_to_data(image, psm=psm)
+    return save_page(data, base_name, page_num, output_dir, preserve_lines)
 
-    config = f"--psm {psm}"
-    data = pytesseract.image_to_data(
-        image,
-        output_type=pytesseract.Output.DICT,
-        config=config
-    )
 
+def page_from_data(data, preserve_lines=True):
+    """
+    {"full_text", "tokens"} from word boxes in pytesseract's image_to_data dict layout
+    (text, conf, left, top, width, height, block_num, par_num, line_num, word_num), from
+    Tesseract or a PDF text layer (see text_layer.py)
+    """
     n = len(data["text"])
 
     if preserve_lines:
@@ -137,7 +139,24 @@ def ocr_image(image, base_name, page_num=None, output_dir=OUTPUT_DIR, preserve_l
 
         full_text = "".join(full_text_parts)
 
-    output = {"full_text": full_text, "tokens": tokens}
+    return {"full_text": full_text, "tokens": tokens}
+
+
+def save_page(data, base_name, page_num=None, output_dir=OUTPUT_DIR, preserve_lines=True):
+    """ Builds the page JSON from word boxes (see page_from_data) and writes it with the
+    page text. Returns (json_file, full_text). """
+    # saving both json and text for source file
+    if page_num:
+        json_file = os.path.join(output_dir, f"{base_name}_page{page_num}_ocr.json")
+        text_file = os.path.join(output_dir, f"{base_name}_page{page_num}.txt")
+    else:
+        json_file = os.path.join(output_dir, f"{base_name}_ocr.json")
+        text_file = os.path.join(output_dir, f"{base_name}.txt")
+
+    output = page_from_data(data, preserve_lines)
+    full_text = output["full_text"]
+    count("pages")
+    count("tokens", len(output["tokens"]))
 
     with open(json_file, "w", encoding="utf-8") as f:
         json.dump(output, f, ensure_ascii=False, indent=2)
@@ -146,7 +165,7 @@ def ocr_image(image, base_name, page_num=None, output_dir=OUTPUT_DIR, preserve_l
         f.write(full_text)
 
     print(f"Saved JSON to {json_file} and text to {text_file}")
-
+    return json_file, full_text
 
 
 # def ocr_image(image, base_name, page_num=None, output_dir=OUTPUT_DIR):
@@ -214,11 +233,11 @@ def ocr_image(image, base_name, page_num=None, output_dir=OUTPUT_DIR, preserve_l
 #     print(f"Saved JSON to {json_file} and text to {text_file}")
 
 
-def save_dicom_metadata(ds, base_name):
+def save_dicom_metadata(ds, base_name, output_dir=OUTPUT_DIR):
     # dicom metadata to text
     # does not handel pixel data
     # not compatible with output_layout atm. 
-    meta_file = os.path.join(OUTPUT_DIR, f"{base_name}_dicom_metadata.txt")
+    meta_file = os.path.join(output_dir, f"{base_name}_dicom_metadata.txt")
     with open(meta_file, "w", encoding="utf-8") as f:
         for elem in ds.iterall():
             # Only write tags with values
@@ -227,24 +246,70 @@ def save_dicom_metadata(ds, base_name):
     print(f"Saved DICOM metadata to {meta_file}")
 
 
-def main():
-    if len(sys.argv) < 2:
-        print("python run_ocr.py <input_file>")
-        sys.exit(1)
-
-    input_path = sys.argv[1]
+def _init_ocr_worker(configuration):
+    # the parent's settings (OCR_ENGINE, PDF_RENDERER), also where workers are spawned
+    PIPELINE_CONFIGURATION.update(configuration)
+    # one page per process already fills the cores; Tesseract's OpenMP threads on top of
+    # that only compete for them. Inherited by the tesseract subprocesses, and read by
+    # tesserocr's when it is first imported (in the worker, see ocr_engine.py).
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+
+
+def _ocr_pdf_page(pdf_path, page_num, base_name, output_dir, dpi=300):
+    # in a worker: the page is rendered here, so only its path crosses processes
+    return ocr_image(render_page(pdf_path, page_num, dpi), base_name, page_num=page_num, output_dir=output_dir)
+
+
+def ocr_pdf_parallel(pdf_path, base_name, output_dir, workers, dpi=300):
+    """
+    OCR the image-only pages of a PDF in a pool of `workers` processes, each rendering and
+    OCR'ing one page at a time; pages with a text layer are read here meanwhile. Returns
+    [(json_file, full_text), ...] in page order, whatever order the pages finish in.
+    Stage timings of the pages OCR'd in workers stay in the workers.
+    """
+    layers = pdf_words(pdf_path, dpi)
+    image_pages = [page_num for page_num, words in enumerate(layers, start=1) if words is None]
+    results = [None] * len(layers)
+    # each worker holds one rendered page (plus tesseract's copy of it); processes are only
+    # started for pages submitted
+    workers = min(workers, pages_per_batch(2 * page_image_mb(pdf_path, dpi), len(image_pages)))
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_ocr_worker,
+                               initargs=(dict(PIPELINE_CONFIGURATION),))
+    try:
+        futures = {page_num: pool.submit(_ocr_pdf_page, pdf_path, page_num, base_name, output_dir, dpi)
+                   for page_num in image_pages}
+        for page_num, words in enumerate(layers, start=1):
+            if words is not None:
+                count("text_layer_pages")
+                results[page_num - 1] = save_page(words, base_name, page_num=page_num, output_dir=output_dir)
+        for page_num, future in futures.items():
+            results[page_num - 1] = future.result()
+    finally:
+        # a failed page fails the file; drop the pages not started
+        pool.shutdown(cancel_futures=True)
+    return results
+
+
+def ocr_file(input_path, output_dir=OUTPUT_DIR, workers=1):
+    """
+    OCR a DICOM, PDF or image file into output_dir (PDF pages go to output_dir/<base_name>/).
+    workers > 1 OCRs the pages of a PDF in that many processes (see ocr_pdf_parallel).
+
+    Returns [(json_file, full_text), ...] in page order; empty for a DICOM without pixel data.
+    """
     base_name = os.path.splitext(os.path.basename(input_path))[0]
     extension = os.path.splitext(input_path)[1].lower()
+    os.makedirs(output_dir, exist_ok=True)
 
     # handling DICOM
     if extension == ".dcm":
         print("Processing DICOM...")
         ds = pydicom.dcmread(input_path)
-        save_dicom_metadata(ds, base_name)
+        save_dicom_metadata(ds, base_name, output_dir)
 
         if "PixelData" not in ds:
             print("No pixel data found in DICOM, metadata saved")
-            return
+            return []
 
         pixel_array = ds.pixel_array
         image = (
@@ -252,31 +317,57 @@ def main():
             if len(pixel_array.shape) == 3
             else Image.fromarray(pixel_array).convert("L")
         )
-        ocr_image(image, base_name)
-        return
+        return [ocr_image(image, base_name, output_dir=output_dir)]
 
     # handling PDF
     if extension == ".pdf":
         # Create a subfolder for this PDF (used for output_layout)
-        pdf_output_dir = os.path.join(OUTPUT_DIR, base_name)
+        pdf_output_dir = os.path.join(output_dir, base_name)
         os.makedirs(pdf_output_dir, exist_ok=True)
 
-        pages = convert_from_path(input_path, dpi=300)
-        for idx, page_img in enumerate(pages, start=1):
+        if workers > 1:
+            results = ocr_pdf_parallel(input_path, base_name, pdf_output_dir, workers)
+            print(f"Outputs saved in {pdf_output_dir}")
+            return results
+
+        # pages with a usable text layer are read from the PDF; the rest are rasterized one
+        # at a time, handed to OCR and released
+        results = []
+        for idx, words, page_img in iter_pdf_content(input_path, dpi=300):
             # pass subfolder as output dir
-            ocr_image(page_img, base_name, page_num=idx, output_dir=pdf_output_dir)
+            if words is not None:
+                count("text_layer_pages")
+                results.append(save_page(words, base_name, page_num=idx, output_dir=pdf_output_dir))
+            else:
+                results.append(ocr_image(page_img, base_name, page_num=idx, output_dir=pdf_output_dir))
         print(f"Outputs saved in {pdf_output_dir}")
-        return
+        return results
+
     # handling single images
+    image = Image.open(input_path).convert("RGB")
+    return [ocr_image(image, base_name, output_dir=output_dir)]
+
+
+def main():
+    import argparse
+    from profiling import profiled
+
+    parser = argparse.ArgumentParser(description="OCR a DICOM, PDF or image file into ocr_output")
+    parser.add_argument("input_file")
+    parser.add_argument("--profile", nargs="?", const="profiles", metavar="DIR",
+                        help="write a flame graph and tracemalloc top allocations here (see profiling.py)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="OCR the pages of a PDF in this many processes, e.g. the number of cores")
+    args = parser.parse_args()
+
     try:
-        image = Image.open(input_path).convert("RGB")
+        base_name = os.path.splitext(os.path.basename(args.input_file))[0]
+        with profiled("ocr", base_name, args.profile):
+            ocr_file(args.input_file, workers=args.workers)
     except Exception as e:
         print(f"Error: {e}")
         sys.exit(1)
 
-    ocr_image(image, base_name)
-
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the pipeline modules import each other by sibling name, as when run from model-testing/transformer
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
@@ -0,0 +1,88 @@
+import random
+
+import pytest
+from presidio_analyzer import RecognizerResult
+
+from clinical_filter import ClinicalDataFilter
+
+resolve = ClinicalDataFilter.resolve_overlaps
+
+
+def spans(results):
+    return [(r.entity_type, r.start, r.end) for r in results]
+
+
+def assert_no_partial_overlaps(results):
+    for a in results:
+        for b in results:
+            if a is b or a.end <= b.start or b.end <= a.start:
+                continue
+            nested = (a.start <= b.start and b.end <= a.end) or (b.start <= a.start and a.end <= b.end)
+            assert nested, f"{a} partially overlaps {b}"
+
+
+def test_exact_duplicates_keep_highest_priority():
+    results = [RecognizerResult("DATE_TIME", 0, 5, 0.9), RecognizerResult("ZIPCODE", 0, 5, 0.5)]
+    assert spans(resolve("", results)) == [("ZIPCODE", 0, 5)]
+
+
+def test_equal_priority_duplicates_keep_the_first_reported():
+    results = [RecognizerResult("PHONE_NUMBER", 0, 5, 0.5), RecognizerResult("EMAIL_ADDRESS", 0, 5, 0.9)]
+    assert spans(resolve("", results)) == [("PHONE_NUMBER", 0, 5)]
+
+
+def test_nesting():
+    results = [
+        RecognizerResult("ADDRESS", 0, 30, 0.8),
+        # dropped: a nested type inside a container
+        RecognizerResult("LOCATION", 10, 16, 0.9),
+        RecognizerResult("ZIPCODE", 24, 29, 0.9),
+        # kept: not a nested type
+        RecognizerResult("PHONE_NUMBER", 2, 8, 0.9),
+        # kept: LOCATION is not a container
+        RecognizerResult("LOCATION", 40, 60, 0.9),
+        RecognizerResult("DATE_TIME", 45, 50, 0.9),
+    ]
+    assert spans(resolve("", results)) == [("ADDRESS", 0, 30), ("PHONE_NUMBER", 2, 8),
+                                           ("LOCATION", 40, 60), ("DATE_TIME", 45, 50)]
+
+
+def test_partial_overlap_trims_the_lower_rank():
+    results = [RecognizerResult("LOCATION", 0, 10, 0.9), RecognizerResult("PERSON", 6, 15, 0.5)]
+    assert spans(resolve("", results)) == [("LOCATION", 0, 6), ("PERSON", 6, 15)]
+
+
+def test_equal_rank_partial_overlap_trims_the_later_one():
+    results = [RecognizerResult("PERSON", 0, 10, 0.5), RecognizerResult("PERSON", 5, 15, 0.5)]
+    assert spans(resolve("", results)) == [("PERSON", 0, 10), ("PERSON", 10, 15)]
+
+
+def test_chain():
+    results = [RecognizerResult("DATE_TIME", 0, 6, 0.5), RecognizerResult("LOCATION", 4, 10, 0.5),
+               RecognizerResult("PERSON", 8, 14, 0.5), RecognizerResult("ADDRESS", 12, 18, 0.5)]
+    assert spans(resolve("", results)) == [("DATE_TIME", 0, 4), ("LOCATION", 4, 8), ("PERSON", 8, 12),
+                                           ("ADDRESS", 12, 18)]
+
+
+def test_trim_that_turns_nesting_into_partial_overlap():
+    results = [RecognizerResult("ADDRESS", 4, 11, 0.5), RecognizerResult("PERSON", 7, 14, 0.5), RecognizerResult("LOCATION", 3, 13, 0.5)]
+    out = resolve("", results)
+    assert_no_partial_overlaps(out)
+    assert spans(out) == [("LOCATION", 3, 4), ("ADDRESS", 4, 11), ("PERSON", 11, 14)]
+
+
+TYPES = list(ClinicalDataFilter.ENTITY_PRIORITY) + ["OTHER"]
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_random_results_leave_no_partial_overlaps_or_gaps(seed):
+    rng = random.Random(seed)
+    results = []
+    for _ in range(rng.randrange(1, 10)):
+        start = rng.randrange(40)
+        results.append(RecognizerResult(rng.choice(TYPES), start, start + rng.randrange(1, 15), rng.choice([0.5, 0.9])))
+    out = resolve("", results)
+    assert_no_partial_overlaps(out)
+    covered = lambda rs: {i for r in rs for i in range(r.start, r.end)}
+    # the only results dropped outright are nested inside another, so nothing detected is lost
+    assert covered(out) == covered(results)
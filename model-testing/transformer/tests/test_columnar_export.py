@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from columnar_export import ColumnarWriter, read_table, table_path, to_rows
+
+
+def document_rows(i, base=0):
+    text = f"Patient {i} seen by Dr X{i} at clinic {i % 3}."
+    start = text.index(f"X{i}")
+    end = start + len(f"X{i}")
+    row = {"entity_type": "PERSON" if i % 2 else "DOCTOR", "start": base + start, "end": base + end, "score": 0.5,
+           "text": text[start:end], "left_context": text[:start], "right_context": text[end:],
+           # every document brings a new surrogate
+           "replacement": f"Surrogate {i}"}
+    return [row]
+
+
+@pytest.mark.parametrize("fmt", ["arrow", "parquet"])
+def test_round_trip_across_dictionary_resets(tmp_path, fmt):
+    out = str(tmp_path)
+    expected = []
+    with ColumnarWriter(out, fmt, batch_rows=4, max_dictionary=8) as writer:
+        for i in range(50):
+            rows = document_rows(i)
+            writer.add(rows, case=f"case{i % 2}", doc_id=i, pass_name="second")
+            expected += rows
+    if fmt == "arrow":
+        # the surrogates outgrew max_dictionary several times
+        assert os.path.exists(table_path(out, "detections", "arrow", 3))
+
+    documents, detections = read_table(out, "documents"), read_table(out, "detections")
+    assert to_rows(detections, documents) == expected
+    assert documents.column("case").to_pylist() == [f"case{i % 2}" for i in range(50)]
+
+
+def test_offsets_past_two_gigabytes(tmp_path):
+    out = str(tmp_path)
+    rows = document_rows(1, base=3 << 30)
+    with ColumnarWriter(out) as writer:
+        writer.add(rows)
+    assert read_table(out, "detections").column("start").to_pylist() == [rows[0]["start"]]
+
+
+def test_new_export_drops_old_parts(tmp_path):
+    out = str(tmp_path)
+    with ColumnarWriter(out, batch_rows=1, max_dictionary=1) as writer:
+        for i in range(5):
+            writer.add(document_rows(i))
+    with ColumnarWriter(out) as writer:
+        writer.add(document_rows(7))
+    assert [row["replacement"] for row in to_rows(read_table(out, "detections"), read_table(out, "documents"))] \
+        == ["Surrogate 7"]
@@ -0,0 +1,35 @@
+import random
+
+import pytest
+from faker import Faker
+
+from context_anonymizer import ContextAwareAnonymizer
+from span_record import SpanRecord
+
+
+def test_partial_overlap_tail_is_replaced():
+    text = "Seen at Boston 12 Main Street yesterday"
+    results = [SpanRecord("LOCATION", 8, 17, 0.8), SpanRecord("ADDRESS", 15, 29, 0.9)]
+    Faker.seed(0)
+    out = ContextAwareAnonymizer().anonymize(text, results)
+    assert out.startswith("Seen at ") and out.endswith(" yesterday")
+    assert "Boston" not in out and "Main Street" not in out
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_no_detected_character_survives(seed):
+    # chained, nested and partial overlaps; "#" marks detected characters, "." the rest
+    rng = random.Random(seed)
+    results = []
+    for _ in range(rng.randrange(1, 12)):
+        start = rng.randrange(60)
+        results.append(SpanRecord("OTHER", start, start + rng.randrange(1, 15), 0.5))
+    chars = ["."] * 80
+    for r in results:
+        chars[r.start:r.end] = "#" * (r.end - r.start)
+    text = "".join(chars)
+
+    out = ContextAwareAnonymizer().anonymize(text, results)
+    assert "#" not in out
+    # everything outside the detections is kept, in order
+    assert out.replace("*", "") == text.replace("#", "")
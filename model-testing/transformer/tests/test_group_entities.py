@@ -0,0 +1,136 @@
+import random
+
+from rapidfuzz import fuzz
+
+from group_entities import NameGroupIndex, _normalize, group_names
+
+FIRST = ["John", "Jon", "Jonathan", "Mary", "Marie", "Anne", "Ann", "Robert", "Bob", "Li"]
+LAST = ["Smith", "Smyth", "Lee", "Leigh", "McKinley", "McKinly", "Patel", "Nguyen"]
+
+
+def mention(rng):
+    roll = rng.random()
+    if roll < 0.3:
+        return rng.choice(LAST)
+    if roll < 0.5:
+        return f"{rng.choice(FIRST)[0]}. {rng.choice(LAST)}"
+    name = f"{rng.choice(FIRST)} {rng.choice(LAST)}"
+    return name.upper() if roll > 0.9 else name
+
+
+def brute_force_groups(entities, score_cutoff):
+    """ group_names by pairwise fuzz.WRatio and a plain flood fill """
+    name_to_entity = {}
+    for entity in entities:
+        name_to_entity[_normalize(entity)] = entity
+    names = list(name_to_entity)
+    label = list(range(len(names)))
+    changed = True
+    while changed:
+        changed = False
+        for i in range(len(names)):
+            for j in range(i + 1, len(names)):
+                if label[i] != label[j] and fuzz.WRatio(names[i], names[j], score_cutoff=score_cutoff) > 0:
+                    label[i] = label[j] = min(label[i], label[j])
+                    changed = True
+    groups = {}
+    for name, root in zip(names, label):
+        groups.setdefault(root, set()).add(name_to_entity[name])
+    return list(groups.values())
+
+
+def test_group_names_matches_pairwise_wratio():
+    rng = random.Random(11)
+    entities = [mention(rng) for _ in range(300)] + [f"Patient{i} Case{rng.randrange(30)}" for i in range(300)]
+    for score_cutoff in (60, 85, 90, 95):
+        assert group_names(entities, score_cutoff=score_cutoff) == brute_force_groups(entities, score_cutoff)
+
+
+def test_group_names_fractional_cutoff():
+    rng = random.Random(11)
+    entities = [mention(rng) for _ in range(300)] + [f"Patient{i} Case{rng.randrange(30)}" for i in range(300)]
+    for score_cutoff in (85.5, 90.5, 95.5):
+        assert group_names(entities, score_cutoff=score_cutoff) == brute_force_groups(entities, score_cutoff)
+    # a pair scoring between floor(cutoff) and cutoff stays apart
+    score = fuzz.WRatio(_normalize("Jonathan Smith"), _normalize("Jon Smyth"))
+    assert score % 1
+    assert len(group_names(["Jonathan Smith", "Jon Smyth"], score_cutoff=score + 0.01)) == 2
+    assert len(group_names(["Jonathan Smith", "Jon Smyth"], score_cutoff=score)) == 1
+
+
+def test_saved_index_reopens_with_same_groups(tmp_path):
+    rng = random.Random(3)
+    path = tmp_path / "name_groups.json"
+    index = NameGroupIndex.open(path)
+    for _ in range(20):
+        index.add([mention(rng) for _ in range(5)])
+        index.save()
+        reopened = NameGroupIndex.open(path)
+        assert reopened.groups() == index.groups()
+        assert reopened.canonical_map() == index.canonical_map()
+
+
+def test_canonical_is_first_spelling_seen():
+    index = NameGroupIndex()
+    assert index.canonical("J. Smith") == "j. smith"
+    index.add(["John Smith", "Mary Lee"])
+    index.add(["J. Smith", "JOHN SMITH"])
+    assert index.canonical("J. Smith") == "john smith"
+    assert index.canonical("john smith") == "john smith"
+    assert index.canonical("Mary Lee") == "mary lee"
+    assert len(index.groups()) == 2
+
+
+def test_add_returns_every_changed_spelling(tmp_path):
+    rng = random.Random(3)
+    index = NameGroupIndex()
+    name_map = index.canonical_map()
+    for page in range(60):
+        name_map.update(index.add([mention(rng) for _ in range(rng.randrange(0, 6))]))
+        assert name_map == index.canonical_map()
+        if page == 30:
+            # reopened from disk, the index keeps reporting changes
+            path = tmp_path / "name_groups.json"
+            index.save(path)
+            index = NameGroupIndex.open(path)
+            assert index.canonical_map() == name_map
+
+
+def test_add_reports_merged_group():
+    index = NameGroupIndex()
+    assert index.add(["John Smith"]) == {"john smith": "john smith"}
+    assert index.add(["John Smith"]) == {}
+    changed = index.add(["Mary Lee", "J. Smith"])
+    assert changed["mary lee"] == "mary lee"
+    assert changed["j. smith"] == "john smith"
+
+
+def test_save_appends_to_journal_and_compacts(tmp_path):
+    rng = random.Random(5)
+    path = tmp_path / "name_groups.json"
+    index = NameGroupIndex.open(path)
+    rewrites = []
+    write = index._write
+    index._write = lambda p: (rewrites.append(p), write(p))
+    for doc in range(80):
+        # a few new people per document
+        index.add([mention(rng) for _ in range(3)] + [f"Patient{doc} Case{rng.randrange(40)}"])
+        index.save()
+        reopened = NameGroupIndex.open(path)
+        assert reopened.canonical_map() == index.canonical_map()
+        assert reopened.groups() == index.groups()
+    # the index file is rewritten each time the journal doubles it, the other saves append
+    assert 1 < len(rewrites) < 12
+    assert (tmp_path / "name_groups.json.log").exists() or index._journaled == 0
+
+
+def test_journal_with_partial_last_line(tmp_path):
+    path = tmp_path / "name_groups.json"
+    index = NameGroupIndex.open(path)
+    index.add(["John Smith", "Mary Lee"])
+    index.save()
+    index.add(["J. Smith"])
+    index.save()
+    with open(f"{path}.log", "a", encoding="utf-8") as f:
+        f.write('["Robert Pat')
+    assert NameGroupIndex.open(path).canonical_map() == index.canonical_map()
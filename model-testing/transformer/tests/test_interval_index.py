@@ -0,0 +1,172 @@
+import random
+
+import pytest
+
+from interval_index import IntervalIndex
+from match_results import link_tokens
+from span_record import SpanRecord
+from dep.span import Span, merge_spans
+
+
+def random_spans(rng, n, length=1000):
+    spans = []
+    for _ in range(n):
+        start = rng.randrange(length)
+        # mostly short spans, some page-wide ones
+        size = rng.randrange(1, 400) if rng.random() < 0.05 else rng.randrange(1, 12)
+        spans.append((start, start + size))
+    return spans
+
+
+def brute(index, keep):
+    return [i for i, (start, end, alive) in enumerate(zip(index.starts, index.ends, index.alive))
+            if alive and keep(start, end)]
+
+
+def check_queries(index, rng, queries=300, length=1000):
+    for _ in range(queries):
+        start = rng.randrange(-5, length + 5)
+        end = start + rng.randrange(0, 30)
+        assert index.overlapping(start, end) == brute(index, lambda s, e: s < end and e > start)
+        assert index.stabbing(start) == brute(index, lambda s, e: s <= start < e)
+        assert index.enclosing(start, end) == brute(index, lambda s, e: s <= start and e >= end)
+
+
+@pytest.fixture(params=[IntervalIndex.SCAN, 0], ids=["default", "tree only"])
+def scan(request):
+    return request.param
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_queries_match_brute_force(seed, scan):
+    rng = random.Random(seed)
+    index = IntervalIndex.from_spans(random_spans(rng, 500), key=lambda s: s)
+    index.SCAN = scan
+    check_queries(index, rng)
+
+    for i in rng.sample(range(len(index)), 200):
+        index.discard(i)
+    check_queries(index, rng)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_append_and_discard_while_querying(seed, scan):
+    # the sweeps' usage: grow the index in start order, query and discard as it grows
+    rng = random.Random(seed)
+    index = IntervalIndex()
+    index.SCAN = scan
+    for start, end in sorted(random_spans(rng, 300)):
+        index.append(start, end, (start, end))
+        if rng.random() < 0.3:
+            index.discard(rng.randrange(len(index)))
+        if rng.random() < 0.1:
+            check_queries(index, rng, queries=20)
+    check_queries(index, rng)
+
+
+def test_from_spans_orders_containers_first():
+    index = IntervalIndex.from_spans([(5, 6), (5, 9), (0, 3)], key=lambda s: s)
+    assert [value for _, _, value in index] == [(0, 3), (5, 9), (5, 6)]
+
+
+def test_append_out_of_order():
+    index = IntervalIndex()
+    index.append(10, 12)
+    with pytest.raises(ValueError):
+        index.append(9, 20)
+
+
+def test_discard_is_idempotent():
+    index = IntervalIndex.from_spans([(0, 100), (10, 20)], key=lambda s: s)
+    index.discard(0)
+    index.discard(0)
+    assert index.stabbing(15) == [1]
+    assert list(index) == [(10, 20, (10, 20))]
+
+
+# --- code that depends on the index ---
+
+def words_of(text):
+    tokens, pos = [], 0
+    for word in text.split(" "):
+        tokens.append({"text": word, "char_start": pos, "char_end": pos + len(word)})
+        pos += len(word) + 1
+    return tokens
+
+
+def test_link_tokens():
+    text = "Seen by John Smith at Mercy General Hospital on 03/14/1962 today"
+    tokens = words_of(text)
+    entities = IntervalIndex.from_spans([
+        SpanRecord("PERSON", 8, 18, 0.9, "Ann Lee"),
+        SpanRecord("ORGANIZATION", 22, 44, 0.8, "<ORG>"),
+        # nested in the organization: its words keep the organization's replacement
+        SpanRecord("LOCATION", 28, 35, 0.7, "<LOC>"),
+        SpanRecord("DATE_TIME", 48, 58, 0.9, "04/01/1963"),
+    ])
+    replacements = [token.get("replacement") for token in link_tokens(entities, tokens)]
+    assert replacements == [None, None, "Ann Lee", "", None, "<ORG>", "", "", None, "04/01/1963", None]
+
+
+def test_link_tokens_with_page_wide_span_matches_brute_force():
+    rng = random.Random(7)
+    text = " ".join("w" * rng.randrange(1, 9) for _ in range(400))
+    records = [SpanRecord("ORGANIZATION", 0, len(text), 0.5, "<PAGE>")]
+    for start, end in random_spans(rng, 60, length=len(text)):
+        records.append(SpanRecord("PERSON", start, min(end, len(text)), 0.9, f"<{start}>"))
+    tokens = link_tokens(IntervalIndex.from_spans(records), words_of(text))
+
+    ordered = sorted(records, key=lambda r: (r.start, -r.end))
+    for token in tokens:
+        hits = [r for r in ordered if r.start < token["char_end"] and r.end > token["char_start"]]
+        expected = hits[0].replacement if token["char_start"] <= hits[0].start < token["char_end"] else ""
+        assert token["replacement"] == expected
+
+
+def reference_merge(spans_a, spans_b):
+    """ The linear-scan merge_spans the index replaced """
+    merged = []
+    for s in sorted(spans_a + spans_b, key=lambda s: (s.start, -s.length, -s.score)):
+        for m in merged:
+            if not (s.end <= m.start or s.start >= m.end):
+                winner = (s if s.length > m.length else m) if s.length != m.length else (s if s.score > m.score else m)
+                if winner is s:
+                    merged.remove(m)
+                    merged.append(s)
+                break
+        else:
+            merged.append(s)
+    return sorted(merged, key=lambda s: (s.start, s.end))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_merge_spans_matches_linear_scan(seed):
+    rng = random.Random(seed)
+    spans_a, spans_b = [], []
+    for source, spans in (("presidio", spans_a), ("stanford", spans_b)):
+        for start, end in random_spans(rng, 80):
+            spans.append(Span(start, end, end - start, "PERSON", rng.random(), source))
+    key = lambda s: (s.start, s.end, s.source)
+    assert list(map(key, merge_spans(spans_a, spans_b))) == list(map(key, reference_merge(spans_a, spans_b)))
+
+
+def test_anonymize_splices_outermost_results_only():
+    from presidio_analyzer import RecognizerResult
+    from context_anonymizer import ContextAwareAnonymizer
+
+    text = "SSN 123-45-6789 and MRN 00077219 plus code ZX-99 end"
+    results = [
+        RecognizerResult("US_SSN", 4, 15, 0.9),
+        # inside the SSN: gets a replacement but is not spliced into it
+        RecognizerResult("OTHER", 8, 10, 0.5),
+        RecognizerResult("MRN", 20, 32, 0.9),
+        RecognizerResult("OTHER", 43, 48, 0.5),
+        # overlaps the previous one from the right: only its uncovered tail " end" is replaced
+        RecognizerResult("OTHER", 46, 52, 0.5),
+    ]
+    anonymizer = ContextAwareAnonymizer()
+    out = anonymizer.anonymize(text, list(reversed(results)))
+    assert out.startswith("SSN XXX-XX-XXXX and MRN ")
+    assert out.endswith(" plus code * *")
+    mrn = out[len("SSN XXX-XX-XXXX and MRN "):-len(" plus code * *")]
+    assert len(mrn) == len("00077219") and mrn.isdigit()
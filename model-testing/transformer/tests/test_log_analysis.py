@@ -0,0 +1,60 @@
+import json
+import os
+
+from presidio_analyzer import RecognizerResult
+
+from case_store import CaseStore
+from log_analysis import _write_records, iter_rows, write_json
+from run_log import CASE_INDEX_NAME, RunLog, find_record
+from span_record import SpanRecord, to_records
+
+
+TEXT = "Seen by John Smith on 03/14/1962 at Mercy General"
+
+
+def test_write_json_matches_json_dumps(tmp_path):
+    results = [RecognizerResult("PERSON", 8, 18, 0.85), RecognizerResult("DATE_TIME", 22, 32, 0.6)]
+    path = tmp_path / "results.json"
+    write_json(path, iter_rows(TEXT, results, {"John Smith": "Ann Lee"}, window=10))
+    write_json(path, iter_rows(TEXT, [], window=10))
+    expected = list(iter_rows(TEXT, results, {"John Smith": "Ann Lee"}, window=10))
+    assert path.read_text(encoding="utf-8") == json.dumps(expected, ensure_ascii=False) + "\n[]\n"
+    assert [row["replacement"] for row in expected] == ["Ann Lee", ""]
+    assert (expected[0]["left_context"], expected[0]["right_context"]) == ("Seen by ", " on 03/14/")
+
+
+def test_span_records_round_trip_rows():
+    records = to_records([RecognizerResult("PERSON", 8, 18, 0.85), SpanRecord("DATE_TIME", 22, 32, 0.6, "04/01/1963")])
+    rows = [record.to_row(TEXT) for record in records]
+    assert rows[0]["text"] == "John Smith"
+    assert [(r.entity_type, r.start, r.end, r.score, r.replacement) for r in map(SpanRecord.from_row, rows)] \
+        == [("PERSON", 8, 18, 0.85, ""), ("DATE_TIME", 22, 32, 0.6, "04/01/1963")]
+    result = records[1].to_recognizer_result()
+    assert (result.entity_type, result.start, result.end, result.score) == ("DATE_TIME", 22, 32, 0.6)
+
+
+def rows(n):
+    for i in range(n):
+        yield {"entity_type": "PERSON", "start": i, "end": i + 1, "score": 0.5, "text": "x",
+               "left_context": "", "right_context": "", "replacement": "y"}
+
+
+def test_write_records_streams_rows_to_run_log_and_store(tmp_path):
+    logs = str(tmp_path)
+    store = CaseStore(":memory:")
+    doc_id = store.add_document("c")
+    with RunLog(os.path.join(logs, "c", "run_20260101_000000_1.jsonl"), case="c",
+                case_index=os.path.join(logs, CASE_INDEX_NAME)) as log:
+        _write_records("c", doc_id, "second", "text", rows(3), "en", [], [], None, log, store)
+        _write_records("c", doc_id + 1, "second", "none", rows(0), "en", [], [], None, log, None)
+
+    record = find_record("c", doc_id, "second", logs)
+    assert record["results"] == list(rows(3))
+    assert list(record)[-1] == "results"
+    assert find_record("c", doc_id + 1, "second", logs)["results"] == []
+    stored = store.get_pass(doc_id, "second")
+    assert stored["results"] == list(rows(3))
+    assert store._query("SELECT entity_count FROM passes") == [{"entity_count": 3}]
+    with open(os.path.join(logs, "c", "run_20260101_000000_1.jsonl"), encoding="utf-8") as f:
+        for line in f:
+            json.loads(line)
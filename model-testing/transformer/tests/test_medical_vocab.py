@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+from medical_vocab import INDEX_SUFFIX, FingerprintSet, MedicalVocabulary
+
+
+@pytest.fixture
+def vocab_path(tmp_path):
+    path = tmp_path / "vocab.txt"
+    path.write_text("\n".join(f"term{i}" for i in range(1000)) + "\n# comment\nAspirin\n")
+    return str(path)
+
+
+def test_index_is_written_and_reused(vocab_path):
+    vocab = MedicalVocabulary(vocab_path)
+    assert "aspirin" in vocab and "term999" in vocab and "comment" not in vocab
+    # no temporary file is left next to the index
+    assert sorted(os.listdir(os.path.dirname(vocab_path))) == ["vocab.txt", "vocab.txt" + INDEX_SUFFIX]
+    assert len(FingerprintSet.load(vocab_path + INDEX_SUFFIX)) == len(vocab)
+
+
+@pytest.mark.parametrize("damage", [
+    lambda data: data[: len(data) // 2],   # cut short by a concurrent writer
+    lambda data: data[24:],                # headerless slots of an older build
+    lambda data: data[:24],                # header only
+    lambda data: b"",
+])
+def test_invalid_index_is_rebuilt(vocab_path, damage):
+    index_path = vocab_path + INDEX_SUFFIX
+    expected = len(MedicalVocabulary(vocab_path))
+    with open(index_path, "rb") as f:
+        data = f.read()
+    with open(index_path, "wb") as f:
+        f.write(damage(data))
+    with pytest.raises(ValueError):
+        FingerprintSet.load(index_path)
+
+    vocab = MedicalVocabulary(vocab_path)
+    assert len(vocab) == expected and "term5" in vocab
+    with open(index_path, "rb") as f:
+        assert f.read() == data
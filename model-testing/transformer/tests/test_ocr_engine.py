@@ -0,0 +1,62 @@
+import pytest
+import pytesseract
+from PIL import Image, ImageDraw, ImageFont
+
+import ocr_engine
+
+TSV = ("1\t1\t0\t0\t0\t0\t0\t0\t600\t120\t-1\t\n"
+       "4\t1\t1\t1\t1\t0\t20\t30\t410\t52\t-1\t\n"
+       "5\t1\t1\t1\t1\t1\t20\t30\t190\t52\t96.312744\tPatient\n"
+       "5\t1\t1\t1\t1\t2\t230\t31\t200\t51\t91.5\tSmith\n"
+       "5\t1\t1\t1\t1\t3\t440\t31\t4\t51\t-1\t\n")
+
+
+def test_tsv_to_dict():
+    data = ocr_engine.tsv_to_dict(TSV)
+    assert data["text"] == ["", "", "Patient", "Smith", ""]
+    assert data["conf"] == [-1, -1, 96, 91, -1]
+    assert data["left"] == [0, 20, 20, 230, 440]
+    assert data["level"] == [1, 4, 5, 5, 5]
+    assert data["word_num"] == [0, 0, 1, 2, 3]
+    assert list(data) == list(ocr_engine.TSV_COLUMNS)
+
+
+def test_tsv_to_dict_matches_pytesseract_parsing():
+    header = "\t".join(ocr_engine.TSV_COLUMNS) + "\n"
+    expected = pytesseract.pytesseract.file_to_dict(header + TSV, "\t", -1)
+    assert ocr_engine.tsv_to_dict(TSV) == expected
+
+
+def _tesseract_installed():
+    try:
+        pytesseract.get_tesseract_version()
+        return True
+    except (pytesseract.TesseractNotFoundError, OSError):
+        return False
+
+
+def _page():
+    image = Image.new("RGB", (900, 160), "white")
+    draw = ImageDraw.Draw(image)
+    draw.text((30, 40), "Patient John Smith 03/14/1962", fill="black", font=ImageFont.load_default(size=48))
+    return image
+
+
+def _words(data):
+    return [(data["text"][i], data["left"][i], data["top"][i], data["width"][i], data["height"][i])
+            for i in range(len(data["text"])) if data["level"][i] == 5 and data["text"][i].strip()]
+
+
+@pytest.mark.parametrize("engine", ocr_engine.ENGINES)
+def test_engine_matches_pytesseract(engine):
+    if not _tesseract_installed():
+        pytest.skip("tesseract is not installed")
+    if engine == "tesserocr" and ocr_engine._tesserocr() is None:
+        pytest.skip("tesserocr is not installed")
+    image = _page()
+    expected = pytesseract.image_to_data(image, lang="eng", output_type=pytesseract.Output.DICT, config="--psm 6")
+    data = ocr_engine.image_to_data(image, psm=6, engine=engine)
+    assert list(data) == list(expected)
+    # confidences may differ in the last digits between a linked and the installed Tesseract
+    assert _words(data) == _words(expected)
+    assert "Smith" in [word[0] for word in _words(data)]
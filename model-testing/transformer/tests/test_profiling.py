@@ -0,0 +1,75 @@
+import os
+import json
+import time
+
+from profiling import profiled
+
+
+def transient_peak():
+    block = [bytearray(1024) for _ in range(6 * 1024)]
+    time.sleep(0.05)
+    del block
+
+
+def busy(seconds):
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < seconds:
+        sum(range(1000))
+
+
+def sections(path):
+    """ title -> its lines """
+    out, title = {}, None
+    with open(path, encoding="utf-8") as f:
+        for line in f.read().splitlines()[1:]:
+            if not line:
+                title = None
+            elif title is None:
+                title = line
+                out[title] = []
+            else:
+                out[title].append(line)
+    return out
+
+
+def test_transient_peak_is_attributed(tmp_path):
+    with profiled("case", 1, str(tmp_path), interval=0.002) as profile:
+        transient_peak()
+        kept = [str(i) * 3 for i in range(20000)]
+    assert kept
+    alloc = next(path for path in profile.paths if path.endswith(".alloc.txt"))
+    report = sections(alloc)
+
+    peak_sites = next(lines for title, lines in report.items() if title.startswith("at the peak") and "sites" in title)
+    assert "block = [bytearray" in peak_sites[0]
+    end_sites = report["still allocated at the end, top allocation sites"]
+    assert "kept = [str(i)" in end_sites[0]
+    # nothing from the profiler or the sampler thread it started
+    for lines in report.values():
+        assert not any(" profiling.py:" in line or "threading.py" in line for line in lines)
+
+
+def test_profile_files(tmp_path):
+    with profiled("case", "notes/1.txt", str(tmp_path), interval=0.002) as profile:
+        busy(0.05)
+        kept = [str(i) * 3 for i in range(20000)]
+    assert kept
+    base = os.path.join(str(tmp_path), "case_notes_1.txt")
+    assert profile.paths == [base + ".collapsed", base + ".speedscope.json", base + ".alloc.txt"]
+    with open(base + ".collapsed", encoding="utf-8") as f:
+        assert any("busy (test_profiling.py:" in line for line in f)
+    with open(base + ".speedscope.json", encoding="utf-8") as f:
+        samples = json.load(f)["profiles"][0]
+    assert samples["samples"] and len(samples["samples"]) == len(samples["weights"])
+    with open(base + ".alloc.txt", encoding="utf-8") as f:
+        assert "kept = [str(i)" in f.read()
+
+
+def test_nested_and_disabled_profiles_write_nothing(tmp_path):
+    with profiled("case", 1, None):
+        busy(0.01)
+    with profiled("case", 1, str(tmp_path)) as outer:
+        with profiled("case", 2, str(tmp_path)) as inner:
+            busy(0.01)
+    assert inner.paths == []
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(path) for path in outer.paths)
@@ -0,0 +1,80 @@
+import os
+
+import run_log
+from run_log import CASE_INDEX_NAME, RunLog, find_record, reindex_case
+
+
+def record(doc_id, pass_name, text):
+    return {"doc_id": doc_id, "pass": pass_name, "anonymized_text": text}
+
+
+def test_find_record_latest_over_runs(tmp_path):
+    logs = str(tmp_path)
+    with RunLog(os.path.join(logs, "c", "run_20260101_000000_1.jsonl"), case="c",
+                case_index=os.path.join(logs, CASE_INDEX_NAME)) as old:
+        old.append(record(1, "first", "old first"))
+        old.append(record(1, "second", "old second"))
+        old.append(record(2, "first", "two"))
+    with RunLog(os.path.join(logs, "c", "run_20260102_000000_1.jsonl"), case="c",
+                case_index=os.path.join(logs, CASE_INDEX_NAME)) as new:
+        new.append(record(1, "second", "new second"))
+        new.append(record(1, "first", "new first"))
+
+    assert find_record("c", 1, "second", logs)["anonymized_text"] == "new second"
+    assert find_record("c", 1, logs_dir=logs)["anonymized_text"] == "new first"
+    assert find_record("c", 2, logs_dir=logs)["anonymized_text"] == "two"
+    assert find_record("c", 3, logs_dir=logs) is None
+    assert find_record("other", 1, logs_dir=logs) is None
+
+
+def test_older_run_closing_late_does_not_win(tmp_path):
+    logs = str(tmp_path)
+    index = os.path.join(logs, CASE_INDEX_NAME)
+    older = RunLog(os.path.join(logs, "c", "run_20260101_000000_1.jsonl"), case="c", case_index=index)
+    with RunLog(os.path.join(logs, "c", "run_20260102_000000_2.jsonl"), case="c", case_index=index) as newer:
+        newer.append(record(1, "second", "newer"))
+    older.append(record(1, "second", "older"))
+    older.close()
+    assert find_record("c", 1, "second", logs)["anonymized_text"] == "newer"
+
+
+def test_find_record_sees_queued_records(tmp_path, monkeypatch):
+    logs = str(tmp_path)
+    monkeypatch.setattr(run_log, "_OPEN_LOGS", {})
+    log = run_log.run_log_for("c", logs)
+    try:
+        log.append(record(5, "first", "queued"))
+        assert find_record("c", 5, "first", logs)["anonymized_text"] == "queued"
+    finally:
+        log.close()
+
+
+def test_reindex_case(tmp_path):
+    logs = str(tmp_path)
+    # a run without the case index, as written before it existed
+    with RunLog(os.path.join(logs, "c", "run_20260101_000000_1.jsonl")) as log:
+        log.append(record(1, "first", "a"))
+        log.append(record(1, "first", "b"))
+    assert find_record("c", 1, logs_dir=logs) is None
+    assert reindex_case("c", logs) == 1
+    assert find_record("c", 1, "first", logs)["anonymized_text"] == "b"
+
+
+def test_find_record_reuses_read_only_connection(tmp_path, monkeypatch):
+    logs = str(tmp_path)
+    index = os.path.join(logs, CASE_INDEX_NAME)
+    monkeypatch.setattr(run_log, "_READERS", {})
+    with RunLog(os.path.join(logs, "c", "run_20260101_000000_1.jsonl"), case="c", case_index=index) as log:
+        log.append(record(1, "first", "a"))
+    # lookups neither open a writer connection nor create the schema again
+    monkeypatch.setattr(run_log, "_connect", None)
+    assert find_record("c", 1, "first", logs)["anonymized_text"] == "a"
+    reader = run_log._READERS[index]
+    monkeypatch.undo()
+    monkeypatch.setattr(run_log, "_READERS", {index: reader})
+    with RunLog(os.path.join(logs, "c", "run_20260102_000000_1.jsonl"), case="c", case_index=index) as log:
+        log.append(record(1, "first", "b"))
+    # the cached connection sees the newer run's batch
+    assert find_record("c", 1, "first", logs)["anonymized_text"] == "b"
+    assert run_log._READERS == {index: reader}
+    reader.close()
@@ -0,0 +1,65 @@
+import pytest
+from PIL import Image
+
+pymupdf = pytest.importorskip("pymupdf")
+
+import text_layer
+from configurations import PIPELINE_CONFIGURATION
+
+TYPED = "Patient: Jennifer Lee\nDOB: 05/06/1994\nMRN: 00077219\nSeen in clinic for follow-up."
+
+
+def _png(width, height, color):
+    pix = pymupdf.Pixmap(pymupdf.csRGB, pymupdf.IRect(0, 0, width, height), False)
+    pix.set_rect(pix.irect, color)
+    return pix.tobytes("png")
+
+
+@pytest.fixture
+def pdf(tmp_path):
+    doc = pymupdf.open()
+    # 1: typed only
+    doc.new_page().insert_text((72, 72), TYPED)
+    # 2: typed with a stamped MRN / ID card picture (its text is not in the text layer)
+    page = doc.new_page()
+    page.insert_text((72, 72), TYPED)
+    page.insert_image(pymupdf.Rect(72, 300, 272, 380), stream=_png(400, 160, (230, 230, 230)))
+    # 3: typed with a horizontal rule drawn as a 1 pt image
+    page = doc.new_page()
+    page.insert_text((72, 72), TYPED)
+    page.insert_image(pymupdf.Rect(72, 200, 540, 201), stream=_png(400, 2, (0, 0, 0)))
+    # 4: scan only
+    doc.new_page().insert_image(pymupdf.Rect(0, 0, 612, 792), stream=_png(300, 400, (255, 255, 255)))
+    path = str(tmp_path / "mixed.pdf")
+    doc.save(path)
+    return path
+
+
+def test_page_words_layout(pdf):
+    with pymupdf.open(pdf) as doc:
+        data = text_layer.page_words(doc[0], dpi=300)
+    assert data["text"][:3] == ["Patient:", "Jennifer", "Lee"]
+    # boxes at 300 dpi: x = 72 pt -> 300 px
+    assert data["left"][0] == 300
+    assert set(data["conf"]) == {100.0}
+    assert data["line_num"][:4] == [1, 1, 1, 2]
+
+
+def test_pages_with_images_are_ocrd(pdf):
+    layers = text_layer.pdf_words(pdf)
+    assert [words is not None for words in layers] == [True, False, True, False]
+
+
+def test_iter_pdf_content_renders_only_image_pages(pdf):
+    pages = list(text_layer.iter_pdf_content(pdf, dpi=72))
+    assert [page_num for page_num, _, _ in pages] == [1, 2, 3, 4]
+    for page_num, words, image in pages:
+        assert (words is None) == (page_num in (2, 4))
+        assert (image is None) == (words is not None)
+        if image is not None:
+            assert isinstance(image, Image.Image) and image.size == (595, 842)  # A4 at 72 dpi
+
+
+def test_disabled(pdf, monkeypatch):
+    monkeypatch.setitem(PIPELINE_CONFIGURATION, "PDF_TEXT_LAYER", False)
+    assert text_layer.pdf_words(pdf) == [None] * 4
@@ -0,0 +1,102 @@
+import unicodedata
+
+from configurations import PIPELINE_CONFIGURATION
+from pdf_pages import _pymupdf, iter_pdf_pages, pdf_info
+
+# Words of a PDF page from its embedded text layer, for born-digital PDFs (and scans that
+# already carry an OCR layer), instead of rasterizing and running Tesseract.
+#
+# page_words() returns the words in pytesseract's image_to_data dict layout, with boxes
+# scaled to the pixels of the page rasterized at `dpi`, so tesseract_test.save_page builds
+# the same {"full_text", "tokens"} JSON from either and linking/rendering (which draw on
+# the 300 dpi raster) need no changes. Needs PyMuPDF; without it every page is OCR'd.
+#
+# A text layer is used when the page has at least MIN_WORDS words, few unmappable
+# characters, and no images. Text in an image (a scanned ID card, a signature, a stamped
+# MRN on an otherwise typed page) is not in the text layer, so a page with any image
+# larger than a rule or a dot is OCR'd whole; its PHI would otherwise never be detected.
+
+MIN_WORDS = 3
+# share of characters that may be U+FFFD or control/private-use (fonts without a ToUnicode map)
+MAX_BAD_CHARS = 0.1
+# images thinner than this (points) in either direction are rules, borders or dots: no text
+MIN_IMAGE_SIDE = 6
+
+
+def _usable(page, words):
+    if len(words) < MIN_WORDS:
+        return False
+    text = "".join(word[4] for word in words)
+    bad = sum(ch == "\ufffd" or unicodedata.category(ch) in ("Cc", "Co", "Cn") for ch in text)
+    if bad > MAX_BAD_CHARS * len(text):
+        return False
+    return not any(_has_text_room(page.rect & _rect(info["bbox"])) for info in page.get_image_info())
+
+
+def _has_text_room(rect):
+    return rect.width >= MIN_IMAGE_SIDE and rect.height >= MIN_IMAGE_SIDE
+
+
+def _rect(bbox):
+    return _pymupdf().Rect(bbox)
+
+
+def page_words(page, dpi=300):
+    """ The words of a PyMuPDF page as an image_to_data dict, or None when the page has no
+    usable text layer """
+    words = page.get_text("words", sort=True)
+    if not _usable(page, words):
+        return None
+    scale = dpi / 72
+    # boxes are in unrotated page space; the raster is of the rotated page
+    matrix = page.rotation_matrix * _pymupdf().Matrix(scale, scale)
+    data = {key: [] for key in ("text", "conf", "left", "top", "width", "height",
+                                "block_num", "par_num", "line_num", "word_num")}
+    for x0, y0, x1, y1, text, block, line, word in words:
+        rect = _rect((x0, y0, x1, y1)) * matrix
+        data["text"].append(text)
+        data["conf"].append(100.0)
+        data["left"].append(round(rect.x0))
+        data["top"].append(round(rect.y0))
+        data["width"].append(round(rect.width))
+        data["height"].append(round(rect.height))
+        # 1-based like Tesseract's; PyMuPDF has no paragraphs
+        data["block_num"].append(block + 1)
+        data["par_num"].append(1)
+        data["line_num"].append(line + 1)
+        data["word_num"].append(word + 1)
+    return data
+
+
+def enabled() -> bool:
+    return PIPELINE_CONFIGURATION.get("PDF_TEXT_LAYER", True) and _pymupdf() is not None
+
+
+def pdf_words(pdf_path, dpi=300, last_page=None):
+    """ page_words for pages 1..last_page, None for each page without a usable text layer
+    (and for every page when the text layer is disabled) """
+    page_count, _ = pdf_info(pdf_path)
+    last_page = min(last_page or page_count, page_count)
+    if not enabled():
+        return [None] * last_page
+    # the word lists are small; every page is checked before any is rendered
+    with _pymupdf().open(pdf_path) as doc:
+        return [page_words(doc[i], dpi) for i in range(last_page)]
+
+
+def iter_pdf_content(pdf_path, dpi=300, threads=1, window=2, last_page=None):
+    """
+    (page_num, words, image) for every page in order: words (see page_words) for pages with
+    a usable text layer and image None, else words None and the page rasterized at dpi
+    (see pdf_pages.iter_pdf_pages; only those pages are rendered).
+    """
+    layers = pdf_words(pdf_path, dpi, last_page)
+    image_pages = [i + 1 for i, words in enumerate(layers) if words is None]
+    images = iter_pdf_pages(pdf_path, dpi=dpi, window=window, threads=threads, pages=image_pages)
+    for page_num, words in enumerate(layers, start=1):
+        if words is not None:
+            yield page_num, words, None
+        else:
+            rendered_num, image = next(images)
+            yield rendered_num, None, image
+            del image